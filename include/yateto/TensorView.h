@@ -344,6 +344,222 @@ namespace yateto {
     uint_t const* m_rowInd;
     uint_t const* m_colPtr;
   };
+
+  template<unsigned Dim, typename real_t, typename uint_t>
+  class CSFTensorView : public TensorView<Dim, real_t, uint_t> {
+  public:
+    explicit CSFTensorView(real_t* values, std::initializer_list<uint_t> shape, uint_t numRoots, uint_t const* fiberIdx, uint_t const* fiberPtr)
+      : TensorView<Dim, real_t, uint_t>(shape), m_values(values) {
+      setLevels(numRoots, fiberIdx, fiberPtr);
+    }
+
+    explicit CSFTensorView(real_t* values, uint_t const shape[], uint_t numRoots, uint_t const* fiberIdx, uint_t const* fiberPtr)
+      : TensorView<Dim, real_t, uint_t>(shape), m_values(values) {
+      setLevels(numRoots, fiberIdx, fiberPtr);
+    }
+
+    uint_t size() const {
+      return m_numNodes[Dim-1];
+    }
+
+    void setZero() {
+      memset(m_values, 0, size() * sizeof(real_t));
+    }
+
+    real_t& operator[](uint_t const entry[Dim]) {
+      uint_t begin = 0;
+      uint_t end = m_numNodes[0];
+      uint_t node = 0;
+      for (unsigned level = 0; level < Dim; ++level) {
+        uint_t index = entry[Dim-1-level];
+        node = begin;
+        while (node < end && m_fiberIdx[level][node] != index) {
+          ++node;
+        }
+        assert(node != end);
+        if (level < Dim-1) {
+          begin = m_fiberPtr[level][node];
+          end = m_fiberPtr[level][node+1];
+        }
+      }
+      return m_values[node];
+    }
+
+    template<typename... Entry>
+    real_t& operator()(Entry... entry) {
+      static_assert(sizeof...(entry) == Dim, "Number of arguments to operator() does not match Tensor's dimension.");
+      uint_t e[Dim] = {static_cast<uint_t>(entry)...};
+      return operator[](e);
+    }
+
+    template<class view_t>
+    void copyToView(view_t& other) {
+      assert(Dim == other.dim());
+      uint_t entry[Dim];
+      copyLevel(other, entry, 0, 0, m_numNodes[0]);
+    }
+
+  protected:
+    void setLevels(uint_t numRoots, uint_t const* fiberIdx, uint_t const* fiberPtr) {
+      uint_t numNodes = numRoots;
+      for (unsigned level = 0; level < Dim; ++level) {
+        m_fiberIdx[level] = fiberIdx;
+        m_numNodes[level] = numNodes;
+        fiberIdx += numNodes;
+        if (level < Dim-1) {
+          m_fiberPtr[level] = fiberPtr;
+          fiberPtr += numNodes + 1;
+          numNodes = m_fiberPtr[level][numNodes];
+        }
+      }
+    }
+
+    template<class view_t>
+    void copyLevel(view_t& other, uint_t* entry, unsigned level, uint_t begin, uint_t end) {
+      for (uint_t node = begin; node < end; ++node) {
+        entry[Dim-1-level] = m_fiberIdx[level][node];
+        if (level == Dim-1) {
+          other[entry] = m_values[node];
+        } else {
+          copyLevel(other, entry, level+1, m_fiberPtr[level][node], m_fiberPtr[level][node+1]);
+        }
+      }
+    }
+
+    real_t* m_values;
+    uint_t const* m_fiberIdx[Dim];
+    uint_t const* m_fiberPtr[Dim];
+    uint_t m_numNodes[Dim];
+  };
+
+  template<typename real_t, typename uint_t>
+  class BandedMatrixView : public TensorView<2, real_t, uint_t> {
+  public:
+    explicit BandedMatrixView(real_t* values, std::initializer_list<uint_t> shape, uint_t lower, uint_t upper)
+      : TensorView<2, real_t, uint_t>(shape), m_values(values), m_lower(lower), m_upper(upper) {
+    }
+
+    explicit BandedMatrixView(real_t* values, uint_t const shape[], uint_t lower, uint_t upper)
+      : TensorView<2, real_t, uint_t>(shape), m_values(values), m_lower(lower), m_upper(upper) {
+    }
+
+    uint_t size() const {
+      return offset(static_cast<long>(m_upper) + 1);
+    }
+
+    void setZero() {
+      memset(m_values, 0, size() * sizeof(real_t));
+    }
+
+    real_t& operator()(uint_t row, uint_t col) {
+      long d = static_cast<long>(col) - static_cast<long>(row);
+      assert(d >= -static_cast<long>(m_lower) && d <= static_cast<long>(m_upper));
+      return m_values[ offset(d) + row - start(d) ];
+    }
+
+    real_t& operator[](uint_t entry[2]) {
+      return operator()(entry[0], entry[1]);
+    }
+
+    template<class view_t>
+    void copyToView(view_t& other) {
+      assert(2 == other.dim());
+      assert(this->shape(0) == other.shape(0) && this->shape(1) == other.shape(1));
+
+      uint_t entry[2];
+      for (long d = -static_cast<long>(m_lower); d <= static_cast<long>(m_upper); ++d) {
+        for (uint_t i = 0; i < length(d); ++i) {
+          entry[0] = start(d) + i;
+          entry[1] = entry[0] + d;
+          other[entry] = m_values[offset(d) + i];
+        }
+      }
+    }
+
+  protected:
+    uint_t start(long d) const {
+      return d < 0 ? -d : 0;
+    }
+
+    uint_t length(long d) const {
+      long stop = std::min(static_cast<long>(this->shape(0)), static_cast<long>(this->shape(1)) - d);
+      return stop - static_cast<long>(start(d));
+    }
+
+    uint_t offset(long d) const {
+      uint_t o = 0;
+      for (long e = -static_cast<long>(m_lower); e < d; ++e) {
+        o += length(e);
+      }
+      return o;
+    }
+
+    real_t* m_values;
+    uint_t m_lower;
+    uint_t m_upper;
+  };
+
+  template<typename real_t, typename uint_t>
+  class BlockSparseMatrixView : public TensorView<2, real_t, uint_t> {
+  public:
+    explicit BlockSparseMatrixView(real_t* values, std::initializer_list<uint_t> shape, uint_t numBlocks, uint_t const* blockPtr, uint_t const* blockRows, uint_t const* blockCols)
+      : TensorView<2, real_t, uint_t>(shape), m_values(values), m_numBlocks(numBlocks), m_blockPtr(blockPtr), m_blockRows(blockRows), m_blockCols(blockCols) {
+    }
+
+    explicit BlockSparseMatrixView(real_t* values, uint_t const shape[], uint_t numBlocks, uint_t const* blockPtr, uint_t const* blockRows, uint_t const* blockCols)
+      : TensorView<2, real_t, uint_t>(shape), m_values(values), m_numBlocks(numBlocks), m_blockPtr(blockPtr), m_blockRows(blockRows), m_blockCols(blockCols) {
+    }
+
+    uint_t size() const {
+      return m_blockPtr[ m_numBlocks ];
+    }
+
+    void setZero() {
+      memset(m_values, 0, size() * sizeof(real_t));
+    }
+
+    real_t& operator()(uint_t row, uint_t col) {
+      uint_t block = 0;
+      while (block < m_numBlocks) {
+        if (row >= m_blockRows[2*block] && row < m_blockRows[2*block+1] &&
+            col >= m_blockCols[2*block] && col < m_blockCols[2*block+1]) {
+          break;
+        }
+        ++block;
+      }
+      assert(block != m_numBlocks);
+
+      uint_t ld = m_blockRows[2*block+1] - m_blockRows[2*block];
+      return m_values[ m_blockPtr[block] + (row - m_blockRows[2*block]) + (col - m_blockCols[2*block]) * ld ];
+    }
+
+    real_t& operator[](uint_t entry[2]) {
+      return operator()(entry[0], entry[1]);
+    }
+
+    template<class view_t>
+    void copyToView(view_t& other) {
+      assert(2 == other.dim());
+      assert(this->shape(0) == other.shape(0) && this->shape(1) == other.shape(1));
+
+      uint_t entry[2];
+      for (uint_t block = 0; block < m_numBlocks; ++block) {
+        real_t const* values = m_values + m_blockPtr[block];
+        for (entry[1] = m_blockCols[2*block]; entry[1] < m_blockCols[2*block+1]; ++entry[1]) {
+          for (entry[0] = m_blockRows[2*block]; entry[0] < m_blockRows[2*block+1]; ++entry[0]) {
+            other[entry] = *values++;
+          }
+        }
+      }
+    }
+
+  protected:
+    real_t* m_values;
+    uint_t m_numBlocks;
+    uint_t const* m_blockPtr;
+    uint_t const* m_blockRows;
+    uint_t const* m_blockCols;
+  };
 }
 
 #endif
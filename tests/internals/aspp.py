@@ -0,0 +1,94 @@
+import unittest
+import numpy as np
+from yateto import aspp
+
+
+class PackedSparsityPattern(unittest.TestCase):
+  def setUp(self):
+    self.rng = np.random.default_rng(42)
+    self.A = self.rng.random((11, 5, 3)) < 0.3
+    self.B = self.rng.random((3, 9)) < 0.3
+
+  def assertSameSpp(self, spp, npspp):
+    self.assertEqual(spp.shape, npspp.shape)
+    self.assertTrue(np.array_equal(spp.as_ndarray(), npspp))
+
+  def test_unary_operations(self):
+    spp = aspp.packed.fromNdarray(self.A)
+    reference = aspp.general(self.A)
+    self.assertEqual(spp.count_nonzero(), reference.count_nonzero())
+    self.assertEqual([(int(m), int(M)) for m, M in spp.nnzbounds()],
+                     [(int(m), int(M)) for m, M in reference.nnzbounds()])
+    self.assertSameSpp(spp.transposed((2, 0, 1)), self.A.transpose((2, 0, 1)))
+    self.assertSameSpp(spp.indexSum('ijk', 'ki'), np.einsum('ijk->ki', self.A))
+    self.assertSameSpp(spp.indexSum('ijk', 'kj'), np.einsum('ijk->kj', self.A))
+
+  def test_binary_operations(self):
+    A = aspp.packed.fromNdarray(self.A)
+    B = aspp.packed.fromNdarray(self.B)
+    self.assertSameSpp(aspp.packed.einsum('ijk,kl->lij', A, B), np.einsum('ijk,kl->lij', self.A, self.B))
+    self.assertSameSpp(aspp.packed.einsum('ijk,kl->jl', A, B), np.einsum('ijk,kl->jl', self.A, self.B))
+    self.assertSameSpp(aspp.packed.add(A, aspp.dense(self.A.shape).as_packed()), np.ones(self.A.shape, dtype=bool))
+
+  def test_dispatch(self):
+    threshold = aspp.packed.THRESHOLD
+    try:
+      aspp.packed.THRESHOLD = 0
+      spp = aspp.einsum('ijk,kl->il', aspp.general(self.A), aspp.general(self.B))
+    finally:
+      aspp.packed.THRESHOLD = threshold
+    self.assertIsInstance(spp, aspp.packed)
+    self.assertSameSpp(spp, np.einsum('ijk,kl->il', self.A, self.B))
+
+
+class BoxedSparsityPattern(unittest.TestCase):
+  def setUp(self):
+    self.A = aspp.boxed((6, 5, 4), [(1, 4), (0, 5), (2, 3)])
+    self.B = aspp.boxed((4, 7), [(0, 4), (3, 6)])
+
+  def assertSameSpp(self, spp, npspp):
+    self.assertEqual(spp.shape, npspp.shape)
+    self.assertTrue(np.array_equal(spp.as_ndarray(), npspp))
+
+  def test_unary_operations(self):
+    A = self.A.as_ndarray()
+    self.assertEqual(self.A.count_nonzero(), np.count_nonzero(A))
+    self.assertEqual(self.A.nnzbounds(), [(1, 3), (0, 4), (2, 2)])
+    for nz, reference in zip(self.A.nonzero(), A.nonzero()):
+      self.assertTrue(np.array_equal(nz, reference))
+    self.assertSameSpp(self.A.transposed((2, 0, 1)), A.transpose((2, 0, 1)))
+    self.assertSameSpp(self.A.indexSum('ijk', 'ki'), np.einsum('ijk->ki', A))
+
+  def test_binary_operations(self):
+    A = self.A.as_ndarray()
+    B = self.B.as_ndarray()
+    spp = aspp.einsum('ijk,kl->lij', self.A, self.B)
+    self.assertIsInstance(spp, aspp.boxed)
+    self.assertSameSpp(spp, np.einsum('ijk,kl->lij', A, B))
+    self.assertSameSpp(aspp.einsum('ijk,kl->jl', self.A, aspp.general(B)), np.einsum('ijk,kl->jl', A, B))
+    union = aspp.add(self.A, aspp.boxed(self.A.shape, [(0, 2), (0, 5), (2, 3)]))
+    self.assertIsInstance(union, aspp.boxed)
+    self.assertEqual(union.box, ((0, 4), (0, 5), (2, 3)))
+    other = aspp.boxed(self.A.shape, [(0, 1), (0, 1), (0, 1)])
+    self.assertSameSpp(aspp.add(self.A, other), A | other.as_ndarray())
+
+
+class SparseEinsum(unittest.TestCase):
+  def test_sparse_einsum(self):
+    rng = np.random.default_rng(7)
+    A = rng.random((9, 8, 3)) < 0.05
+    B = rng.random((8, 6)) < 0.3
+    for description in ['ijk,jl->il', 'ijk,jl->lki', 'ijk,jl->k', 'ijk,jl->']:
+      spp = aspp.general.sparseEinsum(description, aspp.general(A), aspp.general(B))
+      self.assertTrue(np.array_equal(spp.as_ndarray(), np.einsum(description, A, B)))
+
+
+class Memoization(unittest.TestCase):
+  def test_memo(self):
+    aspp.memo.clear()
+    A = np.eye(5, dtype=bool)
+    first = aspp.general(A).transposed((1, 0))
+    second = aspp.general(A.copy()).transposed((1, 0))
+    self.assertIs(first, second)
+    self.assertEqual((aspp.memo.hits, aspp.memo.misses), (1, 1))
+    self.assertNotEqual(aspp.general(A).fingerprint(), aspp.general(~A).fingerprint())
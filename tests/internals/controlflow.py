@@ -0,0 +1,27 @@
+import unittest
+from yateto import Tensor
+from yateto.ast.cost import BoundingBoxCostEstimator
+from yateto.generator import Kernel
+
+
+class CommonSubexpressions(unittest.TestCase):
+  def prepare(self, ast):
+    kernel = Kernel('kernel', ast)
+    kernel.prepareUntilUnitTest()
+    kernel.prepareUntilCodeGen(BoundingBoxCostEstimator)
+    return [pp.action for pp in kernel.cfg if pp.action]
+
+  def setUp(self):
+    self.A, self.B, self.D, self.X, self.Y = [Tensor(name, (4, 4)) for name in 'ABDXY']
+
+  def test_two_outputs(self):
+    actions = self.prepare([self.X['ij'] <= self.A['ik'] * self.B['kj'], self.Y['ij'] <= self.A['ik'] * self.B['kj']])
+    self.assertEqual(sum(action.isRHSExpression() for action in actions), 1)
+    self.assertEqual({str(action.result) for action in actions}, {'X', 'Y'})
+
+  def test_later_use(self):
+    actions = self.prepare([self.X['ij'] <= self.A['ik'] * self.B['kj'], self.Y['il'] <= self.A['ik'] * self.B['kj'] * self.D['jl']])
+    self.assertEqual(sum(action.isRHSExpression() for action in actions), 2)
+    self.assertEqual({str(action.result) for action in actions} & {'X', 'Y'}, {'X', 'Y'})
+    product = next(action.result for action in actions if action.isRHSExpression() and 'D' not in map(str, action.term.variableList()))
+    self.assertIn(product, actions[-1].term.variableList())
@@ -0,0 +1,90 @@
+import unittest
+from yateto import Tensor
+from yateto.arch import Architecture, MemoryLevel
+from yateto.ast import opt
+from yateto.ast.cost import MemoryAwareCost, MemoryAwareCostEstimator, RooflineCostEstimator
+from yateto.ast.node import Product
+from yateto.ast.transformer import DeduceIndices, EquivalentSparsityPattern
+
+
+class MemoryAwareCosts(unittest.TestCase):
+  def setUp(self):
+    # (A*B)*C needs less flops but a temporary of 2x32 values, A*(B*C) needs 4x4 values
+    A, B, C, Y = Tensor('A', (2, 4)), Tensor('B', (4, 32)), Tensor('C', (32, 4)), Tensor('Y', (2, 4))
+    ast = EquivalentSparsityPattern().visit(DeduceIndices().visit(Y['il'] <= A['ij'] * B['jk'] * C['kl']))
+    self.terms = list(ast.rightTerm())
+    self.target = ast.rightTerm().indices
+
+  def plan(self, **kwargs):
+    estimator = MemoryAwareCostEstimator(**kwargs)
+    tree = opt.strengthReduction(self.terms, self.target, estimator)
+    return estimator.estimate(tree), estimator.temporaries(tree)
+
+  def test_ordering(self):
+    self.assertLess(MemoryAwareCost(0, 1000), MemoryAwareCost(1, 0))
+    self.assertLess(MemoryAwareCost(1, 10), MemoryAwareCost(1, 20))
+    self.assertEqual(MemoryAwareCost(1, 10), MemoryAwareCost(1, 10))
+    self.assertEqual(min([MemoryAwareCost(2, 0), MemoryAwareCost(0, 5), MemoryAwareCost(0, 3)]), MemoryAwareCost(0, 3))
+    self.assertEqual(sum([MemoryAwareCost(1, 2), MemoryAwareCost(3, 4)]), MemoryAwareCost(4, 6))
+    self.assertEqual(MemoryAwareCost(4, 6) - MemoryAwareCost(3, 4), MemoryAwareCost(1, 2))
+
+  def test_cap(self):
+    cost, (largest, total) = self.plan()
+    self.assertEqual((cost.excess(), largest, total), (0, 64, 64))
+
+    # The cheapest tree whose temporaries fit is selected
+    capped, (largest, total) = self.plan(memoryCap=16 * 8)
+    self.assertEqual((capped.excess(), largest, total), (0, 16, 16))
+    self.assertGreater(capped.flops(), cost.flops())
+
+    # Temporaries of exactly memoryCap bytes fit
+    capped, (largest, total) = self.plan(memoryCap=64 * 8)
+    self.assertEqual(capped, cost)
+
+    # If no tree fits, the one with least excess memory is selected
+    capped, (largest, total) = self.plan(memoryCap=8)
+    self.assertEqual((capped.excess(), largest), (16 * 8 - 8, 16))
+
+  def test_weight(self):
+    weighted, (largest, total) = self.plan(memoryWeight=100)
+    self.assertEqual(largest, 16)
+    self.assertEqual(weighted.flops(), self.plan(memoryCap=16 * 8)[0].flops() + 100 * 16)
+
+
+class Roofline(unittest.TestCase):
+  def setUp(self):
+    self.arch = Architecture('test', 'd', 32,
+                             memoryHierarchy=[MemoryLevel('L1', 1024, 64.0), MemoryLevel('DRAM', None, 2.0)],
+                             peakFlops={'S': 8.0, 'D': 4.0})
+
+  def product(self, n):
+    A, B = Tensor('A', (n, n)), Tensor('B', (n, n))
+    return EquivalentSparsityPattern().visit(Product(A['ij'], B['jk']))
+
+  def test_architecture(self):
+    self.assertEqual(self.arch.memoryLevel(1024).name, 'L1')
+    self.assertEqual(self.arch.memoryLevel(1025).name, 'DRAM')
+    self.assertEqual(self.arch.bandwidth(10**9), 2.0)
+    self.assertEqual(self.arch.peakFlops(), 4.0)
+    with self.assertRaises(ValueError):
+      self.arch.setMemoryHierarchy([MemoryLevel('L1', 1024, 64.0)])
+    with self.assertRaises(ValueError):
+      self.arch.setPeakFlops({'S': 8.0})
+
+  def test_product(self):
+    # Compute bound: 4^3 flops on 2*16 values from L1
+    product = self.product(4)
+    self.assertEqual(RooflineCostEstimator(self.arch).estimate(product), 4**3 / 4.0)
+
+    # Memory bound: 16^3 flops on 2*256 values from DRAM
+    product = self.product(16)
+    self.assertEqual(RooflineCostEstimator(self.arch).estimate(product), 2 * 256 * 8 / 2.0)
+
+  def test_temporaries(self):
+    product = self.product(4)
+    D = Tensor('D', (4, 4, 4))
+    outer = EquivalentSparsityPattern().visit(Product(product, D['ijk']))
+    estimator = RooflineCostEstimator(self.arch)
+    # The temporary is written and read, thus, counted twice
+    numBytes = (2 * 4**3 + 4**3) * 8
+    self.assertEqual(estimator.estimate(outer), estimator.estimate(product) + max(4**3 / 4.0, numBytes / 2.0))
@@ -0,0 +1,33 @@
+import contextlib
+import filecmp
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+from yateto import Generator, Tensor, simpleParameterSpace, useArchitectureIdentifiedBy
+from yateto.gemm_configuration import Eigen, GeneratorCollection
+
+
+class ParallelGeneration(unittest.TestCase):
+  def generate(self, outputDir, jobs):
+    arch = useArchitectureIdentifiedBy('dhsw')
+    spp = np.zeros((8, 8), dtype=bool)
+    spp[:5, 2:6] = True
+    A, B, C = Tensor('A', (8, 8), spp=spp), Tensor('B', (8, 8)), Tensor('C', (8, 8))
+    D, Q = Tensor('D', (8, 8, 8)), [Tensor('Q', (8, 8), spp=np.roll(spp, i, axis=1)) for i in range(3)]
+    generator = Generator(arch)
+    generator.add('matmul', C['ij'] <= A['ik'] * B['kj'])
+    generator.add('chain', C['il'] <= A['ij'] * B['jk'] * D['kml'] * B['mi'])
+    generator.addFamily('family', simpleParameterSpace(3), lambda i: C['ij'] <= Q[i]['ik'] * B['kj'] + C['ij'])
+    with contextlib.redirect_stdout(io.StringIO()):
+      generator.generate(outputDir, gemm_cfg=GeneratorCollection([Eigen(arch)]), jobs=jobs)
+
+  def test_jobs(self):
+    with tempfile.TemporaryDirectory() as serial, tempfile.TemporaryDirectory() as parallel:
+      self.generate(serial, 1)
+      self.generate(parallel, 2)
+      files = sorted(os.listdir(serial))
+      self.assertEqual(sorted(os.listdir(parallel)), files)
+      match, mismatch, errors = filecmp.cmpfiles(serial, parallel, files, shallow=False)
+      self.assertEqual((mismatch, errors), ([], []))
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from yateto import Tensor
+from yateto.grouping import applyGroups, clusterSparsityPatterns, writeGroups
+from yateto.input import memoryLayoutFromFile
+from yateto.memory import BlockSparseMemoryLayout, DenseMemoryLayout
+from yateto.type import Collection
+
+
+class SparsityPatternClustering(unittest.TestCase):
+  def setUp(self):
+    A = np.zeros((6, 6), dtype=bool)
+    A[0:3, 0:3] = True
+    B = A.copy()
+    B[3, 3] = True
+    C = np.zeros((6, 6), dtype=bool)
+    C[5, :] = True
+    self.tensors = [Tensor('A', (6, 6), spp=A), Tensor('B', (6, 6), spp=B),
+                    Tensor('C', (6, 6), spp=C), Tensor('D', (6, 6), spp=A.copy())]
+
+  def names(self, groups):
+    return [[tensor.name() for tensor in group] for group in groups]
+
+  def test_budgets(self):
+    self.assertEqual(self.names(clusterSparsityPatterns(self.tensors, maxFlopIncrease=0.0)), [['A', 'D'], ['B'], ['C']])
+    self.assertEqual(self.names(clusterSparsityPatterns(self.tensors, maxRoutines=2)), [['A', 'B', 'D'], ['C']])
+    self.assertEqual(self.names(clusterSparsityPatterns(self.tensors, maxRoutines=1, maxFlopIncrease=0.1)), [['A', 'B', 'D'], ['C']])
+    with self.assertRaises(ValueError):
+      clusterSparsityPatterns(self.tensors)
+
+  def test_apply(self):
+    applyGroups(clusterSparsityPatterns(self.tensors, maxRoutines=2))
+    self.assertEqual(self.tensors[0].spp().count_nonzero(), 10)
+    self.assertTrue(self.tensors[0].memoryLayout().isCompatible(self.tensors[1].spp()))
+
+  def test_block_shape(self):
+    for tensor in self.tensors:
+      tensor.setMemoryLayout(BlockSparseMemoryLayout, blockShape=(2, 2))
+    applyGroups(clusterSparsityPatterns(self.tensors, maxRoutines=2))
+    self.assertEqual(self.tensors[0].memoryLayout(), BlockSparseMemoryLayout.fromSpp(self.tensors[1].spp(), blockShape=(2, 2)))
+    self.assertEqual(self.tensors[0].memoryLayout().numberOfBlocks(), 4)
+
+  def test_round_trip(self):
+    groups = clusterSparsityPatterns(self.tensors, maxRoutines=2)
+    db = Collection()
+    for tensor in self.tensors:
+      db[tensor.name()] = Tensor(tensor.name(), tensor.shape(), spp=tensor.spp(groupSpp=False).as_ndarray())
+    with tempfile.TemporaryDirectory() as directory:
+      xmlFile = os.path.join(directory, 'groups.xml')
+      writeGroups(xmlFile, groups)
+      memoryLayoutFromFile(xmlFile, db, dict())
+    applyGroups(groups)
+    for tensor in self.tensors:
+      self.assertTrue(np.array_equal(db.byName(tensor.name()).spp().as_ndarray(), tensor.spp().as_ndarray()))
+      self.assertIsInstance(db.byName(tensor.name()).memoryLayout(), DenseMemoryLayout)
+      self.assertEqual(db.byName(tensor.name()).memoryLayout(), tensor.memoryLayout())
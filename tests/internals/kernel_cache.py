@@ -0,0 +1,70 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from yateto import Generator, Tensor, useArchitectureIdentifiedBy
+from yateto.ast.cost import BoundingBoxCostEstimator, ExactCost
+from yateto.ast import opt
+from yateto.gemm_configuration import Eigen, GeneratorCollection
+from yateto.generator import Kernel
+from yateto.kernel_cache import KernelCache
+
+
+class ReadOnlyKernelCache(KernelCache):
+  def store(self, key, data):
+    raise OSError('read-only file system')
+
+
+class KernelCaching(unittest.TestCase):
+  def setUp(self):
+    self.arch = useArchitectureIdentifiedBy('dhsw')
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+  def actions(self, kernel):
+    return [(str(pp.action.result), str(pp.action.term), pp.action.add) for pp in kernel.cfg if pp.action]
+
+  def generate(self, cache):
+    A, B, C = [Tensor(name, (4, 4)) for name in 'ABC']
+    generator = Generator(self.arch)
+    generator.add('matmul', C['ij'] <= A['ik'] * B['kj'])
+    with tempfile.TemporaryDirectory() as outputDir, contextlib.redirect_stdout(io.StringIO()):
+      generator.generate(outputDir, gemm_cfg=GeneratorCollection([Eigen(self.arch)]), kernel_cache=cache)
+    return next(iter(generator.kernels()))
+
+  def test_hit_miss(self):
+    cache = KernelCache(self.directory.name)
+    kernel = self.generate(cache)
+    self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    cache = KernelCache(self.directory.name)
+    cached = self.generate(cache)
+    self.assertEqual((cache.hits, cache.misses), (1, 0))
+    self.assertEqual(self.actions(cached), self.actions(kernel))
+
+  def test_corrupt_entry(self):
+    self.generate(KernelCache(self.directory.name))
+    for filename in os.listdir(self.directory.name):
+      with open(os.path.join(self.directory.name, filename), 'wb') as f:
+        f.write(b'corrupt')
+
+    cache = KernelCache(self.directory.name)
+    kernel = self.generate(cache)
+    self.assertEqual(cache.hits, 1)
+    self.assertIsNotNone(kernel.cfg)
+
+  def test_store_failure(self):
+    with self.assertWarnsRegex(UserWarning, 'matmul.*read-only file system'):
+      self.generate(ReadOnlyKernelCache(self.directory.name))
+
+  def test_key(self):
+    A, B, C = [Tensor(name, (4, 4)) for name in 'ABC']
+    kernel = Kernel('matmul', C['ij'] <= A['ik'] * B['kj'])
+    gemm_cfg = GeneratorCollection([Eigen(self.arch)])
+    options = (BoundingBoxCostEstimator, opt.AUTO, None, False, False, False)
+    key = KernelCache.key(kernel, self.arch, gemm_cfg, options)
+    self.assertEqual(KernelCache.key(kernel, self.arch, gemm_cfg, options), key)
+    for i, option in [(0, ExactCost), (1, opt.GREEDY), (3, True), (4, True), (5, True)]:
+      changed = options[:i] + (option,) + options[i+1:]
+      self.assertNotEqual(KernelCache.key(kernel, self.arch, gemm_cfg, changed), key)
@@ -1,5 +1,7 @@
 import unittest
+from yateto import useArchitectureIdentifiedBy
 from yateto.type import Tensor
+from yateto.ast.cost import RooflineLoGCostModel
 from yateto.ast.node import IndexedTensor, Contraction
 from yateto.ast.indices import Indices
 from yateto.ast.log import LoG
@@ -44,3 +46,18 @@ class LogNode(unittest.TestCase):
 
     log = LoG(contraction)
     self.assertFalse(log.is_pure_gemm())
+
+  def test_roofline_cost_model(self):
+    left = IndexedTensor(tensor=Tensor(name='A', shape=(9, 56, 2)), indexNames='kli')
+    right = IndexedTensor(tensor=Tensor(name='B', shape=(9, 56)), indexNames='kn')
+    contraction_shape = (56, 2, 56)
+    contraction = Contraction(indices=Indices(indexNames='nil', shape=contraction_shape),
+                              lTerm=left,
+                              rTerm=right,
+                              sumIndices={'k'})
+    contraction.setMemoryLayout(DenseMemoryLayout(shape=contraction_shape))
+
+    # 56 GEMMs of size 56x2x9 vs. 2 GEMMs of size 56x56x9
+    self.assertEqual(str(LoG(contraction).loopIndices()), 'l')
+    model = RooflineLoGCostModel(useArchitectureIdentifiedBy('dhsw'))
+    self.assertEqual(str(LoG(contraction, model=model).loopIndices()), 'i')
@@ -0,0 +1,197 @@
+import io
+import itertools
+import re
+import unittest
+import numpy as np
+from yateto import aspp, Tensor, useArchitectureIdentifiedBy
+from yateto.ast.transformer import DeduceIndices
+from yateto.gemm_configuration import GeneratorCollection
+from yateto.layout_selection import FindGemmOperands, GemmOperand, LayoutSelector
+from yateto.ast.indices import BoundingBox, Indices, Range
+from yateto.codegen import common
+from yateto.codegen.code import Cpp
+from yateto.memory import BandedMemoryLayout, BlockSparseMemoryLayout, CSCMemoryLayout, CSFMemoryLayout, DenseMemoryLayout, DiagonalMemoryLayout
+
+
+class CSCLayout(unittest.TestCase):
+  def setUp(self):
+    rng = np.random.default_rng(3)
+    self.A = rng.random((7, 6)) < 0.4
+    self.A[:, 2] = False
+    self.ml = CSCMemoryLayout(aspp.general(self.A))
+
+  def test_structure(self):
+    rows, cols = self.A.T.nonzero()[::-1]
+    self.assertTrue(np.array_equal(self.ml.rowIndex(), rows))
+    self.assertTrue(np.array_equal(self.ml.colPointer(), np.concatenate(([0], np.cumsum(self.A.sum(axis=0))))))
+    self.assertEqual(self.ml.requiredReals(), np.count_nonzero(self.A))
+
+  def test_addresses(self):
+    rows, cols = self.A.nonzero()
+    addresses = self.ml.addresses((rows, cols))
+    self.assertEqual(addresses.tolist(), [self.ml.address(entry) for entry in zip(rows, cols)])
+    self.assertEqual(sorted(addresses.tolist()), list(range(self.ml.requiredReals())))
+    entries = self.ml.entries(Range(0, 7), Range(1, 4))
+    self.assertEqual(entries, [(r, c-1) for c in range(1, 4) for r in range(7) if self.A[r, c]])
+
+  def test_dense_addresses(self):
+    ml = DenseMemoryLayout((4, 5, 3))
+    entries = np.nonzero(np.ones((4, 5, 3), dtype=bool))
+    self.assertEqual(ml.addresses(entries).tolist(), [ml.address(entry) for entry in zip(*entries)])
+
+
+class DenseLayout(unittest.TestCase):
+  def notWrittenAddresses(self, ml, writeBB):
+    bbox = ml.bbox()
+    entries = itertools.product(*[range(r.start, r.stop) for r in bbox])
+    return sorted(ml.address(entry) for entry in entries if not all(w.start <= i < w.stop for i, w in zip(entry, writeBB)))
+
+  def test_not_written_intervals(self):
+    bbox = BoundingBox([Range(1, 5), Range(0, 5), Range(2, 5)])
+    layouts = [DenseMemoryLayout((6, 5, 5), bbox),
+               DenseMemoryLayout((6, 5, 5), bbox, stride=(1, 6, 40)),
+               DenseMemoryLayout((6, 5, 5), bbox, stride=(15, 3, 1))]
+    writeBBs = [BoundingBox([Range(1, 5), Range(0, 5), Range(3, 4)]),
+                BoundingBox([Range(1, 5), Range(1, 3), Range(2, 5)]),
+                BoundingBox([Range(2, 4), Range(1, 3), Range(3, 5)]),
+                BoundingBox([Range(1, 5), Range(0, 5), Range(2, 2)]),
+                bbox]
+    for ml, writeBB in itertools.product(layouts, writeBBs):
+      intervals = ml.notWrittenIntervals(writeBB)
+      self.assertEqual([address for start, stop in intervals for address in range(start, stop)], self.notWrittenAddresses(ml, writeBB))
+      # Intervals are maximal
+      for (start, stop), (nextStart, nextStop) in zip(intervals, intervals[1:]):
+        self.assertLess(stop, nextStart)
+
+    # Writing the middle of the last dimension leaves one interval before and one after
+    self.assertEqual(layouts[0].notWrittenIntervals(writeBBs[0]), [(0, 20), (40, 60)])
+
+
+class CSFLayout(unittest.TestCase):
+  def setUp(self):
+    self.A = np.zeros((3, 4, 2), dtype=bool)
+    self.A[0, 1, 0] = self.A[2, 1, 0] = self.A[1, 3, 0] = self.A[2, 0, 1] = True
+    self.ml = CSFMemoryLayout(aspp.general(self.A))
+
+  def test_fibers(self):
+    self.assertEqual(self.ml.numberOfRoots(), 2)
+    self.assertEqual(self.ml.fiberIndices().tolist(), [0, 1, 1, 3, 0, 0, 2, 1, 2])
+    self.assertEqual(self.ml.fiberPointer().tolist(), [0, 2, 3, 0, 2, 3, 4])
+
+  def test_addresses(self):
+    entries = self.ml.storedEntries()
+    self.assertEqual(self.ml.addresses(entries).tolist(), list(range(self.ml.requiredReals())))
+    self.assertEqual([self.ml.address(entry) for entry in zip(*entries)], list(range(self.ml.requiredReals())))
+    self.assertEqual(self.ml.address((1, 3, 0)), 2)
+
+  def loopOverNonzeros(self, A):
+    """Returns the generated code and the (entry, address) pairs visited by the generated loops."""
+    sparse = common.IndexedTensorDescription('A', Indices('ijk', A.shape), CSFMemoryLayout(aspp.general(A)), aspp.general(A))
+    stream = io.StringIO()
+    cpp = Cpp(stream)
+    cpp.__enter__()
+    calls = list()
+    def body(address, entry):
+      calls.append(entry)
+      entries = ', '.join('{}'.format(entry[index]) if index in entry else '_' + index for index in 'ijk')
+      cpp('visit(({}), {});'.format(entries, address))
+      return 1
+    flops = common.sparseForLoops(cpp, sparse, Indices(), [], body)
+    self.assertEqual(flops, np.count_nonzero(A))
+
+    # Translate the C++ code to Python
+    code = list()
+    for line in stream.getvalue().splitlines():
+      indent, statement = re.match(r'( *)(.*)', line).groups()
+      statement = re.sub(r'static int const (\w+)\[\] = \{(.*)\};', r'\1 = [\2]', statement)
+      statement = re.sub(r'for \(int (\w+) = (.*); \w+ < (.*); \+\+\w+\) \{', r'for \1 in range(\2, \3):', statement)
+      statement = re.sub(r'int const (\w+) = (.*);', r'\1 = \2', statement).replace('{', 'if True:').rstrip(';')
+      if statement != '}':
+        code.append(indent + statement)
+    visited = list()
+    exec('\n'.join(code), {'visit': lambda entry, address: visited.append((entry, address))})
+    return stream.getvalue(), calls, visited
+
+  def test_fiber_loops(self):
+    rng = np.random.default_rng(7)
+    for nnz, numCalls in [(common.SPARSE_UNROLL_THRESHOLD, common.SPARSE_UNROLL_THRESHOLD), (2 * common.SPARSE_UNROLL_THRESHOLD, 1)]:
+      A = np.zeros((16, 8, 8), dtype=bool)
+      A.flat[rng.choice(A.size, nnz, replace=False)] = True
+      code, calls, visited = self.loopOverNonzeros(A)
+      # Above the threshold, the loops over the fiber tree are emitted once
+      self.assertEqual(len(calls), numCalls)
+      self.assertEqual('_fiber' in code, numCalls == 1)
+      entries = CSFMemoryLayout(aspp.general(A)).storedEntries()
+      self.assertEqual(visited, [(tuple(int(e) for e in entry), address) for address, entry in enumerate(zip(*entries))])
+
+
+class BlockSparseLayout(unittest.TestCase):
+  def setUp(self):
+    self.A = np.zeros((10, 9), dtype=bool)
+    self.A[0:3, 0:2] = True
+    self.A[8, 7] = True
+
+  def test_tiling(self):
+    ml = BlockSparseMemoryLayout.fromSpp(aspp.general(self.A), blockShape=(4, 4))
+    self.assertEqual([(r.start, r.stop, c.start, c.stop, offset) for r, c, offset in ml.blocks()],
+                     [(0, 4, 0, 4, 0), (8, 10, 4, 8, 16)])
+    self.assertEqual(ml.requiredReals(), 24)
+    self.assertTrue(ml.isCompatible(aspp.general(self.A)))
+    rows, cols = self.A.nonzero()
+    self.assertEqual(ml.addresses((rows, cols)).tolist(), [ml.address(entry) for entry in zip(rows, cols)])
+    self.assertEqual(ml.address((8, 7)), 16 + 0 + 3*2)
+
+  def test_explicit_blocks(self):
+    with self.assertRaises(ValueError):
+      BlockSparseMemoryLayout.fromSpp(aspp.general(self.A), blocks=[((0, 3), (0, 2))])
+    with self.assertRaises(ValueError):
+      BlockSparseMemoryLayout((10, 9), [((0, 3), (0, 2)), ((2, 4), (1, 3))])
+
+
+class BandedLayout(unittest.TestCase):
+  def test_banded(self):
+    A = np.array([[-1 <= j-i <= 2 for j in range(7)] for i in range(5)])
+    ml = BandedMemoryLayout.fromSpp(aspp.general(A))
+    self.assertEqual(ml.bandwidths(), (1, 2))
+    self.assertEqual(ml.requiredReals(), np.count_nonzero(A))
+    rows, cols = A.nonzero()
+    addresses = ml.addresses((rows, cols))
+    self.assertEqual(sorted(addresses.tolist()), list(range(ml.requiredReals())))
+    self.assertEqual(addresses.tolist(), [ml.address(entry) for entry in zip(rows, cols)])
+    self.assertEqual(ml.address((1, 0)), 0)
+    self.assertEqual(ml.address((0, 0)), 4)
+
+  def test_diagonal(self):
+    ml = DiagonalMemoryLayout.fromSpp(aspp.general(np.eye(4, dtype=bool)))
+    self.assertEqual(ml.requiredReals(), 4)
+    self.assertEqual(ml.address((2, 2)), 2)
+    self.assertTrue(ml.isCompatible(aspp.general(np.eye(4, dtype=bool))))
+    self.assertFalse(ml.isCompatible(aspp.general(np.ones((4, 4), dtype=bool))))
+    with self.assertRaises(ValueError):
+      DiagonalMemoryLayout.fromSpp(aspp.general(np.ones((4, 4), dtype=bool)))
+
+
+class LayoutSelection(unittest.TestCase):
+  def setUp(self):
+    self.arch = useArchitectureIdentifiedBy('dhsw')
+    self.selector = LayoutSelector(self.arch, GeneratorCollection([]))
+
+  def test_operands(self):
+    A = Tensor('A', (6, 5), spp=np.eye(6, 5, dtype=bool))
+    B = Tensor('B', (5, 4))
+    C = Tensor('C', (4, 6))
+    ast = DeduceIndices().visit(C['ki'] <= A['ij'] * B['jk'])
+    operands = FindGemmOperands().visit(ast)
+    self.assertEqual(operands['A'], [GemmOperand(4, 6, 5, False, True)])
+    self.assertEqual(operands['B'], [GemmOperand(4, 6, 5, True, True)])
+
+  def test_selection(self):
+    rng = np.random.default_rng(5)
+    blocks = np.zeros((32, 32), dtype=bool)
+    blocks[0:8, 0:8] = blocks[16:24, 8:16] = True
+    use = [GemmOperand(32, 16, 32, True, False)]
+    for spp, expected in [(rng.random((32, 32)) < 0.03, CSCMemoryLayout),
+                          (rng.random((32, 32)) < 0.9, DenseMemoryLayout),
+                          (blocks, BlockSparseMemoryLayout)]:
+      decision = self.selector.select(Tensor('X', (32, 32), spp=spp), use)
+      self.assertEqual(decision.layout[0], expected)
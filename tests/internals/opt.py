@@ -0,0 +1,124 @@
+import unittest
+import numpy as np
+from yateto import Tensor
+from yateto.ast import opt
+from yateto.ast.cost import BoundingBoxCostEstimator, FusedGemmsBoundingBoxCostEstimator, ShapeCostEstimator
+from yateto.ast.node import IndexedTensor, IndexSum, Product
+from yateto.ast.transformer import DeduceIndices, EquivalentSparsityPattern
+
+
+def exhaustiveSearch(terms, targetIndices, costEstimator):
+  """Returns the minimum cost over all binary product trees."""
+  full = (1 << len(terms)) - 1
+  def indices(mask):
+    return set().union(*[set(term.indices) for i, term in enumerate(terms) if mask & (1 << i)])
+  def summed(tree, mask):
+    for index in indices(mask) - indices(full ^ mask) - set(targetIndices):
+      if index in tree.indices:
+        tree = IndexSum(tree, index)
+    return tree
+  def trees(mask):
+    if mask & (mask - 1) == 0:
+      yield summed(terms[mask.bit_length() - 1], mask)
+      return
+    low = mask & -mask
+    rest = mask ^ low
+    sub = rest
+    while True:
+      left = sub | low
+      right = mask ^ left
+      if right != 0:
+        for ltree in trees(left):
+          for rtree in trees(right):
+            yield summed(Product(ltree, rtree), mask)
+      if sub == 0:
+        break
+      sub = (sub - 1) & rest
+  return min(costEstimator.estimate(tree) for tree in trees(full))
+
+
+def structure(node):
+  if isinstance(node, IndexedTensor):
+    return node.name()
+  return (type(node).__name__, str(node.indices)) + tuple(structure(child) for child in node)
+
+
+class ContractionOrder(unittest.TestCase):
+  def einsum(self, sizes, sparse=False):
+    """Returns the terms and target indices of a 5-term chain contraction."""
+    rng = np.random.RandomState(sum(sizes))
+    names = 'ABCDE'
+    indices = ['ij', 'jk', 'kl', 'lm', 'mn']
+    terms = list()
+    for name, idx in zip(names, indices):
+      shape = tuple(sizes[ord(i) - ord('i')] for i in idx)
+      spp = None
+      if sparse:
+        spp = np.zeros(shape, dtype=bool)
+        spp[:rng.randint(1, shape[0] + 1), :rng.randint(1, shape[1] + 1)] = True
+      terms.append(Tensor(name, shape, spp=spp)[idx])
+    product = terms[0]
+    for term in terms[1:]:
+      product = product * term
+    Y = Tensor('Y', (sizes[0], sizes[-1]))
+    ast = EquivalentSparsityPattern().visit(DeduceIndices().visit(Y['in'] <= product))
+    einsum = ast.rightTerm()
+    return list(einsum), einsum.indices
+
+  def sizes(self):
+    rng = np.random.RandomState(42)
+    return [tuple(int(size) for size in rng.randint(1, 16, size=6)) for _ in range(8)]
+
+  def test_optimal(self):
+    for sparse in (False, True):
+      for sizes in self.sizes():
+        terms, target = self.einsum(sizes, sparse)
+        for Estimator in (ShapeCostEstimator, BoundingBoxCostEstimator):
+          tree = opt.strengthReduction(terms, target, Estimator())
+          self.assertEqual(Estimator().estimate(tree), exhaustiveSearch(terms, target, Estimator()))
+
+  def test_context(self):
+    # Costs of fused GEMMs depend on the operands' index order, thus, all trees are enumerated
+    for sizes in self.sizes()[:2]:
+      terms, target = self.einsum(sizes)
+      expected = structure(opt.exhaustiveStrengthReduction(terms, target, FusedGemmsBoundingBoxCostEstimator()))
+      self.assertEqual(structure(opt.strengthReduction(terms, target, FusedGemmsBoundingBoxCostEstimator())), expected)
+      self.assertEqual(structure(opt.planStrengthReduction(terms, target, FusedGemmsBoundingBoxCostEstimator())), expected)
+
+  def assertValidTree(self, tree, terms, target):
+    leaves = list()
+    def visit(node):
+      if isinstance(node, IndexedTensor):
+        leaves.append(node)
+      elif isinstance(node, Product):
+        self.assertEqual(set(node.indices), set(node.leftTerm().indices) | set(node.rightTerm().indices))
+      else:
+        self.assertIsInstance(node, IndexSum)
+        self.assertIn(str(node.sumIndex()), node.term().indices)
+        self.assertEqual(set(node.indices), set(node.term().indices) - set(node.sumIndex()))
+      for child in node:
+        visit(child)
+    visit(tree)
+    self.assertCountEqual([id(leaf) for leaf in leaves], [id(term) for term in terms])
+    self.assertEqual(set(tree.indices), set(target))
+
+  def test_heuristics(self):
+    for sparse in (False, True):
+      for sizes in self.sizes():
+        terms, target = self.einsum(sizes, sparse)
+        optimal = exhaustiveSearch(terms, target, BoundingBoxCostEstimator())
+        for tree in (opt.greedyStrengthReduction(terms, target, BoundingBoxCostEstimator()),
+                     opt.beamStrengthReduction(terms, target, BoundingBoxCostEstimator())):
+          self.assertValidTree(tree, terms, target)
+          self.assertGreaterEqual(BoundingBoxCostEstimator().estimate(tree), optimal)
+
+  def test_planner(self):
+    terms, target = self.einsum(self.sizes()[0])
+    cost = lambda tree: BoundingBoxCostEstimator().estimate(tree)
+    plan = lambda planner, **kwargs: opt.planStrengthReduction(terms, target, BoundingBoxCostEstimator(), planner, **kwargs)
+    self.assertEqual(cost(plan(opt.AUTO)), cost(plan(opt.OPTIMAL)))
+    # AUTO falls back to beam search if the optimal search exceeds the node budget
+    self.assertEqual(cost(plan(opt.AUTO, beamWidth=1, nodeBudget=opt.optimalSearchSize(len(terms)) - 1)),
+                     cost(plan(opt.GREEDY)))
+    with self.assertRaises(ValueError):
+      plan('exhaustive')
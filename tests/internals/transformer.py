@@ -0,0 +1,239 @@
+import io
+import itertools
+import unittest
+import warnings
+import numpy as np
+from yateto import aspp, Tensor, useArchitectureIdentifiedBy
+from yateto.ast.cost import BoundingBoxCostEstimator, RooflineLoGCostModel
+from yateto.ast.indices import BoundingBox, Indices
+from yateto.ast.log import LoG
+from yateto.ast.node import Contraction, Op, Permute
+from yateto.ast.transformer import (ComputeMemoryLayout, DeduceIndices, EquivalentSparsityPattern, FindContractions,
+                                    FoldConstantExpressions, ImplementContractions, SelectIndexPermutations,
+                                    StrengthReduction)
+from yateto.ast.visitor import FindIndexPermutations, FindTensors
+from yateto.codegen import copyscaleadd
+from yateto.codegen.code import Cpp
+from yateto.codegen.common import IndexedTensorDescription
+from yateto.generator import Kernel
+from yateto.memory import DenseMemoryLayout
+from yateto.type import FoldedTensor
+
+
+class SparsityBackPropagation(unittest.TestCase):
+  def box(self, node):
+    return [(r.start, r.stop) for r in BoundingBox.fromSpp(node.eqspp())]
+
+  def test_einsum_add(self):
+    spp = np.zeros((8, 8), dtype=bool)
+    spp[:, 0:3] = True
+    A = Tensor('A', (8, 8), spp=spp)
+    B, D, E, C = [Tensor(name, (8, 8)) for name in 'BDEC']
+    ast = DeduceIndices().visit(C['ik'] <= A['ij'] * (B['jl'] * D['lk'] + 2.0 * E['jk']))
+    ast = EquivalentSparsityPattern().visit(ast)
+    add = ast.rightTerm()[1]
+    self.assertEqual(self.box(add[0][0]), [(0, 3), (0, 8)])
+    self.assertEqual(self.box(add[1].term()), [(0, 3), (0, 8)])
+
+  def test_assign(self):
+    spp = np.zeros((8, 8), dtype=bool)
+    spp[0:2, :] = True
+    R = Tensor('R', (8, 8), spp=spp)
+    M, X = Tensor('M', (8, 8)), Tensor('X', (8, 8))
+    # The product has nonzeros outside of R's bounding box, which are discarded
+    with self.assertWarnsRegex(UserWarning, 'R\\[ik\\]'):
+      ast = EquivalentSparsityPattern().visit(DeduceIndices().visit(R['ik'] <= M['ij'] * X['jk']))
+    self.assertEqual(self.box(ast.rightTerm()), [(0, 2), (0, 8)])
+    self.assertEqual(self.box(ast.rightTerm()[0]), [(0, 2), (0, 8)])
+    self.assertEqual(self.box(ast.rightTerm()[1]), [(0, 8), (0, 8)])
+
+    # Nothing is discarded if the right-hand side fits
+    spp = np.zeros((8, 8), dtype=bool)
+    spp[0:2, 0:2] = True
+    S = Tensor('S', (8, 8), spp=spp)
+    with warnings.catch_warnings():
+      warnings.simplefilter('error')
+      ast = EquivalentSparsityPattern().visit(DeduceIndices().visit(R['ik'] <= S['ij'] * X['jk']))
+    self.assertEqual(self.box(ast.rightTerm()), [(0, 2), (0, 8)])
+
+
+class TransposeThenGemm(unittest.TestCase):
+  def implement(self, ast, ttgt):
+    model = RooflineLoGCostModel(useArchitectureIdentifiedBy('dhsw'))
+    ast = DeduceIndices().visit(ast)
+    ast = EquivalentSparsityPattern().visit(ast)
+    ast = StrengthReduction(BoundingBoxCostEstimator).visit(ast)
+    ast = FindContractions().visit(ast)
+    ast = ComputeMemoryLayout().visit(ast)
+    ast = SelectIndexPermutations(FindIndexPermutations(model, ttgt).visit(ast)).visit(ast)
+    return ImplementContractions(model).visit(ast).rightTerm()
+
+  def test_ttgt(self):
+    A = Tensor('A', (2, 32, 40))
+    D = Tensor('D', (32, 24))
+    C = Tensor('C', (2, 40, 24))
+    log = self.implement(C['ijl'] <= A['ikj'] * D['kl'], False)
+    self.assertEqual(str(log.loopIndices()), 'j')
+    log = self.implement(C['ijl'] <= A['ikj'] * D['kl'], True)
+    self.assertEqual(str(log.loopIndices()), '')
+    self.assertIsInstance(log.leftTerm(), Permute)
+    self.assertEqual(str(log.leftTerm().term().indices), 'ikj')
+    self.assertTrue(log.leftTerm().blockTranspose)
+
+  def test_blocking(self):
+    arch = useArchitectureIdentifiedBy('dhsw')
+    codes = list()
+    for blockTranspose in [False, True]:
+      result, term = [IndexedTensorDescription(name, indices, DenseMemoryLayout((32, 32)), aspp.dense((32, 32)))
+                      for name, indices in [('B', Indices('ji', (32, 32))), ('A', Indices('ij', (32, 32)))]]
+      stream = io.StringIO()
+      cpp = Cpp(stream)
+      cpp.__enter__()
+      copyscaleadd.generator(arch, copyscaleadd.Description(1.0, 0.0, result, term, blockTranspose), 'cpu').generate(cpp, None)
+      codes.append(stream.getvalue())
+    self.assertNotIn('_blk', codes[0])
+    self.assertIn('_blkj', codes[1])
+
+
+class TemporaryLayouts(unittest.TestCase):
+  def setUp(self):
+    DenseMemoryLayout.setAlignmentArch(useArchitectureIdentifiedBy('dhsw'))
+
+  def implement(self, ast, temporaryLayouts):
+    ast = DeduceIndices().visit(ast)
+    ast = EquivalentSparsityPattern().visit(ast)
+    ast = StrengthReduction(BoundingBoxCostEstimator).visit(ast)
+    ast = FindContractions().visit(ast)
+    ast = ComputeMemoryLayout().visit(ast)
+    ast = SelectIndexPermutations(FindIndexPermutations(temporaryLayouts=temporaryLayouts).visit(ast)).visit(ast)
+    return ImplementContractions().visit(ast).rightTerm()
+
+  def chain(self):
+    spp = np.zeros((7, 6, 5), dtype=bool)
+    spp[0:5] = True
+    A = Tensor('A', (7, 6, 5), spp=spp)
+    B, D, C = Tensor('B', (5, 2)), Tensor('D', (2, 9)), Tensor('C', (7, 6, 9))
+    return C['ijl'] <= A['ijm'] * B['mk'] * D['kl']
+
+  def test_padding(self):
+    log = self.implement(self.chain(), False)
+    self.assertEqual(str(log.loopIndices()), 'j')
+    log = self.implement(self.chain(), True)
+    self.assertEqual(str(log.loopIndices()), '')
+    self.assertEqual([(r.start, r.stop) for r in log.leftTerm().memoryLayout().bbox()], [(0, 7), (0, 6), (0, 2)])
+
+  def test_default_unchanged(self):
+    A, T = Tensor('A', (6, 6, 6, 6)), Tensor('T', (4, 4, 4, 4))
+    C1, C2, C3, C4 = [Tensor(name, (6, 4)) for name in ['C1', 'C2', 'C3', 'C4']]
+    for ast in [self.chain(), T['abcd'] <= C1['sd'] * C2['rc'] * C3['qb'] * C4['pa'] * A['pqrs']]:
+      nodes = [self.implement(ast, False)]
+      while nodes:
+        node = nodes.pop()
+        if isinstance(node, Op):
+          layout = node.memoryLayout()
+          node.computeMemoryLayout()
+          self.assertEqual(layout, node.memoryLayout())
+          nodes.extend(node)
+
+
+class ConstantFolding(unittest.TestCase):
+  def setUp(self):
+    self.a = np.arange(1.0, 17.0).reshape(4, 4)
+    self.b = np.arange(16.0, 0.0, -1.0).reshape(4, 4)
+    self.A, self.B = Tensor('A', (4, 4), spp=self.a), Tensor('B', (4, 4), spp=self.b)
+    self.X, self.Y, self.Z = [Tensor(name, (4, 4)) for name in 'XYZ']
+
+  def folded(self, ast):
+    ast = FoldConstantExpressions().visit(DeduceIndices().visit(ast))
+    return [tensor for tensor in FindTensors().visit(ast).values() if isinstance(tensor, FoldedTensor)]
+
+  def test_values(self):
+    folded = self.folded(self.Y['ik'] <= self.A['ij'] * self.B['jl'] * self.X['lk'])
+    self.assertEqual(len(folded), 1)
+    np.testing.assert_allclose(folded[0].values_as_ndarray(), self.a @ self.b)
+
+    folded = self.folded(self.Y['ik'] <= 2.0 * self.A['ij'] * self.X['jk'])
+    self.assertEqual(len(folded), 1)
+    np.testing.assert_allclose(folded[0].values_as_ndarray(), 2.0 * self.a)
+
+  def test_names(self):
+    # Equal values give equal names, hence, the folded tensor is shared by all kernels
+    first = self.folded(self.Y['ik'] <= self.A['ij'] * self.B['jl'] * self.X['lk'])
+    A2, B2 = Tensor('A2', (4, 4), spp=self.a), Tensor('B2', (4, 4), spp=self.b)
+    second = self.folded(self.Z['ik'] <= A2['ij'] * B2['jl'] * self.X['lk'])
+    self.assertEqual(first[0].name(), second[0].name())
+    # Different values with equal shape and sparsity pattern must not collide
+    transposed = self.folded(self.Z['ik'] <= self.A['ij'] * self.B['lj'] * self.X['lk'])
+    self.assertNotEqual(first[0].name(), transposed[0].name())
+    np.testing.assert_allclose(transposed[0].values_as_ndarray(), self.a @ self.b.T)
+
+  def test_opt_in(self):
+    kernel = Kernel('kernel', self.Y['ik'] <= self.A['ij'] * self.B['jl'] * self.X['lk'])
+    kernel.prepareUntilUnitTest()
+    kernel.prepareUntilCodeGen(BoundingBoxCostEstimator)
+    self.assertEqual(set(FindTensors().visit(kernel.ast)), {'A', 'B', 'X', 'Y'})
+    self.assertEqual(kernel.unusedTensors, [])
+
+    kernel = Kernel('kernel', self.Y['ik'] <= self.A['ij'] * self.B['jl'] * self.X['lk'])
+    kernel.prepareUntilUnitTest()
+    kernel.prepareUntilCodeGen(BoundingBoxCostEstimator, fold_constants=True)
+    self.assertEqual({tensor.name() for tensor in kernel.unusedTensors}, {'A', 'B'})
+
+
+class UnprunedIndexPermutations(FindIndexPermutations):
+  """Evaluates the LoG of every combination of result and operand permutations."""
+  def visit_Contraction(self, node):
+    permutationVariants = self.findVariants(node)
+    lV = permutationVariants[node.leftTerm()]
+    rV = permutationVariants[node.rightTerm()]
+    variants = dict()
+    for C in map(''.join, itertools.permutations(str(node.indices))):
+      costs = [log.cost() + lV[A]._cost + rV[B]._cost for A in lV for B in rV for log in [LoG(node, A, B, C)] if log is not None]
+      if costs:
+        variants[C] = self.Variant(min(costs), None)
+    permutationVariants[node] = variants
+    return permutationVariants
+
+
+class IndexPermutations(unittest.TestCase):
+  def setUp(self):
+    self.addCleanup(DenseMemoryLayout.setAlignmentArch, None)
+
+  def contractions(self):
+    sizes = dict(zip('abcdijkl', (3, 4, 5, 6, 7, 8, 2, 9)))
+    T = lambda name, indices: Tensor(name, tuple(sizes[idx] for idx in indices))[indices]
+    S = Tensor('S', tuple(sizes[idx] for idx in 'abij'))
+    ast = DeduceIndices().visit(S['abij'] <= T('A', 'acik') * T('B', 'cdkl') * T('C', 'dblj'))
+    ast = EquivalentSparsityPattern().visit(ast)
+    ast = StrengthReduction(BoundingBoxCostEstimator).visit(ast)
+    ast = FindContractions().visit(ast)
+    return ComputeMemoryLayout().visit(ast)
+
+  def test_pruning(self):
+    for arch in (None, useArchitectureIdentifiedBy('dhsw')):
+      DenseMemoryLayout.setAlignmentArch(arch)
+      ast = self.contractions()
+      pruned = FindIndexPermutations().visit(ast)
+      unpruned = UnprunedIndexPermutations().visit(ast)
+      contractions = [node for node in unpruned if isinstance(node, Contraction)]
+      self.assertEqual(len(contractions), 2)
+      for node in contractions:
+        self.assertEqual(set(pruned[node]), set(unpruned[node]))
+        for C, variant in unpruned[node].items():
+          self.assertEqual(pruned[node][C]._cost, variant._cost, C)
+
+  def test_max_variants(self):
+    class CappedIndexPermutations(FindIndexPermutations):
+      MAX_VARIANTS = 6
+    ast = self.contractions()
+    capped = CappedIndexPermutations().visit(ast)
+    unpruned = UnprunedIndexPermutations().visit(ast)
+    for node in unpruned:
+      if isinstance(node, Contraction):
+        self.assertLessEqual(len(capped[node]), CappedIndexPermutations.MAX_VARIANTS)
+        # Every index leads a block once, hence, a variant
+        self.assertEqual({C[0] for C in capped[node]}, set(str(node.indices)))
+        for C, variant in capped[node].items():
+          self.assertGreaterEqual(variant._cost, unpruned[node][C]._cost)
+        self.assertEqual(min(variant._cost for variant in capped[node].values()),
+                         min(variant._cost for variant in unpruned[node].values()))
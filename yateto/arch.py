@@ -39,14 +39,39 @@
 
 from .memory import DenseMemoryLayout
 
+class MemoryLevel(object):
+  def __init__(self, name, size, bandwidth):
+    """
+
+    Args:
+      name (str): name of the level e.g., L1, L2, DRAM
+      size (int): capacity in bytes available to a single core. None if unbounded.
+      bandwidth (float): sustained bandwidth of a single core in GB/s
+    """
+    self.name = name
+    self.size = size
+    self.bandwidth = bandwidth
+
+  def __repr__(self):
+    return 'MemoryLevel({}, {}, {})'.format(self.name, self.size, self.bandwidth)
+
+
 class Architecture(object):
+  # Rough single-core figures which are used if no performance characteristics are given
+  DEFAULT_MEMORY_HIERARCHY = [MemoryLevel('L1', 32*1024, 32.0),
+                              MemoryLevel('L2', 256*1024, 16.0),
+                              MemoryLevel('DRAM', None, 4.0)]
+  DEFAULT_PEAK_FLOPS = {'S': 16.0, 'D': 8.0}
+
   def __init__(self,
                name,
                precision,
                alignment,
                enablePrefetch=False,
                backend='cpp',
-               host_name=None):
+               host_name=None,
+               memoryHierarchy=None,
+               peakFlops=None):
     """
 
     Args:
@@ -59,6 +84,10 @@ class Architecture(object):
           data prefetching
       host_name (str): name of the host (CPU) architecture. If the code is intended to be generated
           for a CPU-like architecture then the field should be equal to None.
+      memoryHierarchy (list): MemoryLevels ordered from the innermost cache to main memory.
+          The last level must be unbounded.
+      peakFlops (dict): peak floating point performance of a single core in GFLOP/s for
+          each precision ('S' and 'D')
     """
     self.name = name
     self.backend = backend
@@ -86,9 +115,36 @@ class Architecture(object):
     self._tmpStackLimit = 524288
     self.is_accelerator = backend != 'cpp' and self.host_name != None
 
+    self.setMemoryHierarchy(memoryHierarchy if memoryHierarchy is not None else self.DEFAULT_MEMORY_HIERARCHY)
+    self.setPeakFlops(peakFlops if peakFlops is not None else self.DEFAULT_PEAK_FLOPS)
+
   def setTmpStackLimit(self, tmpStackLimit):
     self._tmpStackLimit = tmpStackLimit
 
+  def setMemoryHierarchy(self, memoryHierarchy):
+    if len(memoryHierarchy) == 0 or memoryHierarchy[-1].size is not None:
+      raise ValueError('The last level of the memory hierarchy must be unbounded (size=None).')
+    self.memoryHierarchy = list(memoryHierarchy)
+
+  def setPeakFlops(self, peakFlops):
+    if self.precision not in peakFlops:
+      raise ValueError(f'Peak flops are missing for precision {self.precision}.')
+    self.peakFlopsPerPrecision = dict(peakFlops)
+
+  def peakFlops(self):
+    """Peak performance in GFLOP/s for the architecture's precision."""
+    return self.peakFlopsPerPrecision[self.precision]
+
+  def memoryLevel(self, workingSetBytes):
+    """Returns the innermost memory level which holds the working set."""
+    for level in self.memoryHierarchy:
+      if level.size is None or workingSetBytes <= level.size:
+        return level
+
+  def bandwidth(self, workingSetBytes):
+    """Bandwidth in GB/s of the innermost memory level which holds the working set."""
+    return self.memoryLevel(workingSetBytes).bandwidth
+
   def alignedLower(self, index):
     return index - index % self.alignedReals
 
@@ -112,22 +168,45 @@ def _get_name_and_precision(ident):
   return ident[1:], ident[0].upper()
 
 
+def _performance(caches, dram, peakDouble):
+  """caches: list of (size in KiB, bandwidth in GB/s), dram: bandwidth in GB/s,
+  peakDouble: double precision GFLOP/s (single precision is assumed to be twice as fast)."""
+  hierarchy = [MemoryLevel('L{}'.format(i+1), size * 1024, bandwidth) for i, (size, bandwidth) in enumerate(caches)]
+  hierarchy.append(MemoryLevel('DRAM', None, dram))
+  return {'memoryHierarchy': hierarchy, 'peakFlops': {'S': 2.0 * peakDouble, 'D': peakDouble}}
+
+
 def getArchitectureIdentifiedBy(ident):
   name, precision = _get_name_and_precision(ident)
 
+  # Rough single-core estimates of the memory hierarchy and peak performance
+  performance = {
+    'noarch': _performance([(32, 32.0), (256, 16.0)], 4.0, 8.0),
+    'wsm': _performance([(32, 42.0), (256, 42.0), (2048, 20.0)], 5.0, 10.6),
+    'snb': _performance([(32, 83.0), (256, 83.0), (2560, 40.0)], 8.0, 20.8),
+    'hsw': _performance([(32, 166.0), (256, 83.0), (2560, 40.0)], 8.0, 41.6),
+    'skx': _performance([(32, 307.0), (1024, 154.0), (1408, 40.0)], 6.0, 76.8),
+    'knc': _performance([(32, 70.0), (512, 35.0)], 5.0, 17.6),
+    'knl': _performance([(32, 179.0), (512, 45.0)], 7.0, 44.8),
+    'rome': _performance([(32, 186.0), (512, 93.0), (4096, 46.0)], 5.0, 46.4),
+    'thunderx2t99': _performance([(32, 80.0), (256, 40.0), (1024, 20.0)], 5.0, 20.0),
+    'a64fx': _performance([(64, 230.0), (680, 115.0)], 21.0, 70.4),
+    'power9': _performance([(32, 120.0), (256, 60.0), (5120, 30.0)], 6.0, 30.4)
+  }
+
   # NOTE: ibxsmm currently supports prefetch only for KNL kernels
   arch = {
-    'noarch': Architecture(name, precision, 16, False),
-    'wsm': Architecture(name, precision, 16, False),
-    'snb': Architecture(name, precision, 32, False),
-    'hsw': Architecture(name, precision, 32, False),
-    'skx': Architecture(name, precision, 64, True),
-    'knc': Architecture(name, precision, 64, False),
-    'knl': Architecture(name, precision, 64, True),
-    'rome': Architecture(name, precision, 32, False),
-    'thunderx2t99': Architecture(name, precision, 16, False),
-    'a64fx': Architecture(name, precision, 256, True),
-    'power9': Architecture(name, precision, 16, False)
+    'noarch': Architecture(name, precision, 16, False, **performance['noarch']),
+    'wsm': Architecture(name, precision, 16, False, **performance['wsm']),
+    'snb': Architecture(name, precision, 32, False, **performance['snb']),
+    'hsw': Architecture(name, precision, 32, False, **performance['hsw']),
+    'skx': Architecture(name, precision, 64, True, **performance['skx']),
+    'knc': Architecture(name, precision, 64, False, **performance['knc']),
+    'knl': Architecture(name, precision, 64, True, **performance['knl']),
+    'rome': Architecture(name, precision, 32, False, **performance['rome']),
+    'thunderx2t99': Architecture(name, precision, 16, False, **performance['thunderx2t99']),
+    'a64fx': Architecture(name, precision, 256, True, **performance['a64fx']),
+    'power9': Architecture(name, precision, 16, False, **performance['power9'])
   }
   return arch[name]
 
@@ -1,8 +1,59 @@
+import collections
+import functools
+import hashlib
 import numpy as np
 import numpy.lib
 import re
 from abc import ABC, abstractmethod
 
+def _parseEinsum(description):
+  p = re.match('(\w*),(\w*)->(\w*)', description)
+  if not p:
+    raise ValueError(description + ' not understood.')
+  return p.group(1), p.group(2), p.group(3)
+
+class Memo(object):
+  """LRU cache for the results of sparsity pattern operations.
+
+  Keys contain the fingerprints of the operands, hence, identical patterns share
+  entries also if they are distinct objects.
+  """
+  def __init__(self, maxSize=256):
+    self.maxSize = maxSize
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+
+  def get(self, key, compute):
+    if key in self._entries:
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return self._entries[key]
+    self.misses += 1
+    value = compute()
+    self._entries[key] = value
+    if len(self._entries) > self.maxSize:
+      self._entries.popitem(last=False)
+    return value
+
+  def clear(self):
+    self._entries.clear()
+    self.hits = 0
+    self.misses = 0
+
+  def __str__(self):
+    return 'Memo(hits={}, misses={}, entries={})'.format(self.hits, self.misses, len(self._entries))
+
+memo = Memo()
+
+def _memoized(method):
+  """Memoizes a method of ASpp whose remaining arguments are identified by their string."""
+  @functools.wraps(method)
+  def wrapper(self, *args):
+    key = (method.__name__, self.fingerprint()) + tuple([str(arg) for arg in args])
+    return memo.get(key, lambda: method(self, *args))
+  return wrapper
+
 class ASpp(ABC):
   def __init__(self, shape):
     self.shape = shape
@@ -10,10 +61,32 @@ class ASpp(ABC):
     for s in shape:
       self.size *= s
     self.ndim = len(shape)
+    self._fingerprint = None
+    self._nnzbounds = None
 
   def identity(self):
     return self
 
+  def fingerprint(self):
+    """Hashable key which is equal for equal patterns of the same class."""
+    if self._fingerprint is None:
+      self._fingerprint = (type(self).__name__, tuple(self.shape)) + self._contentFingerprint()
+    return self._fingerprint
+
+  def _contentFingerprint(self):
+    return ()
+
+  def boundingBox(self):
+    from .ast.indices import BoundingBox, Range
+    return BoundingBox([Range(m, M+1) for m, M in self.nnzbounds()])
+
+  def __getstate__(self):
+    # Cached values are recomputed on demand, such that pickles only depend on the pattern
+    state = self.__dict__.copy()
+    state['_fingerprint'] = None
+    state['_nnzbounds'] = None
+    return state
+
   @abstractmethod
   def count_nonzero(self):
     pass
@@ -108,6 +181,15 @@ class dense(ASpp):
   def as_general(self):
     return general(self.as_ndarray())
 
+  def as_boxed(self):
+    return boxed(self.shape, [(0, s) for s in self.shape])
+
+  def as_packed(self):
+    bits = np.full(packed.packedShape(self.shape), 0xFF, dtype=np.uint8)
+    if self.shape[0] % 8 != 0:
+      bits[-1] = (0xFF << (8 - self.shape[0] % 8)) & 0xFF
+    return packed(self.shape, bits)
+
   def as_ndarray(self):
     return np.ones(self.shape, dtype=bool, order=general.NUMPY_DEFAULT_ORDER)
 
@@ -118,6 +200,8 @@ class dense(ASpp):
 class general(ASpp):
   NUMPY_DEFAULT_ORDER = 'F'
   OPTIMIZE_EINSUM = {'optimize': True } if np.lib.NumpyVersion(np.__version__) >= '1.12.0' else {}
+  # einsum works on coordinate lists if the density of an operand is lower
+  SPARSE_DENSITY = 0.1
 
   def __init__(self, npspp: np.ndarray):
     super().__init__(npspp.shape)
@@ -132,41 +216,54 @@ class general(ASpp):
   def is_dense(self):
     return self.count_nonzero() == self.size
 
+  def density(self):
+    return self.count_nonzero() / self.size if self.size > 0 else 1.0
+
   @classmethod
-  def sumAxes(cls, spp, cache, axes):
-    if len(axes) == 0:
-      return spp
-    head = axes[0]
-    tail = axes[1:]
-    if not tail in cache:
-      cache[tail] = cls.sumAxes(spp, cache, tail)
-    return cache[tail].sum(axis=head)
+  def projections(cls, pattern, axes):
+    """Reduces pattern onto each of the axes with np.any.
+
+    The axes are split in halves and each half is reduced over the other half
+    first, such that the reductions touch about 2 * pattern.size entries in total.
+    """
+    if len(axes) == 1:
+      return {axes[0]: pattern.reshape(-1)}
+    half = len(axes) // 2
+    left, right = axes[:half], axes[half:]
+    result = cls.projections(np.any(pattern, axis=right, keepdims=True), left)
+    result.update(cls.projections(np.any(pattern, axis=left, keepdims=True), right))
+    return result
 
   def nnzbounds(self):
-    n = len(self.shape)
-    bounds = list()
-    cache = dict()
-    for axis in range(n):
-      axes = tuple([a for a in range(n) if a != axis])
-      reduction = self.sumAxes(self.pattern, cache, axes)
-      nonzeros = np.where(reduction)
-      assert len(nonzeros) == 1
-      m, M = nonzeros[0][[0,-1]]
-      bounds.append((m, M))
-    return bounds
+    if self._nnzbounds is None:
+      projections = self.projections(self.pattern, tuple(range(self.ndim)))
+      bounds = list()
+      for axis in range(self.ndim):
+        nonzeros = np.where(projections[axis])[0]
+        bounds.append((nonzeros[0], nonzeros[-1]))
+      self._nnzbounds = tuple(bounds)
+    return list(self._nnzbounds)
 
   def nonzero(self):
     return self.pattern.nonzero()
 
+  def _contentFingerprint(self):
+    return (hashlib.sha1(np.packbits(self.pattern, axis=None).tobytes()).hexdigest(),)
+
   def copy(self):
-    return type(self)(self.pattern.copy())
+    spp = type(self)(self.pattern.copy())
+    spp._fingerprint = self._fingerprint
+    spp._nnzbounds = self._nnzbounds
+    return spp
 
   def reshape(self, shape):
     return type(self)(self.pattern.reshape(shape, order=self.NUMPY_DEFAULT_ORDER))
 
+  @_memoized
   def transposed(self, perm):
     return type(self)(self.pattern.transpose(perm).copy(order=self.NUMPY_DEFAULT_ORDER))
 
+  @_memoized
   def indexSum(self, sourceIndices, targetIndices):
     return general(np.einsum('{}->{}'.format(sourceIndices, targetIndices), self.pattern))
 
@@ -176,12 +273,66 @@ class general(ASpp):
 
   @staticmethod
   def einsum(description, a1, a2):
+    if a1.ndim > 0 and a2.ndim > 0 and min(a1.density(), a2.density()) < general.SPARSE_DENSITY:
+      return general.sparseEinsum(description, a1, a2)
     return general(np.einsum(description, a1.pattern, a2.pattern))
 
+  @staticmethod
+  def _coordinates(spp, indices, keep):
+    """Unique nonzero coordinates of spp restricted to the indices in keep."""
+    nonzeros = spp.pattern.nonzero()
+    columns = [nonzeros[indices.find(index)] for index in keep]
+    shape = tuple([spp.shape[indices.find(index)] for index in keep])
+    if len(keep) == 0:
+      return np.zeros((1 if len(nonzeros[0]) > 0 else 0, 0), dtype=np.int64)
+    keys = np.unique(np.ravel_multi_index(columns, shape))
+    return np.stack(np.unravel_index(keys, shape), axis=1)
+
+  @staticmethod
+  def sparseEinsum(description, a1, a2):
+    """einsum on coordinate lists, whose cost is proportional to the number of nonzeros
+    and the number of matching pairs of nonzeros."""
+    A, B, C = _parseEinsum(description)
+    sizes = dict(zip(A, a1.shape))
+    sizes.update(zip(B, a2.shape))
+    shared = [index for index in A if index in B]
+    # Summation indices which only appear in one operand are summed up front
+    keep1 = [index for index in A if index in B or index in C]
+    keep2 = [index for index in B if index in A or index in C]
+    coords1 = general._coordinates(a1, A, keep1)
+    coords2 = general._coordinates(a2, B, keep2)
+
+    def sharedKey(coords, keep):
+      if len(shared) == 0:
+        return np.zeros(coords.shape[0], dtype=np.int64)
+      return np.ravel_multi_index([coords[:, keep.index(index)] for index in shared], tuple([sizes[index] for index in shared]))
+
+    # Join on the shared indices
+    key1 = sharedKey(coords1, keep1)
+    key2 = sharedKey(coords2, keep2)
+    order2 = np.argsort(key2, kind='stable')
+    key2 = key2[order2]
+    lower = np.searchsorted(key2, key1, side='left')
+    counts = np.searchsorted(key2, key1, side='right') - lower
+    total = int(counts.sum())
+    pairs1 = np.repeat(np.arange(coords1.shape[0]), counts)
+    pairs2 = order2[np.repeat(lower - np.cumsum(counts) + counts, counts) + np.arange(total)]
+
+    shape = tuple([sizes[index] for index in C])
+    if len(C) == 0:
+      return general(np.array(total > 0))
+    result = np.zeros(shape, dtype=bool, order=general.NUMPY_DEFAULT_ORDER)
+    columns = [coords1[pairs1, keep1.index(index)] if index in keep1 else coords2[pairs2, keep2.index(index)] for index in C]
+    result[tuple(columns)] = True
+    return general(result)
+
   @staticmethod
   def array_equal(a1, a2):
     return np.array_equal(a1.pattern, a2.pattern)
 
+  def as_packed(self):
+    return packed.fromNdarray(self.pattern)
+
   def as_ndarray(self):
     return self.pattern
 
@@ -189,15 +340,335 @@ class general(ASpp):
     nnz = self.count_nonzero()
     return f"general(shape={self.shape}, size={self.size}, ndim={self.ndim}, nnz={nnz})"
 
+
+class packed(ASpp):
+  """Sparsity pattern which is bit-packed along the leading axis.
+
+  Needs 8 times less memory than general. Operations are evaluated in slabs of
+  the leading axis, such that a pattern is never unpacked as a whole.
+  """
+  # Number of entries which may be unpacked at once
+  SLAB_SIZE = 2**24
+  # Binary operations yield packed patterns if an operand or the result has more entries
+  THRESHOLD = 2**20
+
+  _POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+  def __init__(self, shape, bits):
+    super().__init__(shape)
+    assert self.ndim > 0 and bits.shape == self.packedShape(shape)
+    self.bits = bits
+
+  @staticmethod
+  def packedShape(shape):
+    return ((shape[0] + 7) // 8,) + tuple(shape[1:])
+
+  @classmethod
+  def fromNdarray(cls, npspp):
+    npspp = np.asarray(npspp, dtype=bool)
+    if npspp.ndim == 0:
+      return general(npspp)
+    return cls(npspp.shape, np.packbits(npspp, axis=0))
+
+  def _slabRows(self):
+    rowSize = self.size // self.shape[0]
+    return max(8, self.SLAB_SIZE // max(rowSize, 1) // 8 * 8)
+
+  def _slab(self, start, stop, axis=0):
+    """Unpacks rows start:stop of axis. start must be a multiple of 8 if axis == 0."""
+    if axis == 0:
+      return np.unpackbits(self.bits[start // 8:(stop + 7) // 8], axis=0, count=stop - start).view(bool)
+    index = [slice(None)] * self.ndim
+    index[axis] = slice(start, stop)
+    return np.unpackbits(self.bits[tuple(index)], axis=0, count=self.shape[0]).view(bool)
+
+  def count_nonzero(self):
+    return int(self._POPCOUNT[self.bits].sum(dtype=np.int64))
+
+  def is_dense(self):
+    return self.count_nonzero() == self.size
+
+  def nnzbounds(self):
+    if self._nnzbounds is None:
+      # The leading axis is reduced bytewise, the other axes on non-zero bytes
+      leading = np.bitwise_or.reduce(self.bits.reshape(self.bits.shape[0], -1), axis=1)
+      rows = np.unpackbits(leading, count=self.shape[0]).nonzero()[0]
+      bounds = [(rows[0], rows[-1])]
+      if self.ndim > 1:
+        projections = general.projections(np.any(self.bits, axis=0), tuple(range(self.ndim - 1)))
+        for axis in range(1, self.ndim):
+          nonzeros = projections[axis - 1].nonzero()[0]
+          bounds.append((nonzeros[0], nonzeros[-1]))
+      self._nnzbounds = tuple(bounds)
+    return list(self._nnzbounds)
+
+  def nonzero(self):
+    return self.as_ndarray().nonzero()
+
+  def _contentFingerprint(self):
+    return (hashlib.sha1(self.bits.tobytes()).hexdigest(),)
+
+  def copy(self):
+    spp = type(self)(self.shape, self.bits.copy())
+    spp._fingerprint = self._fingerprint
+    spp._nnzbounds = self._nnzbounds
+    return spp
+
+  def reshape(self, shape):
+    return self.fromNdarray(self.as_ndarray().reshape(shape, order=general.NUMPY_DEFAULT_ORDER))
+
+  @_memoized
+  def transposed(self, perm):
+    perm = tuple(perm)
+    shape = tuple(self.shape[p] for p in perm)
+    if perm[0] == 0:
+      return type(self)(shape, self.bits.transpose(perm).copy())
+    bits = np.zeros(self.packedShape(shape), dtype=np.uint8)
+    index = [slice(None)] * self.ndim
+    axis = perm.index(0)
+    rows = self._slabRows()
+    for start in range(0, self.shape[0], rows):
+      stop = min(start + rows, self.shape[0])
+      index[axis] = slice(start, stop)
+      bits[tuple(index)] = np.packbits(self._slab(start, stop).transpose(perm), axis=0)
+    return type(self)(shape, bits)
+
+  @_memoized
+  def indexSum(self, sourceIndices, targetIndices):
+    source = str(sourceIndices)
+    target = str(targetIndices)
+    summed = tuple([axis for axis, index in enumerate(source) if index not in target])
+    remaining = ''.join([index for index in source if index in target])
+    perm = tuple([remaining.find(index) for index in target])
+    if 0 in summed:
+      # The leading axis is reduced bytewise, hence, the result is unpacked
+      reduced = np.bitwise_or.reduce(self.bits, axis=summed) != 0
+      return self.fromNdarray(reduced.transpose(perm))
+    bits = np.bitwise_or.reduce(self.bits, axis=summed) if summed else self.bits
+    shape = tuple([self.shape[source.find(index)] for index in remaining])
+    return type(self)(shape, bits).transposed(perm)
+
+  @staticmethod
+  def add(a1, a2):
+    assert(a1.shape == a2.shape)
+    return packed(a1.shape, np.bitwise_or(a1.bits, a2.bits))
+
+  @staticmethod
+  def einsum(description, a1, a2):
+    A, B, C = _parseEinsum(description)
+    sizes = dict(zip(A, a1.shape))
+    sizes.update(zip(B, a2.shape))
+    shape = tuple(sizes[index] for index in C)
+
+    # Slabs are taken along the leading index of a1
+    leading = A[0]
+    full2 = a2.as_ndarray() if leading not in B else None
+    bits = np.zeros(packed.packedShape(shape), dtype=np.uint8) if shape else np.zeros((), dtype=bool)
+    index = [slice(None)] * len(C)
+    rows = a1._slabRows()
+    for start in range(0, a1.shape[0], rows):
+      stop = min(start + rows, a1.shape[0])
+      slab2 = a2._slab(start, stop, B.find(leading)) if full2 is None else full2
+      result = np.einsum(description, a1._slab(start, stop), slab2)
+      if not shape:
+        bits |= result
+      elif leading in C:
+        index[C.find(leading)] = slice(start, stop) if C.find(leading) > 0 else slice(start // 8, (stop + 7) // 8)
+        bits[tuple(index)] = np.packbits(result, axis=0)
+      else:
+        bits |= np.packbits(result, axis=0)
+    return packed(shape, bits) if shape else general(bits)
+
+  @staticmethod
+  def array_equal(a1, a2):
+    return a1.shape == a2.shape and np.array_equal(a1.bits, a2.bits)
+
+  def as_general(self):
+    return general(self.as_ndarray())
+
+  def as_ndarray(self):
+    return np.asfortranarray(np.unpackbits(self.bits, axis=0, count=self.shape[0]).view(bool))
+
+  def __str__(self):
+    nnz = self.count_nonzero()
+    return f"packed(shape={self.shape}, size={self.size}, ndim={self.ndim}, nnz={nnz})"
+
+
+class boxed(ASpp):
+  """Sparsity pattern which is dense inside a bounding box and zero outside.
+
+  All operations except nonzero and as_ndarray only work on the bounds of the box.
+  """
+  def __init__(self, shape, bounds):
+    """bounds: list of half-open ranges (start, stop) for each dimension."""
+    super().__init__(shape)
+    box = tuple([(int(start), int(stop)) for start, stop in bounds])
+    assert len(box) == self.ndim and all([0 <= start and stop <= s for (start, stop), s in zip(box, shape)])
+    # A box which is empty in one dimension is empty in all dimensions
+    if any([start >= stop for start, stop in box]):
+      box = tuple([(0, 0)] * self.ndim)
+    self.box = box
+
+  @classmethod
+  def fromBoundingBox(cls, shape, boundingBox):
+    return cls(shape, [(r.start, r.stop) for r in boundingBox])
+
+  def _contentFingerprint(self):
+    return (self.box,)
+
+  def _slices(self):
+    return tuple([slice(start, stop) for start, stop in self.box])
+
+  def count_nonzero(self):
+    nnz = 1
+    for start, stop in self.box:
+      nnz *= stop - start
+    return nnz
+
+  def is_dense(self):
+    return all([start == 0 and stop == s for (start, stop), s in zip(self.box, self.shape)])
+
+  def nnzbounds(self):
+    return [(start, stop-1) for start, stop in self.box]
+
+  def nonzero(self):
+    # The lexicographic order of the entries in the box equals the order of nonzero()
+    inner = np.ones(tuple([stop - start for start, stop in self.box]), dtype=bool).nonzero()
+    return tuple([nz + start for nz, (start, stop) in zip(inner, self.box)])
+
+  def copy(self):
+    return type(self)(self.shape, self.box)
+
+  def reshape(self, shape):
+    if self.is_dense():
+      return type(self)(shape, [(0, s) for s in shape])
+    return self.as_general().reshape(shape)
+
+  def transposed(self, perm):
+    return type(self)(tuple(self.shape[p] for p in perm), [self.box[p] for p in perm])
+
+  def indexSum(self, sourceIndices, targetIndices):
+    source = str(sourceIndices)
+    find = lambda index: source.find(index)
+    if len(targetIndices) == 0:
+      return general(np.array(self.count_nonzero() > 0))
+    return type(self)(tuple(self.shape[find(index)] for index in str(targetIndices)),
+                         [self.box[find(index)] for index in str(targetIndices)])
+
+  @staticmethod
+  def add(a1, a2):
+    assert(a1.shape == a2.shape)
+    if a1.count_nonzero() == 0:
+      return a2.copy()
+    if a2.count_nonzero() == 0:
+      return a1.copy()
+    union = [(min(s1, s2), max(e1, e2)) for (s1, e1), (s2, e2) in zip(a1.box, a2.box)]
+    different = [axis for axis in range(a1.ndim) if a1.box[axis] != a2.box[axis]]
+    # The union of two boxes is a box if one contains the other or if they only
+    # differ in one dimension in which they overlap or touch
+    contains = lambda b1, b2: all([s1 <= s2 and e2 <= e1 for (s1, e1), (s2, e2) in zip(b1, b2)])
+    if contains(a1.box, a2.box) or contains(a2.box, a1.box) or \
+       (len(different) == 1 and max(a1.box[different[0]][0], a2.box[different[0]][0]) <= min(a1.box[different[0]][1], a2.box[different[0]][1])):
+      return boxed(a1.shape, union)
+    cls = packed if a1.size > packed.THRESHOLD else general
+    castMethod = 'as_' + cls.__name__
+    return cls.add(getattr(a1, castMethod)(), getattr(a2, castMethod)())
+
+  @staticmethod
+  def einsum(description, a1, a2):
+    A, B, C = _parseEinsum(description)
+    sizes = dict(zip(A, a1.shape))
+    sizes.update(zip(B, a2.shape))
+    # The product of two boxes is a box in the union of their indices, and its
+    # index sum is the projection of the box (or empty if the box is empty)
+    ranges = dict(zip(A, a1.box))
+    for index, (start, stop) in zip(B, a2.box):
+      if index in ranges:
+        start, stop = max(start, ranges[index][0]), min(stop, ranges[index][1])
+      ranges[index] = (start, stop)
+    isEmpty = any([start >= stop for start, stop in ranges.values()])
+    shape = tuple(sizes[index] for index in C)
+    if len(C) == 0:
+      return general(np.array(not isEmpty))
+    return boxed(shape, [ranges[index] if not isEmpty else (0, 0) for index in C])
+
+  @staticmethod
+  def einsumGeneral(description, a1, a2):
+    """einsum of a general and a boxed pattern, where the boxed pattern is not materialized."""
+    A, B, C = _parseEinsum(description)
+    if not isinstance(a1, general):
+      a1, a2, A, B = a2, a1, B, A
+    a2 = a2.as_boxed() if isinstance(a2, dense) else a2
+    pattern = a1.pattern
+    ranges = dict(zip(B, a2.box))
+    if a2.count_nonzero() == 0:
+      pattern = np.zeros_like(pattern)
+    else:
+      # Entries outside the box are multiplied by zero
+      restriction = tuple([slice(*ranges[index]) if index in ranges else slice(None) for index in A])
+      if any([r != slice(None) and (r.start, r.stop) != (0, s) for r, s in zip(restriction, a1.shape)]):
+        pattern = np.zeros_like(pattern)
+        pattern[restriction] = a1.pattern[restriction]
+    remaining = ''.join([index for index in A if index in C])
+    summed = tuple([axis for axis, index in enumerate(A) if index not in C])
+    reduced = pattern.any(axis=summed) if summed else pattern
+
+    sizes = dict(zip(A, a1.shape))
+    sizes.update(zip(B, a2.shape))
+    result = np.zeros(tuple(sizes[index] for index in C), dtype=bool, order=general.NUMPY_DEFAULT_ORDER)
+    # Indices which only appear in the boxed pattern are broadcast inside the box
+    broadcast = [axis for axis, index in enumerate(C) if index not in A]
+    reduced = reduced.transpose(tuple([remaining.find(index) for index in C if index in A]))
+    result[tuple([slice(*ranges[index]) if index not in A else slice(None) for index in C])] = np.expand_dims(reduced, tuple(broadcast))
+    return general(result)
+
+  @staticmethod
+  def array_equal(a1, a2):
+    return a1.shape == a2.shape and a1.box == a2.box
+
+  def as_general(self):
+    return general(self.as_ndarray())
+
+  def as_packed(self):
+    rows = np.zeros(self.shape[0], dtype=bool)
+    rows[slice(*self.box[0])] = True
+    bits = np.zeros(packed.packedShape(self.shape), dtype=np.uint8)
+    bits[(slice(None),) + self._slices()[1:]] = np.expand_dims(np.packbits(rows), tuple(range(1, self.ndim)))
+    return packed(self.shape, bits)
+
+  def as_ndarray(self):
+    A = np.zeros(self.shape, dtype=bool, order=general.NUMPY_DEFAULT_ORDER)
+    A[self._slices()] = True
+    return A
+
+  def __str__(self):
+    return f"boxed(shape={self.shape}, size={self.size}, ndim={self.ndim}, box={self.box})"
+
 _binary_op = {
   (dense, dense): dense,
   (dense, general): general,
   (general, dense): general,
-  (general, general): general
+  (general, general): general,
+  (dense, packed): packed,
+  (packed, dense): packed,
+  (general, packed): packed,
+  (packed, general): packed,
+  (packed, packed): packed,
+  (dense, boxed): boxed,
+  (boxed, dense): boxed,
+  (boxed, boxed): boxed,
+  (boxed, general): general,
+  (general, boxed): general,
+  (boxed, packed): packed,
+  (packed, boxed): packed
 }
 
-def dispatch(a1, a2):
+def dispatch(a1, a2, size=0):
   cls = _binary_op[(a1.__class__, a2.__class__)]
+  if a1.ndim == 0 or a2.ndim == 0:
+    cls = dense if cls is dense else general
+  elif cls is general and max(a1.size, a2.size, size) > packed.THRESHOLD:
+    cls = packed
   castMethod = 'as_' + cls.__name__
   c1 = getattr(a1, castMethod, a1.identity)
   c2 = getattr(a2, castMethod, a2.identity)
@@ -208,8 +679,23 @@ def add(a1, a2):
   return cls.add(a1, a2)
 
 def einsum(description, a1, a2):
-  cls, a1, a2 = dispatch(a1, a2)
-  return cls.einsum(description, a1, a2)
+  # Operations on dense and boxed patterns are cheaper than a lookup
+  if isinstance(a1, (general, packed)) or isinstance(a2, (general, packed)):
+    return memo.get(('einsum', description, a1.fingerprint(), a2.fingerprint()), lambda: _einsum(description, a1, a2))
+  return _einsum(description, a1, a2)
+
+def _einsum(description, a1, a2):
+  A, B, C = _parseEinsum(description)
+  sizes = dict(zip(A, a1.shape))
+  sizes.update(zip(B, a2.shape))
+  size = 1
+  for index in C:
+    size *= sizes[index]
+  cls, c1, c2 = dispatch(a1, a2, size)
+  # The dense or boxed side of mixed operands is not materialized
+  if cls is general and a1.ndim > 0 and a2.ndim > 0 and {type(a1), type(a2)} & {dense, boxed}:
+    return boxed.einsumGeneral(description, a1, a2)
+  return cls.einsum(description, c1, c2)
 
 def array_equal(a1, a2):
   if a1 == None and a2 == None:
@@ -1,9 +1,17 @@
-from .indices import BoundingBox
-from .node import IndexSum
+import functools
+from .indices import BoundingBox, LoGCost
+from .node import IndexSum, IndexedTensor, LoopOverGEMM
+from ..gemm_configuration import BLASlike, CodeGenerator
 from abc import ABC, abstractmethod
 
 
 class CostEstimator(ABC):
+  def isContextFree(self):
+    """Tells whether the cost of a product only depends on the sets of terms of its
+    operands, i.e., neither on the shape of the operands' trees nor on previous
+    estimates. opt.strengthReduction relies on this property."""
+    return True
+
   def estimate(self, node):
     childCost = 0
     for child in node:
@@ -54,13 +62,13 @@ class BoundingBoxCostEstimator(CachedCostEstimator):
     self._cache[node] = node.boundingBox()
     return 0
 
-  def estimate_Product(self, node):
+  def _productBoundingBox(self, node, indices):
     lbb = self._cache[node.leftTerm()]
     rbb = self._cache[node.rightTerm()]
     lind = node.leftTerm().indices
     rind = node.rightTerm().indices
     ranges = list()
-    for index in node.indices:
+    for index in indices:
       if index in lind and index in rind:
         lpos = lind.find(index)
         rpos = rind.find(index)
@@ -71,7 +79,10 @@ class BoundingBoxCostEstimator(CachedCostEstimator):
         ranges.append(rbb[rind.find(index)])
       else:
         raise RuntimeError('Not supposed to happen.')
-    bb = BoundingBox(ranges)
+    return BoundingBox(ranges)
+
+  def estimate_Product(self, node):
+    bb = self._productBoundingBox(node, node.indices)
     self._cache[node] = bb
 
     return bb.size()
@@ -84,6 +95,145 @@ class BoundingBoxCostEstimator(CachedCostEstimator):
     return tbb.size() - bb.size()
 
 
+@functools.total_ordering
+class MemoryAwareCost(object):
+  """Cost which is ordered lexicographically by (excess, flops).
+
+  excess: Memory of temporaries which exceeds the memory cap (lower is better)
+  flops: Operation count including the weighted size of temporaries (lower is better)
+  """
+  def __init__(self, excess=0, flops=0):
+    self._excess = excess
+    self._flops = flops
+
+  def excess(self):
+    return self._excess
+
+  def flops(self):
+    return self._flops
+
+  def _totuple(self):
+    return (self._excess, self._flops)
+
+  def __lt__(self, other):
+    return self._totuple() < other._totuple()
+
+  def __eq__(self, other):
+    return self._totuple() == other._totuple()
+
+  def __add__(self, other):
+    return MemoryAwareCost(self._excess + other._excess, self._flops + other._flops)
+
+  def __radd__(self, other):
+    # Allows sum() and CostEstimator.estimate, which start with 0
+    assert other == 0
+    return self
+
+  def __sub__(self, other):
+    return MemoryAwareCost(self._excess - other._excess, self._flops - other._flops)
+
+  def __repr__(self):
+    return '{{excess: {}, flops: {}}}'.format(self._excess, self._flops)
+
+
+class MemoryAwareCostEstimator(BoundingBoxCostEstimator):
+  """Bounding box flops with a cap on the memory of temporaries.
+
+  Every non-leaf operand of a product is a temporary whose size is given by its
+  bounding box. Temporaries larger than memoryCap (in bytes) are penalized
+  such that the cheapest tree whose temporaries fit is selected; if no such tree exists,
+  the tree with least excess memory is selected. memoryWeight trades flops for the
+  total temporary footprint (flops per temporary value).
+  As StrengthReduction instantiates the estimator without arguments, use e.g.
+  functools.partial(MemoryAwareCostEstimator, memoryCap=2**30).
+  """
+  def __init__(self, memoryCap=None, memoryWeight=0, bytesPerReal=8):
+    super().__init__()
+    self._memoryCap = memoryCap
+    self._memoryWeight = memoryWeight
+    self._bytesPerReal = bytesPerReal
+    self._temporaries = dict()
+
+  def temporaries(self, node):
+    """Returns (size of largest temporary, total size of temporaries) in number of values."""
+    return self._temporaries[node]
+
+  def generic_estimate(self, node):
+    super().generic_estimate(node)
+    self._temporaries[node] = (0, 0)
+    return MemoryAwareCost()
+
+  def estimate_Product(self, node):
+    flops = super().estimate_Product(node)
+    largest = 0
+    total = 0
+    excess = 0
+    newTotal = 0
+    for child in node:
+      childLargest, childTotal = self._temporaries[child]
+      largest = max(largest, childLargest)
+      total += childTotal
+      if not isinstance(child, IndexedTensor):
+        size = self._cache[child].size()
+        largest = max(largest, size)
+        newTotal += size
+        if self._memoryCap is not None:
+          excess += max(0, size * self._bytesPerReal - self._memoryCap)
+    self._temporaries[node] = (largest, total + newTotal)
+    return MemoryAwareCost(excess, flops + self._memoryWeight * newTotal)
+
+  def estimate_IndexSum(self, node):
+    flops = super().estimate_IndexSum(node)
+    # Sums are fused with the preceding product, thus, no new temporary
+    self._temporaries[node] = self._temporaries[node.term()]
+    return MemoryAwareCost(0, flops)
+
+
+class RooflineCostEstimator(BoundingBoxCostEstimator):
+  """Estimates the run-time in nanoseconds with the roofline model.
+
+  The time of an operation is max(flops / peak flops, bytes / bandwidth), where the
+  bandwidth is the one of the innermost memory level which holds the operands.
+  Flops and operand sizes are given by bounding boxes. Temporaries are counted twice
+  as they are written and read. Sums are fused with the preceding product, hence,
+  they add flops but no memory traffic.
+  As StrengthReduction instantiates the estimator without arguments, use
+  functools.partial(RooflineCostEstimator, arch).
+  """
+  def __init__(self, arch):
+    super().__init__()
+    self._arch = arch
+
+  def _time(self, flops, numReals):
+    numBytes = numReals * self._arch.bytesPerReal
+    return max(flops / self._arch.peakFlops(), numBytes / self._arch.bandwidth(numBytes))
+
+  def _operandReals(self, node):
+    numReals = 0
+    for child in node:
+      size = self._cache[child].size()
+      numReals += size if isinstance(child, IndexedTensor) else 2 * size
+    return numReals
+
+  def estimate_Product(self, node):
+    flops = super().estimate_Product(node)
+    return self._time(flops, self._operandReals(node))
+
+  def estimate_IndexSum(self, node):
+    flops = super().estimate_IndexSum(node)
+    return self._time(flops, 0)
+
+  def estimate_LoopOverGEMM(self, node):
+    lind = node.leftTerm().indices
+    productIndices = lind.merged(node.rightTerm().indices - lind)
+    productSize = self._productBoundingBox(node, productIndices).size()
+    bb = self._productBoundingBox(node, node.indices)
+    self._cache[node] = bb
+    # Multiplications plus additions of the summed products
+    flops = 2 * productSize - bb.size()
+    return self._time(flops, self._operandReals(node) + bb.size())
+
+
 class FusedGemmsBoundingBoxCostEstimator(BoundingBoxCostEstimator):
   """Estimates num. of hardware flops for a tensor operation per GPU thread.
   Therefore, results of BoundingBoxCostEstimator are divided by a size
@@ -96,6 +246,10 @@ class FusedGemmsBoundingBoxCostEstimator(BoundingBoxCostEstimator):
     self._lead_dim = 0
     self._loaded_to_gpu_cache = set()
 
+  def isContextFree(self):
+    # Costs depend on the leading index of the operands and on previously loaded tensors
+    return False
+
   def _get_terms(self, node):
     left_indices = node.leftTerm().indices
     right_indices = node.rightTerm().indices
@@ -166,3 +320,161 @@ class ExactCost(CachedCostEstimator):
     spp = node.computeSparsityPattern(termSpp)
     self._cache[node] = spp    
     return termSpp.count_nonzero() - spp.count_nonzero()
+
+
+class LoGCostModel(object):
+  """Ranks loops over GEMMs by LoGCost, i.e. lexicographically by (non-unit stride,
+  transposes, fused indices).
+
+  Cost models are used by LoG and FindIndexPermutations, where A, B, and C are the
+  index strings of the GEMM's operands and result, m, n, and k are the fused indices
+  of the GEMM, and sizes maps indices to their sizes. Costs must be totally ordered and
+  additive, where adding a cost must preserve the order. If C is None, gemm must return
+  a lower bound for all permutations of the result.
+  """
+  def zero(self):
+    return LoGCost.addIdentity()
+
+  def gemm(self, A, B, C, m, n, k, sizes):
+    """Cost of a loop over GEMMs."""
+    return LoopOverGEMM.gemmCost(A, B, m, n, k)
+
+  def transpose(self, numReals):
+    """Cost of permuting the indices of a tensor with numReals entries."""
+    return LoGCost(0,1,0,0)
+
+  def key(self, perm, indices):
+    """Properties of an index permutation, besides the fused indices, which the cost depends on."""
+    return ()
+
+
+class RooflineLoGCostModel(LoGCostModel):
+  """Predicts the run-time of a loop over GEMMs in nanoseconds.
+
+  Every GEMM costs CALL_OVERHEAD plus its roofline time, multiplied by the loop trip
+  count. The peak flops are scaled by the efficiency of the GemmTool which supports
+  the GEMM (GENERIC_EFFICIENCY if there is none), by the SIMD utilization of m, by
+  TRANSPOSE_EFFICIENCY per transposed operand, and by NON_UNIT_STRIDE_EFFICIENCY per
+  operand whose rows are not contiguous. Memory traffic is counted in cache lines,
+  such that leading dimensions larger than the number of rows waste bandwidth, where
+  the columns are packed if the indices of rows and columns are adjacent.
+
+  Efficiencies may be calibrated per GemmTool class with efficiencies, e.g.
+  {LIBXSMM: 0.8}; all efficiencies must be at most 1.
+  """
+  CALL_OVERHEAD = 10.0
+  GENERIC_EFFICIENCY = 0.25
+  TRANSPOSE_EFFICIENCY = 0.9
+  NON_UNIT_STRIDE_EFFICIENCY = 0.25
+  DEFAULT_EFFICIENCIES = {CodeGenerator: 1.0, BLASlike: 0.5}
+
+  def __init__(self, arch, gemm_cfg=None, target='cpu', efficiencies=None):
+    self._arch = arch
+    self._gemm_cfg = gemm_cfg
+    self._target = target
+    self._efficiencies = dict(self.DEFAULT_EFFICIENCIES)
+    if efficiencies is not None:
+      self._efficiencies.update(efficiencies)
+    if any(efficiency > 1.0 for efficiency in self._efficiencies.values()):
+      raise ValueError('Efficiencies must be at most 1.')
+    self._tools = dict()
+    self._gemms = dict()
+    self._results = dict()
+    self._sizes = (None, None)
+
+  def __getstate__(self):
+    # Caches must not change the kernel cache keys
+    state = dict(self.__dict__)
+    state['_tools'] = dict()
+    state['_gemms'] = dict()
+    state['_results'] = dict()
+    state['_sizes'] = (None, None)
+    return state
+
+  def zero(self):
+    return 0.0
+
+  @staticmethod
+  def _size(indices, sizes):
+    size = 1
+    for index in indices:
+      size *= sizes[index]
+    return size
+
+  def _sizesKey(self, sizes):
+    # The same sizes are passed for all GEMMs of a contraction
+    if self._sizes[0] is not sizes:
+      self._sizes = (sizes, tuple(sorted(sizes.items())))
+    return self._sizes[1]
+
+  def _toolEfficiency(self, m, n, k, transA, transB):
+    key = (m, n, k, transA, transB)
+    if key not in self._tools:
+      tool = None
+      if self._gemm_cfg is not None:
+        tool = self._gemm_cfg.findGemmTool(m, n, k, False, False, transA, transB,
+                                           1.0, 1.0, False, False, self._target)
+      efficiency = self.GENERIC_EFFICIENCY
+      if tool is not None:
+        for cls in type(tool).__mro__:
+          if cls in self._efficiencies:
+            efficiency = self._efficiencies[cls]
+            break
+      self._tools[key] = efficiency
+    return self._tools[key]
+
+  def _lines(self, rows, cols, packed):
+    """Reals which are transferred for a rows x cols matrix."""
+    lineReals = self._arch.alignedReals
+    if packed or cols == 1:
+      return -(-rows * cols // lineReals) * lineReals
+    return cols * -(-rows // lineReals) * lineReals
+
+  def _time(self, flops, efficiency, numReals):
+    numBytes = numReals * self._arch.bytesPerReal
+    return max(flops / (efficiency * self._arch.peakFlops()), numBytes / self._arch.bandwidth(numBytes))
+
+  def _stored(self, perm, rows, cols, trans, sizes):
+    """Transferred reals and whether the rows are contiguous for a GEMM operand."""
+    first, second = (cols, rows) if trans else (rows, cols)
+    contiguous = len(first) == 0 or perm[0] == first[0]
+    packed = len(first) == 0 or len(second) == 0 or perm.find(second[0]) == perm.find(first[-1]) + 1
+    return self._lines(self._size(first, sizes), self._size(second, sizes), packed), contiguous
+
+  def _operands(self, A, B, m, n, k, sizes):
+    """Returns (M, N, K, loops, efficiency, transferred reals of A and B)."""
+    key = (A, B, m, n, k, self._sizesKey(sizes))
+    if key not in self._gemms:
+      transA, transB = LoopOverGEMM.transposes(A, B, m, n, k)
+      M, N, K = (self._size(x, sizes) for x in (m, n, k))
+      loops = self._size(set(A) | set(B), sizes) // (M * N * K)
+      Areals, Acontiguous = self._stored(A, m, k, transA, sizes)
+      Breals, Bcontiguous = self._stored(B, k, n, transB, sizes)
+
+      vectorLength = self._arch.alignedReals
+      simd = M / (-(-M // vectorLength) * vectorLength)
+      efficiency = self._toolEfficiency(M, N, K, transA, transB) * simd
+      efficiency *= self.TRANSPOSE_EFFICIENCY ** (int(transA) + int(transB))
+      efficiency *= self.NON_UNIT_STRIDE_EFFICIENCY ** (int(not Acontiguous) + int(not Bcontiguous))
+      self._gemms[key] = (M, N, K, loops, efficiency, Areals + Breals)
+    return self._gemms[key]
+
+  def gemm(self, A, B, C, m, n, k, sizes):
+    M, N, K, loops, efficiency, ABreals = self._operands(str(A), str(B), m, n, k, sizes)
+    # C is packed in the lower bound
+    if C is None:
+      Creals = self._lines(M, N, True)
+    else:
+      key = (str(C), m, n, self._sizesKey(sizes))
+      if key not in self._results:
+        self._results[key] = self._stored(key[0], m, n, False, sizes)[0]
+      Creals = self._results[key]
+    # C is read and written
+    time = self._time(2 * M * N * K, efficiency, ABreals + 2 * Creals)
+    return loops * (self.CALL_OVERHEAD + time)
+
+  def transpose(self, numReals):
+    return self._time(0, 1.0, 2 * numReals)
+
+  def key(self, perm, indices):
+    return (frozenset((x, y) for x, y in zip(perm[:-1], perm[1:]) if x in indices and y in indices),)
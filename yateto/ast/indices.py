@@ -132,7 +132,7 @@ class BoundingBox(object):
 
   @classmethod
   def fromSpp(cls, spp):
-    return cls([Range(m, M+1) for m, M in spp.nnzbounds()])
+    return spp.boundingBox()
 
   def size(self):
     s = 1
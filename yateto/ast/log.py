@@ -1,6 +1,6 @@
-import copy, re
+import copy
 from .node import LoopOverGEMM
-from .indices import LoGCost
+from .cost import LoGCostModel
 
 def allSubstrings(s):
   L = len(s)
@@ -22,7 +22,60 @@ def fusedVariants(memLayout, I, P, M, prune = False):
   D = set([d for d in D if memLayout.mayFuse(sorted([P[i] for i in d]))])  
   return D
 
-def LoG(contraction, Aperm = None, Bperm = None, Cperm = None):
+def gemmIndices(A, B, C):
+  """Returns whether LoG swaps A and B for C = A B and the index sets Im, In, and Ik of the GEMM."""
+  Icommon = set(A) & set(B) & set(C)
+  C_gemm = ''.join(idx for idx in C if idx not in Icommon)
+  swap = len(C_gemm) > 0 and C_gemm[0] in set(B)
+  if swap:
+    A, B = B, A
+  Im = (set(A) & set(C)) - Icommon
+  In = (set(B) & set(C)) - Icommon
+  Ik = (set(A) & set(B)) - Icommon
+  return swap, Im, In, Ik
+
+def operandClass(memLayout, perm, first, second):
+  """Permutations of a GEMM operand with equal class yield LoGs of equal cost.
+
+  first and second are Im and Ik for A, and Ik and In for B, respectively.
+  """
+  P = {idx: pos for pos, idx in enumerate(perm)}
+  return (frozenset(fusedVariants(memLayout, first, P, perm)),
+          frozenset(fusedVariants(memLayout, second, P, perm)),
+          perm[:1],
+          frozenset((x, y) for x in first for y in second if P[x] > P[y]))
+
+def resultClass(memLayout, perm, Im, In):
+  """Permutations of a GEMM result with equal class yield LoGs of equal cost."""
+  P = {idx: pos for pos, idx in enumerate(perm)}
+  return (frozenset(fusedVariants(memLayout, Im, P, perm, True)), frozenset(fusedVariants(memLayout, In, P, perm)))
+
+def indexSizes(*indices):
+  """Maps every index of the given Indices to its size."""
+  return {idx: I.indexSize(idx) for I in indices for idx in I}
+
+def minGemm(A, B, C, MC, NC, KC, model, sizes):
+  """Cheapest choice (cost, (m, n, k)) of fused indices w.r.t. model, where (None, None) means there is none."""
+  if MC == set():
+    MC = ['']
+  if NC == set():
+    NC = ['']
+
+  minCost = None
+  minMNK = None
+  for m in sorted(MC):
+    for n in sorted(NC):
+      for k in sorted(KC):
+        cost = model.gemm(A, B, C, m, n, k, sizes)
+        if minCost is None or cost < minCost:
+          minCost = cost
+          minMNK = (m, n, k)
+  return minCost, minMNK
+
+def LoG(contraction, Aperm = None, Bperm = None, Cperm = None, model = None):
+  """Implements a contraction as loop over GEMMs whose cost w.r.t. model (default: LoGCostModel) is minimal."""
+  if model is None:
+    model = LoGCostModel()
   L = contraction.leftTerm()
   R = contraction.rightTerm()
   I = contraction
@@ -42,17 +95,10 @@ def LoG(contraction, Aperm = None, Bperm = None, Cperm = None):
   C = I.indices.tostring()
 
 
-  Icommon = set(A) & set(B) & set(C)
-  C_gemm = C
-  if Icommon:
-    C_gemm = re.sub(r'[{}]'.format(''.join(Icommon)), '', C_gemm) # delete indices in Icommon
-  if len(C_gemm) > 0:
-    if C_gemm[0] in set(B):
-      B, A = A, B
-      R, L = L, R
-  Im = (set(A) & set(C)) - Icommon
-  In = (set(B) & set(C)) - Icommon
-  Ik = (set(A) & set(B)) - Icommon
+  swap, Im, In, Ik = gemmIndices(A, B, C)
+  if swap:
+    B, A = A, B
+    R, L = L, R
   
   PA = {idx: pos for pos, idx in enumerate(A)}
   PB = {idx: pos for pos, idx in enumerate(B)}
@@ -65,25 +111,10 @@ def LoG(contraction, Aperm = None, Bperm = None, Cperm = None):
   BK = fusedVariants(R.memoryLayout(), Ik, PB, B)
   BN = fusedVariants(R.memoryLayout(), In, PB, B)
   
-  MC = CM & AM
-  NC = CN & BN
-  KC = AK & BK
-
-  if MC == set():
-    MC = ['']
-  if NC == set():
-    NC = ['']
-
-  minCost = LoGCost()
-  minLog = None
-  for m in sorted(MC):
-    for n in sorted(NC):
-      for k in sorted(KC):
-        log = LoopOverGEMM(I.indices, L, R, m, n, k)
-        cost = log.cost()
-        if cost < minCost:
-          minCost = cost
-          minLog = log
-  if minLog:
-    minLog.setMemoryLayout( I.memoryLayout() )
+  sizes = indexSizes(L.indices, R.indices, I.indices)
+  minCost, minMNK = minGemm(L.indices, R.indices, I.indices, CM & AM, CN & BN, AK & BK, model, sizes)
+  if minMNK is None:
+    return None
+  minLog = LoopOverGEMM(I.indices, L, R, *minMNK)
+  minLog.setMemoryLayout( I.memoryLayout() )
   return minLog
@@ -149,6 +149,8 @@ class Op(Node):
     self._children = list(args)
     self._memoryLayout = None
     self.prefetch = None
+    # True if the memory layout was chosen by the index permutation search
+    self.selectedMemoryLayout = False
   
   def memoryLayout(self):
     return self._memoryLayout
@@ -284,9 +286,11 @@ class Assign(BinOp):
     return self.permute(self.rightTerm().indices, spp)
 
 class Permute(UnaryOp):
-  def __init__(self, term, targetIndices):
+  def __init__(self, term, targetIndices, blockTranspose=False):
     super().__init__(term)
     self.indices = targetIndices
+    # Generate a cache-blocked transpose regardless of the size (see copyscaleadd)
+    self.blockTranspose = blockTranspose
 
   def nonZeroFlops(self):
     return 0
@@ -296,6 +300,13 @@ class Permute(UnaryOp):
     spp = spps[0] if len(spps) == 1 else self.term().eqspp()
     return self.permute(self.term().indices, spp)
 
+def permuted(term, perm, blockTranspose=False):
+  """Returns a Permute of term to the index permutation perm with its sparsity pattern and memory layout."""
+  permute = Permute(term, term.indices.permuted(perm), blockTranspose)
+  permute.setEqspp(permute.computeSparsityPattern())
+  permute.computeMemoryLayout()
+  return permute
+
 def _productContractionLoGSparsityPattern(node, *spps):
   if len(spps) == 0:
     spps = (node.leftTerm().eqspp(), node.rightTerm().eqspp())
@@ -377,13 +388,26 @@ class LoopOverGEMM(BinOp):
         dim(m) != 0 and dim(n) != 0: (m x k) = (m x k or k x n) * (k x n or n x k)
             => Transpose A if k precedes m, transpose B if n precedes k (GEMM)
     """
-    self._transA = self.hasDimensionZero(m) or aTerm.indices.find(m[0]) > aTerm.indices.find(k[0])
-    self._transB = not self.hasDimensionZero(n) and bTerm.indices.find(k[0]) > bTerm.indices.find(n[0])
+    self._transA, self._transB = self.transposes(aTerm.indices, bTerm.indices, m, n, k)
 
   @staticmethod
   def hasDimensionZero(x):
     return len(x) == 0
 
+  @classmethod
+  def transposes(cls, A, B, m, n, k):
+    transA = cls.hasDimensionZero(m) or A.find(m[0]) > A.find(k[0])
+    transB = not cls.hasDimensionZero(n) and B.find(k[0]) > B.find(n[0])
+    return transA, transB
+
+  @classmethod
+  def gemmCost(cls, A, B, m, n, k):
+    """Cost of a LoopOverGEMM with operand indices A and B, without constructing it."""
+    transA, transB = cls.transposes(A, B, m, n, k)
+    AstrideOne = (A.find(m[0]) == 0) if not transA else (A.find(k[0]) == 0)
+    BstrideOne = (B.find(k[0]) == 0) if not transB else (B.find(n[0]) == 0)
+    return LoGCost(int(not AstrideOne) + int(not BstrideOne), int(transA), int(transB), len(m) + len(n) + len(k))
+
   def nonZeroFlops(self):
     p = Product(self.leftTerm(), self.rightTerm())
     p.setEqspp( p.computeSparsityPattern() )
@@ -396,12 +420,7 @@ class LoopOverGEMM(BinOp):
     return _productContractionLoGSparsityPattern(self, *spps)
   
   def cost(self):
-    A = self.leftTerm().indices
-    B = self.rightTerm().indices
-    AstrideOne = (A.find(self._m[0]) == 0) if not self._transA else (A.find(self._k[0]) == 0)
-    BstrideOne = (B.find(self._k[0]) == 0) if not self._transB else (B.find(self._n[0]) == 0)
-    cost = LoGCost(int(not AstrideOne) + int(not BstrideOne), int(self._transA), int(self._transB), len(self._m) + len(self._n) + len(self._k))
-    return cost
+    return self.gemmCost(self.leftTerm().indices, self.rightTerm().indices, self._m, self._n, self._k)
   
   def loopIndices(self):
     i1 = self.indices - (self._m + self._n)
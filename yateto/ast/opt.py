@@ -1,9 +1,65 @@
+import math
 import sys
-from .node import IndexSum, Product
 from copy import deepcopy
+from .node import IndexSum, Product
+
+OPTIMAL = 'optimal'
+GREEDY = 'greedy'
+BEAM = 'beam'
+AUTO = 'auto'
+PLANNERS = (AUTO, OPTIMAL, GREEDY, BEAM)
+
+# Maximum number of subset splits (or trees) the optimal planner may visit when planner = AUTO
+NODE_BUDGET = 200000
+BEAM_WIDTH = 8
+
+
+def _sumIndices(term, indices):
+  for index in term.indices:
+    if index in indices:
+      term = IndexSum(term, index)
+  return term
+
+class _TermSubsets(object):
+  """Subsets of terms represented as bit masks with memoized index sets."""
+  def __init__(self, terms, target_indices):
+    self.terms = terms
+    self.full = (1 << len(terms)) - 1
+    self._target = set(target_indices)
+    self._indices = {0: frozenset()}
+
+  def indices(self, mask):
+    if mask not in self._indices:
+      low = mask & -mask
+      self._indices[mask] = self.indices(mask ^ low) | frozenset(self.terms[low.bit_length()-1].indices)
+    return self._indices[mask]
 
+  def summationIndices(self, mask):
+    """Indices which neither appear in another term nor in the target indices."""
+    return self.indices(mask) - self.indices(self.full ^ mask) - self._target
 
-def strengthReduction(terms, target_indices, cost_estimator, split = 0):
+  def leaf(self, i):
+    return _sumIndices(self.terms[i], self.summationIndices(1 << i))
+
+  def product(self, left, right, mask):
+    return _sumIndices(Product(left, right), self.summationIndices(mask))
+
+def optimalSearchSize(numTerms, contextFree=True):
+  """Number of splits visited by strengthReduction (upper bound).
+
+  If the cost estimator is not context-free, the number of trees visited by
+  exhaustiveStrengthReduction is returned.
+  """
+  if not contextFree:
+    return math.factorial(numTerms) * math.factorial(numTerms - 1) // 2**(numTerms - 1)
+  return (3**numTerms + 1) // 2 - 2**numTerms
+
+def exhaustiveStrengthReduction(terms, target_indices, cost_estimator, split = 0):
+  """Finds the cheapest binary product tree by enumerating all trees.
+
+  Every tree is estimated with a copy of the cost estimator, hence, the estimator may
+  depend on context outside a subtree.
+  """
   n = len(terms)
   
   indexList = [index for term in terms for index in term.indices]
@@ -34,10 +90,10 @@ def strengthReduction(terms, target_indices, cost_estimator, split = 0):
       prodCost = deepcopy(cost_estimator).estimate(mulTerm)
       if best == None or prodCost < minCost:
         selection = set(range(n)) - set([i,j])
-        tree = strengthReduction([terms[i] for i in selection] + [mulTerm],
-                                 deepcopy(target_indices),
-                                 cost_estimator,
-                                 j-1)
+        tree = exhaustiveStrengthReduction([terms[i] for i in selection] + [mulTerm],
+                                           deepcopy(target_indices),
+                                           cost_estimator,
+                                           j-1)
 
         cost_estimator_copy = deepcopy(cost_estimator)
         treeCost = cost_estimator_copy.estimate(tree)
@@ -47,3 +103,116 @@ def strengthReduction(terms, target_indices, cost_estimator, split = 0):
           cost_estimator = cost_estimator_copy
 
   return best
+
+def strengthReduction(terms, target_indices, cost_estimator):
+  """Finds the cheapest binary product tree for the product of terms.
+
+  Dynamic programming over subsets of terms, where subsets are represented as
+  bit masks: The optimal tree for a subset is the cheapest product of the optimal
+  trees of two complementary subsets. An index is summed as soon as it does neither
+  appear in another term nor in target_indices.
+  Trees and, hence, the cost estimator's caches are shared among subsets, thus the
+  cost estimator must be context-free (see CostEstimator.isContextFree). Otherwise,
+  exhaustiveStrengthReduction is used.
+  """
+  if not cost_estimator.isContextFree():
+    return exhaustiveStrengthReduction(terms, target_indices, cost_estimator)
+
+  n = len(terms)
+  subsets = _TermSubsets(terms, target_indices)
+  full = subsets.full
+
+  best = [None] * (1 << n)
+  for i in range(n):
+    tree = subsets.leaf(i)
+    best[1 << i] = (cost_estimator.estimate(tree), tree)
+
+  for mask in range(1, full + 1):
+    if best[mask] is not None:
+      continue
+    low = mask & -mask
+    rest = mask ^ low
+    minCost = None
+    minTree = None
+    # Left subsets always contain the lowest term such that every split is visited once.
+    # On ties, large left subsets are preferred, i.e. the leading terms are multiplied first.
+    subs = [0]
+    sub = rest
+    while sub != 0:
+      subs.append(sub)
+      sub = (sub - 1) & rest
+    subs.sort(key=lambda sub: (-bin(sub).count('1'), sub))
+    for sub in subs:
+      left = sub | low
+      right = mask ^ left
+      if right == 0:
+        continue
+      lowerBound = best[left][0] + best[right][0]
+      if minCost is None or lowerBound < minCost:
+        tree = subsets.product(best[left][1], best[right][1], mask)
+        cost = cost_estimator.estimate(tree)
+        if minCost is None or cost < minCost:
+          minCost = cost
+          minTree = tree
+    best[mask] = (minCost, minTree)
+
+  return best[full][1]
+
+def beamStrengthReduction(terms, target_indices, cost_estimator, width=BEAM_WIDTH):
+  """Heuristic search for a cheap binary product tree.
+
+  A state is a forest of product trees which covers all terms. Starting from the
+  terms, every state is expanded by multiplying two of its trees, and only the width
+  cheapest states are kept. Outer products are only formed if no two trees share
+  an index. The number of cost estimates is O(width * n^3).
+  """
+  n = len(terms)
+  subsets = _TermSubsets(terms, target_indices)
+
+  leaves = [(1 << i, subsets.leaf(i)) for i in range(n)]
+  beam = [(sum(cost_estimator.estimate(tree) for _, tree in leaves), leaves)]
+  products = dict()
+  for step in range(n - 1):
+    candidates = dict()
+    for cost, forest in beam:
+      pairs = [(i,j) for i in range(len(forest)) for j in range(i+1, len(forest))]
+      # Outer products are only considered if no pair shares an index
+      connected = [(i,j) for i,j in pairs if set(forest[i][1].indices) & set(forest[j][1].indices)]
+      for i,j in (connected if connected else pairs):
+        lmask, ltree = forest[i]
+        rmask, rtree = forest[j]
+        key = (id(ltree), id(rtree))
+        if key not in products:
+          tree = subsets.product(ltree, rtree, lmask | rmask)
+          localCost = cost_estimator.estimate(tree) - cost_estimator.estimate(ltree) - cost_estimator.estimate(rtree)
+          products[key] = (tree, localCost)
+        tree, localCost = products[key]
+        newForest = forest[:i] + forest[i+1:j] + forest[j+1:] + [(lmask | rmask, tree)]
+        state = frozenset(mask for mask, _ in newForest)
+        if state not in candidates or cost + localCost < candidates[state][0]:
+          candidates[state] = (cost + localCost, newForest)
+    beam = sorted(candidates.values(), key=lambda candidate: candidate[0])[:width]
+
+  return beam[0][1][0][1]
+
+def greedyStrengthReduction(terms, target_indices, cost_estimator):
+  """Repeatedly multiplies the two trees whose product is cheapest."""
+  return beamStrengthReduction(terms, target_indices, cost_estimator, width=1)
+
+def planStrengthReduction(terms, target_indices, cost_estimator, planner=AUTO, beamWidth=BEAM_WIDTH, nodeBudget=NODE_BUDGET):
+  """Dispatches to one of the planners.
+
+  AUTO uses the optimal planner as long as its search size does not exceed
+  nodeBudget and falls back to beam search otherwise. The budget is counted in
+  visited splits instead of time such that generated code stays reproducible.
+  """
+  if planner == AUTO:
+    searchSize = optimalSearchSize(len(terms), cost_estimator.isContextFree())
+    planner = OPTIMAL if searchSize <= nodeBudget else BEAM
+  if planner == OPTIMAL:
+    return strengthReduction(terms, target_indices, cost_estimator)
+  elif planner == GREEDY:
+    return greedyStrengthReduction(terms, target_indices, cost_estimator)
+  elif planner == BEAM:
+    return beamStrengthReduction(terms, target_indices, cost_estimator, beamWidth)
+  raise ValueError('Unknown planner {}, must be one of {}.'.format(planner, ', '.join(PLANNERS)))
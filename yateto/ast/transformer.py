@@ -1,13 +1,17 @@
 import sys
+import hashlib
+import warnings
+import numpy as np
 from copy import deepcopy
 from typing import Union
-from .visitor import Visitor, PrettyPrinter, ComputeSparsityPattern, ComputeIndexSet
-from .node import IndexedTensor, Op, Assign, Einsum, Add, Product, IndexSum, Contraction, ScalarMultiplication
-from .indices import Indices
+from .visitor import Visitor, PrettyPrinter, ComputeSparsityPattern, ComputeIndexSet, ComputeConstantExpression
+from .node import IndexedTensor, Op, Assign, Einsum, Add, Product, IndexSum, Contraction, ScalarMultiplication, permuted
+from .indices import BoundingBox, Indices
 from .log import LoG
 from . import opt
 from .cost import ShapeCostEstimator
 from .. import aspp
+from ..type import FoldedTensor
 
 # Similar as ast.NodeTransformer
 class Transformer(Visitor): 
@@ -106,12 +110,18 @@ class DeduceIndices(Transformer):
 ### Optimal binary tree
 
 class StrengthReduction(Transformer):
-  def __init__(self, costEstimator):
+  def __init__(self, costEstimator, planner=opt.AUTO, beamWidth=opt.BEAM_WIDTH, nodeBudget=opt.NODE_BUDGET):
+    """planner: one of opt.PLANNERS, see opt.planStrengthReduction."""
+    if planner not in opt.PLANNERS:
+      raise ValueError('Unknown planner {}, must be one of {}.'.format(planner, ', '.join(opt.PLANNERS)))
     self._costEstimator = costEstimator
+    self._planner = planner
+    self._beamWidth = beamWidth
+    self._nodeBudget = nodeBudget
 
   def visit_Einsum(self, node):
     self.generic_visit(node)
-    minTree = opt.strengthReduction(list(node), node.indices, self._costEstimator())
+    minTree = opt.planStrengthReduction(list(node), node.indices, self._costEstimator(), self._planner, self._beamWidth, self._nodeBudget)
     minTree.setIndexPermutation(node.indices)
     return minTree
 
@@ -130,13 +140,24 @@ class FindContractions(Transformer):
 class SelectIndexPermutations(Transformer):
   def __init__(self, permutationVariants):
     self._permutationVariants = permutationVariants
+    # Variants which parents select instead of the cheapest one
+    self._selected = dict()
 
   def generic_visit(self, node):
-    variant = self._permutationVariants[node][str(node.indices)]
+    variant = self._selected.pop(node, None)
+    if variant is None:
+      variant = self._permutationVariants[node][str(node.indices)]
+    if variant._layout is not None:
+      node.setMemoryLayout(variant._layout)
+      node.selectedMemoryLayout = True
     choice = iter(variant._choices)
     for child in node:
       child.setIndexPermutation(next(choice))
+    if variant._childVariants is not None:
+      self._selected.update((child, childVariant) for child, childVariant in zip(node, variant._childVariants) if childVariant is not None)
     super().generic_visit(node)
+    if variant._permutes is not None:
+      node.setChildren([child if perm is None else permuted(child, perm, blockTranspose=True) for child, perm in zip(node, variant._permutes)])
     return node
 
 class AssignPrefetch(Transformer):
@@ -166,14 +187,108 @@ class AssignPrefetch(Transformer):
     return self._assigned
 
 class ImplementContractions(Transformer):
+  def __init__(self, model=None):
+    self._model = model
+
   def visit_Contraction(self, node):
     self.generic_visit(node)
-    newNode = LoG(node)
+    newNode = LoG(node, model=self._model)
     newNode.setEqspp( node.eqspp() )
-    newNode.computeMemoryLayout()
+    if node.selectedMemoryLayout:
+      # The LoG's fused indices depend on the selected layout
+      newNode.setMemoryLayout( node.memoryLayout() )
+    else:
+      newNode.computeMemoryLayout()
     return newNode
 
+class FoldConstantExpressions(Transformer):
+  """Evaluates expressions whose tensors and scalars are all known at generation time.
+
+  Such subtrees are replaced by a FoldedTensor with precomputed values and sparsity
+  pattern. In an Einsum, the constant factors are folded into a single factor if the
+  folded factor has at most as many non-zeros as the individual factors. Constant
+  scalar multiplications of an Einsum are folded into one of its constant factors.
+  Use DeduceIndices before FoldConstantExpressions.
+  """
+  NAME_PREFIX = 'folded_'
+
+  def __init__(self, dtype=np.float64):
+    self._dtype = dtype
+
+  def _isConstant(self, node):
+    if isinstance(node, IndexedTensor):
+      return node.tensor.is_compute_constant()
+    if isinstance(node, ScalarMultiplication) and not node.is_constant():
+      return False
+    return isinstance(node, Op) and not isinstance(node, Assign) and all(self._isConstant(child) for child in node)
+
+  def _folded(self, values, indices):
+    """Returns an IndexedTensor of a new FoldedTensor or None if values are zero."""
+    if not values.any():
+      return None
+    values = np.asfortranarray(values)
+    sha = hashlib.sha1(str(values.shape).encode())
+    sha.update(values.tobytes())
+    tensor = FoldedTensor(self.NAME_PREFIX + sha.hexdigest()[:16], values.shape, spp=values)
+    return tensor[str(indices)]
+
+  def generic_visit(self, node):
+    if self._isConstant(node) and not isinstance(node, IndexedTensor):
+      folded = self._folded(ComputeConstantExpression(self._dtype).visit(node), node.indices)
+      if folded is not None:
+        return folded
+    return super().generic_visit(node)
+
+  def visit_Einsum(self, node):
+    node = self.generic_visit(node)
+    if not isinstance(node, Einsum):
+      return node
+
+    constant = [child for child in node if self._isConstant(child)]
+    others = [child for child in node if not self._isConstant(child)]
+    if len(constant) < 2:
+      return node
+
+    outer = set(node.indices).union(*[set(child.indices) for child in others])
+    indexNames = list()
+    shape = list()
+    for child in constant:
+      for index in child.indices:
+        if index in outer and index not in indexNames:
+          indexNames.append(index)
+          shape.append(child.indices.indexSize(index))
+    terms = [ComputeConstantExpression(self._dtype).visit(child) for child in constant]
+    description = '{}->{}'.format(','.join(child.indices.tostring() for child in constant), ''.join(indexNames))
+    values = np.einsum(description, *terms)
+    if np.count_nonzero(values) > sum(np.count_nonzero(term) for term in terms):
+      return node
+
+    folded = self._folded(values, Indices(indexNames, tuple(shape)))
+    if folded is None:
+      return node
+    node.setChildren(others + [folded])
+    return node
+
+  def visit_ScalarMultiplication(self, node):
+    node = self.generic_visit(node)
+    if isinstance(node, ScalarMultiplication) and node.is_constant() and isinstance(node.term(), Einsum):
+      einsum = node.term()
+      for i, child in enumerate(einsum):
+        if isinstance(child, IndexedTensor) and child.tensor.is_compute_constant():
+          folded = self._folded(node.scalar() * child.tensor.values_as_ndarray(self._dtype), child.indices)
+          if folded is not None:
+            einsum.setChildren(einsum[:i] + [folded] + einsum[i+1:])
+            return einsum
+    return node
+
 class EquivalentSparsityPattern(Transformer):
+  """Computes the equivalent sparsity patterns of all nodes bottom-up and restricts them
+  top-down to the entries which influence a nonzero of the parent.
+
+  The right-hand side of an Assign is restricted to the bounding box of the left-hand
+  side, i.e., nonzeros outside of it are discarded as the left-hand side cannot store
+  them. A warning is issued if this changes the right-hand side.
+  """
   def __init__(self, groupSpp=True):
     self._groupSpp = groupSpp
 
@@ -193,15 +308,60 @@ class EquivalentSparsityPattern(Transformer):
   
   def visit_Assign(self, node):
     self.generic_visit(node)
+    # Only entries in the bounding box of the left-hand side are stored
+    lhs = node.leftTerm()
+    if len(lhs.indices) == 0 or lhs.eqspp().count_nonzero() == 0:
+      node.setEqspp( node.computeSparsityPattern() )
+      return node
+    rhs = node.rightTerm()
+    nonzeros = rhs.eqspp().count_nonzero()
+    box = aspp.boxed.fromBoundingBox(lhs.eqspp().shape, BoundingBox.fromSpp(lhs.eqspp()))
+    self._restrict(rhs, rhs.permute(lhs.indices, box))
+    if rhs.eqspp().count_nonzero() < nonzeros:
+      warnings.warn('Nonzeros of the right-hand side outside of the bounding box of {} are discarded.'.format(lhs))
     node.setEqspp( node.computeSparsityPattern() )
     return node
-  
+
+  def _restrict(self, node, mask):
+    """Restricts the eqspp of node to mask and propagates the restriction to the children."""
+    indices = node.indices.tostring()
+    if len(indices) == 0:
+      return
+    restricted = aspp.einsum('{0},{0}->{0}'.format(indices), node.eqspp(), mask)
+    if restricted.count_nonzero() < node.eqspp().count_nonzero():
+      node.setEqspp(restricted)
+      self._propagate(node)
+
+  def _propagate(self, node):
+    """Restricts the children of node to entries which influence a nonzero of node's eqspp."""
+    if isinstance(node, (Add, ScalarMultiplication)):
+      for child in node:
+        self._restrict(child, child.permute(node.indices, node.eqspp()))
+    elif isinstance(node, Einsum):
+      terms = list(node)
+      for i, child in enumerate(terms):
+        self._restrict(child, self._influence(node, terms[:i] + terms[i+1:], child))
+
+  def _influence(self, node, others, child):
+    """Entries of child for which a product with others is nonzero in node's eqspp."""
+    spp = node.eqspp()
+    indices = node.indices.tostring()
+    for i, term in enumerate(others):
+      termIndices = term.indices.tostring()
+      needed = set(child.indices.tostring()).union(*[other.indices.tostring() for other in others[i+1:]])
+      kept = ''.join(index for index in indices + termIndices if index in needed)
+      kept = ''.join(sorted(set(kept), key=kept.index))
+      spp = aspp.einsum('{},{}->{}'.format(indices, termIndices, kept), spp, term.eqspp())
+      indices = kept
+    childIndices = child.indices.tostring()
+    return aspp.einsum('{},{}->{}'.format(indices, childIndices, childIndices), spp, child.eqspp())
+
   def getEqspp(self, terms, targetIndices):
     # Shortcut if all terms have dense eqspps
     if all([term.eqspp().is_dense() for term in terms]):
       return aspp.dense(targetIndices.shape())
 
-    minTree = opt.strengthReduction(terms, targetIndices, ShapeCostEstimator())
+    minTree = opt.planStrengthReduction(terms, targetIndices, ShapeCostEstimator())
     if isinstance(minTree, IndexedTensor):
       return minTree.eqspp()
     minTree.setIndexPermutation(targetIndices)
@@ -214,9 +374,11 @@ class EquivalentSparsityPattern(Transformer):
     node.setEqspp( self.getEqspp(terms, node.indices) )
     
     for child in node:
+      before = child.eqspp().count_nonzero()
       child.setEqspp( self.getEqspp(terms, child.indices) )
-
-    # TODO: Backtracking of equivalent sparsity pattern to children?
+      # Nested operations are restricted to what influences the restricted child
+      if not isinstance(child, IndexedTensor) and child.eqspp().count_nonzero() < before:
+        self._propagate(child)
 
     return node
 
@@ -1,12 +1,14 @@
 from numpy import ndindex, arange, float64, add, einsum
+import copy
 import math
 import collections
 import itertools
 import re
 import os.path
-from .node import Op
-from .indices import LoGCost
-from .log import LoG
+from .node import Op, permuted
+from .cost import LoGCostModel
+from .log import gemmIndices, indexSizes, minGemm, operandClass, resultClass
+from ..memory import DenseMemoryLayout
 from functools import reduce
 
 # Optional modules
@@ -90,54 +92,148 @@ class FindTensors(Visitor):
     return {node.name(): node.tensor}
 
 class FindIndexPermutations(Visitor):
+  """Finds for every permutation of a node the cheapest permutations of its children.
+
+  For contractions, permutations of the result and of the operands are grouped into
+  classes which yield LoGs of equal cost (see log.operandClass), hence, the LoG cost
+  is only evaluated once per pair of classes, directly from their fused indices. Operand
+  pairs are visited in order of a lower bound on the cost, such that the search stops
+  once the bound exceeds the best cost. Nodes keep at most MAX_VARIANTS variants, where
+  the cheapest variant for every stride-one index is kept first.
+  Costs are given by model (default: LoGCostModel).
+
+  With ttgt, operands of contractions may also be permuted explicitly into a
+  temporary (transpose-then-GEMM) at the cost of model.transpose, such that e.g.
+  a single large GEMM replaces a loop over small GEMMs.
+
+  With temporaryLayouts, the memory layout of a contraction's result is a decision
+  variable, too, if it is an operand of another contraction: Besides the compact
+  layout of its bounding box, the result may be padded to its whole shape (with or
+  without aligned leading dimension), such that the producing and the consuming LoG
+  may fuse more indices. Padding may increase the size by at most MAX_PADDING.
+  """
+  MAX_VARIANTS = 720
+  MAX_PADDING = 0.5
+
+  def __init__(self, model=None, ttgt=False, temporaryLayouts=False):
+    self._model = model if model is not None else LoGCostModel()
+    self._ttgt = ttgt
+    self._temporaryLayouts = temporaryLayouts
+    # Variants of contractions with a non-default result layout
+    self._alternatives = dict()
+
   class Variant(object):
-    def __init__(self, cost, choices):
+    def __init__(self, cost, choices, permutes=None, layout=None, childVariants=None):
       self._cost = cost
       self._choices = choices
+      # Target permutations of children which are permuted explicitly (or None)
+      self._permutes = permutes
+      # Memory layout of the node, if it differs from the computed one
+      self._layout = layout
+      # Alternative variants of children (or None)
+      self._childVariants = childVariants
 
   def findVariants(self, node):
     permutationVariants = dict()
     for child in node:
       permutationVariants.update( self.visit(child) )
     return permutationVariants
-  
-  def variantsFixedRootPermutation(self, node, fixedPerm, permutationVariants):
-    variants = dict()
-    minCost = LoGCost.addIdentity()
+
+  @staticmethod
+  def _ranked(variants):
+    return sorted(variants.items(), key=lambda item: (item[1]._cost, item[0]))
+
+  def _cap(self, variants):
+    if len(variants) <= self.MAX_VARIANTS:
+      return variants
+    ranked = self._ranked(variants)
+    kept = dict()
+    leading = set()
+    for perm, variant in ranked:
+      if perm[:1] not in leading:
+        leading.add(perm[:1])
+        kept[perm] = variant
+    for perm, variant in ranked:
+      if len(kept) >= self.MAX_VARIANTS:
+        break
+      kept.setdefault(perm, variant)
+    return kept
+
+  def _leading(self, variants):
+    """Cheapest permutation for every stride-one index."""
+    perms = dict()
+    for perm, variant in self._ranked(variants):
+      perms.setdefault(perm[:1], perm)
+    return list(perms.values())
+
+  def _permutations(self, node, blocks, references):
+    """All permutations of node's indices, unless there are more than MAX_VARIANTS.
+
+    Otherwise, the candidates keep the blocks (index sets) contiguous and in the order of
+    one of the reference permutations, where every index leads its block once.
+    """
+    indices = str(node.indices)
+    if math.factorial(len(indices)) <= self.MAX_VARIANTS:
+      return [''.join(Cs) for Cs in itertools.permutations(indices)]
+    return self._blockPermutations(indices, blocks, references)
+
+  @staticmethod
+  def _blockPermutations(indices, blocks, references):
+    candidates = dict()
+    for reference in [indices] + references:
+      reference = ''.join(idx for idx in reference if idx in indices)
+      reference += ''.join(idx for idx in indices if idx not in reference)
+      ordered = [''.join(idx for idx in reference if idx in block) for block in blocks]
+      for order in itertools.permutations([block for block in ordered if block]):
+        rest = ''.join(order[1:])
+        for idx in order[0]:
+          candidates[idx + order[0].replace(idx, '') + rest] = None
+    return list(candidates)
+
+  @staticmethod
+  def _numReals(node):
+    return reduce(lambda x, y: x * y, node.indices.shape(), 1)
+
+  def _childChoice(self, child, ranked, variants, perm):
+    """Cheapest (cost, permutation, alternative variant or None) of a child whose parent has permutation perm."""
+    best = None
+    if perm in variants:
+      best = (variants[perm]._cost, perm, None)
+      for alternative in self._alternatives.get(child, dict()).get(perm, []):
+        if alternative._cost < best[0]:
+          best = (alternative._cost, perm, alternative)
+    for ind, variant in ranked[:2]:
+      if ind != perm:
+        candidate = (variant._cost + self._model.transpose(self._numReals(child)), ind, None)
+        if best is None or candidate[:2] < best[:2]:
+          best = candidate
+        break
+    assert best is not None
+    return best
+
+  def variantsFixedRootPermutation(self, node, fixedPerm, permutationVariants, ranked=None):
+    minCost = self._model.zero()
     minInd = list()
+    childVariants = list()
     for child in node:
-      childMinCost = LoGCost()
-      childMinInd = None
-      for ind in sorted(permutationVariants[child]):
-        transpose = int(fixedPerm != ind)
-        cost = permutationVariants[child][ind]._cost + LoGCost(0,transpose,0,0)
-        if cost < childMinCost:
-          childMinCost = cost
-          childMinInd = ind
-      assert childMinInd is not None
+      childRanked = ranked[child] if ranked is not None else self._ranked(permutationVariants[child])
+      childMinCost, childMinInd, childVariant = self._childChoice(child, childRanked, permutationVariants[child], fixedPerm)
       minCost = minCost + childMinCost
       minInd.append(childMinInd)
-    assert minInd is not None
-    variants[fixedPerm] = self.Variant(minCost, minInd)
-    return variants
+      childVariants.append(childVariant)
+    if all(childVariant is None for childVariant in childVariants):
+      childVariants = None
+    return {fixedPerm: self.Variant(minCost, minInd, childVariants=childVariants)}
 
   def allPermutationsNoCostBinaryOp(self, node):
     permutationVariants = self.findVariants(node)
-    lV = permutationVariants[node.leftTerm()]
-    rV = permutationVariants[node.rightTerm()]
-    minCost = LoGCost()
-    minAind = None
-    minBind = None
-    for Aind in sorted(lV):
-      for Bind in sorted(rV):
-        cost = lV[Aind]._cost + rV[Bind]._cost
-        if cost < minCost:
-          minCost = cost
-          minAind = Aind
-          minBind = Bind
-    assert minAind is not None and minBind is not None
-    iterator = itertools.permutations(node.indices)
-    permutationVariants[node] = {''.join(Cs): self.Variant(minCost, [minAind, minBind]) for Cs in iterator}
+    # The sum of costs is minimal if both summands are minimal
+    Aind, A = self._ranked(permutationVariants[node.leftTerm()])[0]
+    Bind, B = self._ranked(permutationVariants[node.rightTerm()])[0]
+    variant = self.Variant(A._cost + B._cost, [Aind, Bind])
+    references = self._leading(permutationVariants[node.leftTerm()]) + self._leading(permutationVariants[node.rightTerm()])
+    perms = self._permutations(node, [str(node.indices)], references)
+    permutationVariants[node] = self._cap({C: variant for C in perms})
     return permutationVariants
 
   def generic_visit(self, node):
@@ -149,12 +245,13 @@ class FindIndexPermutations(Visitor):
 
   def visit_Add(self, node):
     permutationVariants = self.findVariants(node)
-    iterator = itertools.permutations(node.indices)
+    ranked = {child: self._ranked(permutationVariants[child]) for child in node}
+    references = [perm for child in node for perm in self._leading(permutationVariants[child])]
     variants = dict()
-    for Cs in iterator:
-      variants.update( self.variantsFixedRootPermutation(node, ''.join(Cs), permutationVariants) )
+    for C in self._permutations(node, [str(node.indices)], references):
+      variants.update( self.variantsFixedRootPermutation(node, C, permutationVariants, ranked) )
     assert variants, 'Could not find implementation for Add.'
-    permutationVariants[node] = variants
+    permutationVariants[node] = self._cap(variants)
     return permutationVariants
 
   def visit_ScalarMultiplication(self, node):
@@ -167,44 +264,142 @@ class FindIndexPermutations(Visitor):
     
   def visit_IndexSum(self, node):
     permutationVariants = self.findVariants(node)
-    tV = permutationVariants[node.term()]
-    minCost = LoGCost()
-    minTind = None
-    for Tind in sorted(tV):
-        cost = tV[Tind]._cost
-        if cost < minCost:
-            minCost = cost
-            minTind = Tind
-    assert minTind is not None
-    iterator = itertools.permutations(node.indices)
-    permutationVariants[node] = {''.join(Cs): self.Variant(minCost, [minTind]) for Cs in iterator}
+    Tind, T = self._ranked(permutationVariants[node.term()])[0]
+    variant = self.Variant(T._cost, [Tind])
+    perms = self._permutations(node, [str(node.indices)], self._leading(permutationVariants[node.term()]))
+    permutationVariants[node] = self._cap({C: variant for C in perms})
     return permutationVariants
 
+  @staticmethod
+  def _permutedLayout(node, perm):
+    if str(node.indices) == perm:
+      return node.memoryLayout()
+    node = copy.copy(node)
+    node.setIndexPermutation(perm, permuteEqspp=False)
+    return node.memoryLayout()
+
+  def _operandCandidates(self, child, permutationVariants, blocks, references):
+    """Lists candidates (permutation, cost, source permutation, layout, variant) of an
+    operand, where the source permutation is None unless the operand is permuted
+    explicitly and variant is None unless an alternative layout of the operand is used.
+
+    Explicit permutations only pay off if they make blocks contiguous, hence only
+    block permutations in the order of the source or of the references are candidates.
+    """
+    native = {perm: (variant._cost, None) for perm, variant in permutationVariants[child].items()}
+    if self._ttgt:
+      source, variant = self._ranked(permutationVariants[child])[0]
+      cost = variant._cost + self._model.transpose(self._numReals(child))
+      for perm in self._blockPermutations(str(child.indices), blocks, [source] + references):
+        if perm not in native or cost < native[perm][0]:
+          native[perm] = (cost, source)
+    candidates = list()
+    for perm, (cost, source) in native.items():
+      layout = self._permutedLayout(child, perm) if source is None else permuted(child, perm).memoryLayout()
+      candidates.append((perm, cost, source, layout, None))
+    for perm, alternatives in self._alternatives.get(child, dict()).items():
+      if perm in permutationVariants[child]:
+        candidates.extend((perm, variant._cost, None, variant._layout, variant) for variant in alternatives)
+    return candidates
+
+  def _paddedLayouts(self, node, perm):
+    """Padded layouts of node in permutation perm which differ from its computed layout."""
+    layout = self._permutedLayout(node, perm)
+    if not isinstance(layout, DenseMemoryLayout):
+      return []
+    padded = [layout.padded(alignStride=True)] if DenseMemoryLayout.ALIGNMENT_ARCH is not None else []
+    padded.append(layout.padded())
+    maxReals = (1.0 + self.MAX_PADDING) * layout.requiredReals()
+    return [option for i, option in enumerate(padded)
+            if option != layout and option not in padded[:i] and option.requiredReals() <= maxReals]
+
+  def _operandPairs(self, node, candidates, swap, Im, In, Ik, sizes):
+    """Cheapest representatives of the operand classes, ordered by a lower bound on the cost."""
+    def representatives(child, first, second):
+      reps = dict()
+      for perm, cost, source, layout, variant in sorted(candidates[child], key=lambda candidate: (candidate[1], candidate[0])):
+        key = operandClass(layout, perm, first, second)
+        key += self._model.key(perm, first | second)
+        reps.setdefault(key, (perm, cost, source, variant))
+      return reps
+
+    leftSets, rightSets = ((Ik, In), (Im, Ik)) if swap else ((Im, Ik), (Ik, In))
+    left = representatives(node.leftTerm(), *leftSets)
+    right = representatives(node.rightTerm(), *rightSets)
+    pairs = list()
+    for lkey, (Aind, Acost, Asource, Avariant) in left.items():
+      for rkey, (Bind, Bcost, Bsource, Bvariant) in right.items():
+        # The result's fused indices are a subset of the operands' ones
+        A, B = (Bind, Aind) if swap else (Aind, Bind)
+        (AM, AK), (BK, BN) = (rkey[:2], lkey[:2]) if swap else (lkey[:2], rkey[:2])
+        lowerBound, mnk = minGemm(A, B, None, AM | {''}, BN | {''}, AK & BK, self._model, sizes)
+        if mnk is not None:
+          cost = Acost + Bcost
+          pairs.append((cost + lowerBound, Aind, Bind, cost, lkey, rkey, (Asource, Bsource), (Avariant, Bvariant)))
+    return sorted(pairs, key=lambda pair: pair[:3])
+
   def visit_Contraction(self, node):
     permutationVariants = self.findVariants(node)
-    
+    left = str(node.leftTerm().indices)
+    right = str(node.rightTerm().indices)
+
+    common = set(left) & set(right)
+    blocks = [set(left) - common, set(right) - common, common]
+    references = self._leading(permutationVariants[node.leftTerm()]) + self._leading(permutationVariants[node.rightTerm()])
+    sizes = indexSizes(node.leftTerm().indices, node.rightTerm().indices, node.indices)
+    # Free, contracted, and batch indices of the operands
+    batch = common & set(str(node.indices))
+    operandBlocks = blocks[:2] + [common - batch, batch]
+    candidates = {child: self._operandCandidates(child, permutationVariants, operandBlocks,
+                                                 [perm for other in node if other is not child for perm in self._leading(permutationVariants[other])])
+                  for child in node}
+
+    pairs = dict()
+    classes = dict()
+    def cheapest(C, swap, Im, In, Ik, CM, CN):
+      key = (swap, CM, CN) + self._model.key(C, Im | In)
+      if key not in classes:
+        if swap not in pairs:
+          pairs[swap] = self._operandPairs(node, candidates, swap, Im, In, Ik, sizes)
+        best = None
+        for bound, Aind, Bind, childCost, lkey, rkey, sources, childVariants in pairs[swap]:
+          # Pairs are sorted, hence no later pair can beat best
+          if best is not None and best[:3] < (bound, Aind, Bind):
+            break
+          # Same cost as LoG(node, Aind, Bind, C), computed from the classes
+          A, B = (Bind, Aind) if swap else (Aind, Bind)
+          (AM, AK), (BK, BN) = (rkey[:2], lkey[:2]) if swap else (lkey[:2], rkey[:2])
+          cost, mnk = minGemm(A, B, C, CM & AM, CN & BN, AK & BK, self._model, sizes)
+          if mnk is not None:
+            candidate = (cost + childCost, Aind, Bind, sources, childVariants)
+            if best is None or candidate[:3] < best[:3]:
+              best = candidate
+        variant = None
+        if best is not None:
+          cost, Aind, Bind, sources, childVariants = best
+          choices = [perm if source is None else source for perm, source in zip((Aind, Bind), sources)]
+          permutes = None if sources == (None, None) else [None if source is None else perm for perm, source in zip((Aind, Bind), sources)]
+          variant = self.Variant(cost, choices, permutes, childVariants=None if childVariants == (None, None) else list(childVariants))
+        classes[key] = variant
+      return key, classes[key]
+
     variants = dict()
-    iterator = itertools.permutations(node.indices)
-    for Cs in iterator:
-      C = ''.join(Cs)
-      minCost = LoGCost()
-      minAind = None
-      minBind = None
-      lV = permutationVariants[node.leftTerm()]
-      rV = permutationVariants[node.rightTerm()]
-      for Aind in sorted(lV):
-        for Bind in sorted(rV):
-          log = LoG(node, Aind, Bind, C)
-          if log is not None:
-            cost = log.cost() + lV[Aind]._cost + rV[Bind]._cost
-            if cost < minCost:
-              minCost = cost
-              minAind = Aind
-              minBind = Bind
-      if minAind is not None and minBind is not None:
-        variants[C] = self.Variant(minCost, [minAind, minBind])
+    alternatives = dict()
+    for C in self._permutations(node, blocks, references):
+      swap, Im, In, Ik = gemmIndices(left, right, C)
+      key, variant = cheapest(C, swap, Im, In, Ik, *resultClass(self._permutedLayout(node, C), C, Im, In))
+      if variant is None:
+        continue
+      variants[C] = variant
+      if self._temporaryLayouts:
+        for layout in self._paddedLayouts(node, C):
+          paddedKey, padded = cheapest(C, swap, Im, In, Ik, *resultClass(layout, C, Im, In))
+          if paddedKey != key and padded is not None:
+            alternatives.setdefault(C, []).append(self.Variant(padded._cost, padded._choices, padded._permutes, layout, padded._childVariants))
     assert variants, 'Could not find implementation for Contraction.'
-    permutationVariants[node] = variants
+    permutationVariants[node] = self._cap(variants)
+    if alternatives:
+      self._alternatives[node] = alternatives
     return permutationVariants
 
 class PrintEquivalentSparsityPatterns(Visitor):
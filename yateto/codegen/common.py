@@ -1,6 +1,6 @@
 from .. import aspp
 from ..ast.indices import BoundingBox
-from ..ast.log import splitByDistance
+from ..memory import CSFMemoryLayout
 
 
 class TensorDescription(object):
@@ -77,6 +77,67 @@ def forLoops(cpp, indexNames, ranges, body, pragmaSimd=True, prefix='_', indexNo
     flops = flops * rng.size()
   return flops
 
+def fixedAddressString(term, entry, loopIndices, prefix='_'):
+  """Address of a dense term whose indices in entry are fixed and whose other indices in loopIndices vary."""
+  ml = term.memoryLayout
+  offset = sum((entry[index] - ml.bboxi(p).start) * ml.stridei(p) for p, index in enumerate(term.indices) if index in entry)
+  varying = (term.indices & set(loopIndices)) - set(entry)
+  loopAddress = ml.addressString(term.indices, varying, prefix) if len(varying) > 0 else ''
+  if len(loopAddress) == 0:
+    return str(offset)
+  return '{} + {}'.format(offset, loopAddress) if offset != 0 else loopAddress
+
+# Sparse terms with more nonzeros are looped over fiber by fiber instead of unrolled
+SPARSE_UNROLL_THRESHOLD = 256
+
+def _fiberLoops(cpp, sparse: IndexedTensorDescription, body, prefix='_'):
+  """Loops over the fiber tree of a CSF term, where the term's indices are the loop variables prefix + index."""
+  ml = sparse.memoryLayout
+  fiberIdx = ml.fiberIndices().tolist()
+  fiberPtr = ml.fiberPointer().tolist()
+  cpp('static int const _fiberIdx[] = {{{}}};'.format(', '.join(str(i) for i in fiberIdx)))
+  if len(fiberPtr) > 0:
+    cpp('static int const _fiberPtr[] = {{{}}};'.format(', '.join(str(p) for p in fiberPtr)))
+
+  # Level l holds the fibers of dimension N-1-l, the pointers of level l point into level l+1
+  numNodes = [ml.numberOfRoots()]
+  for l in range(len(sparse.indices)-1):
+    numNodes.append(fiberPtr[sum(n+1 for n in numNodes[:-1]) + numNodes[-1]])
+
+  def level(l, begin, end):
+    fiber = '_fiber{}'.format(l)
+    with cpp.For('int {0} = {1}; {0} < {2}; ++{0}'.format(fiber, begin, end)):
+      cpp('int const {}{} = _fiberIdx[{} + {}];'.format(prefix, sparse.indices[-1-l], sum(numNodes[:l]), fiber))
+      if l == len(sparse.indices)-1:
+        return body(fiber, dict())
+      ptrOffset = sum(n+1 for n in numNodes[:l])
+      return level(l+1, '_fiberPtr[{} + {}]'.format(ptrOffset, fiber), '_fiberPtr[{} + {} + 1]'.format(ptrOffset, fiber))
+  return level(0, 0, numNodes[0])
+
+def sparseForLoops(cpp, sparse: IndexedTensorDescription, indexNames, ranges, body):
+  """Loops over indexNames and, inside, over the stored nonzeros of a sparse term.
+
+  body is called with the address of a nonzero and a dict mapping the sparse term's indices
+  to the nonzero's entry, and returns the number of flops per nonzero. Nonzeros are unrolled
+  unless the term is stored in a CSFMemoryLayout with more than SPARSE_UNROLL_THRESHOLD nonzeros,
+  all of which are non-zero in the equivalent sparsity pattern. Then, the fiber tree is looped
+  over and body is called once, with a C++ expression as address and an empty dict, where the
+  sparse term's indices are loop variables.
+  """
+  entries = sparse.memoryLayout.storedEntries()
+  nonzero = sparse.eqspp.as_ndarray()[entries] if len(entries[0]) > 0 else []
+  if isinstance(sparse.memoryLayout, CSFMemoryLayout) and len(nonzero) > SPARSE_UNROLL_THRESHOLD and all(nonzero):
+    with cpp.AnonymousScope():
+      return forLoops(cpp, indexNames, ranges, lambda: len(nonzero) * _fiberLoops(cpp, sparse, body), pragmaSimd=False)
+
+  def unrolled():
+    flops = 0
+    for address, entry in enumerate(zip(*entries)):
+      if nonzero[address]:
+        flops += body(address, {index: int(e) for index, e in zip(sparse.indices, entry)})
+    return flops
+  return forLoops(cpp, indexNames, ranges, unrolled, pragmaSimd=False)
+
 def forLoopsAppendDescriptions(cpp, description_obj, indexNames, ranges, body, pragmaSimd=True, prefix='_', indexNo=None):
   flops = 0
   if indexNo == None:
@@ -125,13 +186,9 @@ def reduceSpp(spp, sourceIndices, targetIndices):
 
 def initializeWithZero(cpp, arch, result: TensorDescription, writeBB = None):
   if writeBB:
-    addresses = sorted(result.memoryLayout.notWrittenAddresses(writeBB))
-    if len(addresses) > 0:
-      regions = splitByDistance(addresses)
-      for region in regions:
-        m, M = min(region), max(region)
-        initialAddress = '{} + {}'.format(result.name, m)
-        cpp.memset(initialAddress, M-m+1, arch.typename)
+    for start, stop in result.memoryLayout.notWrittenIntervals(writeBB):
+      initialAddress = '{} + {}'.format(result.name, start)
+      cpp.memset(initialAddress, stop-start, arch.typename)
   else:
     cpp.memset(result.name, result.memoryLayout.requiredReals(), arch.typename)
 
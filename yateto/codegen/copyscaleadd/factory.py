@@ -3,11 +3,12 @@ from .generic import Generic
 from .csa_gen import CopyScaleAddGenerator
 
 class Description(object):
-  def __init__(self, alpha, beta, result: IndexedTensorDescription, term: IndexedTensorDescription):
+  def __init__(self, alpha, beta, result: IndexedTensorDescription, term: IndexedTensorDescription, blockTranspose=False):
     self.alpha = alpha
     self.beta = beta
     self.result = result
     self.term = term
+    self.blockTranspose = blockTranspose
     
     assert self.alpha != 0.0, 'copyscaleadd does not support alpha=0.0 at the moment.'
     assert self.beta == 1.0 or self.beta == 0.0, 'copyscaleadd supports only beta=0.0 or beta=1.0 at the moment.'
@@ -1,10 +1,45 @@
 from ..common import *
+from ...memory import DenseMemoryLayout
 
 class Generic(object):
+  # Edge length of the tiles of cache-blocked transposes
+  TRANSPOSE_BLOCK = 16
+
   def __init__(self, arch, descr):
     self._arch = arch
     self._descr = descr
-  
+
+  def _transposedIndices(self):
+    """Returns the stride-one indices (result, term) if the copy is a transpose which
+    the description asks to block (with transpose-then-GEMM), else None."""
+    d = self._descr
+    if not d.blockTranspose:
+      return None
+    if not isinstance(d.result.memoryLayout, DenseMemoryLayout) or not isinstance(d.term.memoryLayout, DenseMemoryLayout):
+      return None
+    r = d.result.indices[0]
+    t = d.term.indices[0]
+    if r == t or min(d.loopRanges[r].size(), d.loopRanges[t].size()) <= self.TRANSPOSE_BLOCK:
+      return None
+    return r, t
+
+  def _blockedLoops(self, cpp, r, t, body):
+    """Tiles the loops over r and t such that a tile of the result and of the term stays
+    in cache, where the innermost loop writes the result with unit stride."""
+    d = self._descr
+    block = self.TRANSPOSE_BLOCK
+    rr = d.loopRanges[r]
+    tr = d.loopRanges[t]
+    tileLoop = 'int _blk{0} = {1}; _blk{0} < {2}; _blk{0} += {3}'
+    loop = 'int _{0} = _blk{0}; _{0} < (_blk{0} + {1} < {2} ? _blk{0} + {1} : {2}); ++_{0}'
+    with cpp.For(tileLoop.format(t, tr.start, tr.stop, block)):
+      with cpp.For(tileLoop.format(r, rr.start, rr.stop, block)):
+        with cpp.For(loop.format(t, block, tr.stop)):
+          cpp('#pragma omp simd')
+          with cpp.For(loop.format(r, block, rr.stop)):
+            flops = body()
+    return flops * rr.size() * tr.size()
+
   def _formatTerm(self, alpha, term):
     prefix = ''
     if alpha == 0.0:
@@ -42,4 +77,10 @@ class Generic(object):
 
         return flop
 
+    transposed = self._transposedIndices()
+    if transposed is not None:
+      r, t = transposed
+      outer = ''.join(index for index in d.result.indices if index not in transposed)
+      return forLoops(cpp, outer, d.loopRanges, lambda: self._blockedLoops(cpp, r, t, CopyScaleAddBody()), pragmaSimd=False)
+
     return forLoops(cpp, d.result.indices, d.loopRanges, CopyScaleAddBody())
@@ -142,7 +142,8 @@ class OptimisedKernelFactory(KernelFactory):
       alpha = scalar,
       beta = 1.0 if add else 0.0,
       result = IndexedTensorDescription(str(result), node.indices, result.memoryLayout(), result.eqspp()),
-      term = IndexedTensorDescription(str(term), node.term().indices, term.memoryLayout(), term.eqspp())
+      term = IndexedTensorDescription(str(term), node.term().indices, term.memoryLayout(), term.eqspp()),
+      blockTranspose = node.blockTranspose
     )
     generator = copyscaleadd.generator(self._arch, description, self._target)
     return generator.generate(self._cpp, routineCache)
@@ -158,11 +159,12 @@ class OptimisedKernelFactory(KernelFactory):
     return generator.generate(self._cpp, routineCache)
 
 class UnitTestFactory(KernelFactory):
-  def __init__(self, cpp, arch, nameFun, testFramework):
+  def __init__(self, cpp, arch, nameFun, testFramework, initValues=False):
     super().__init__(cpp, arch, target='cpu')
     self._name = nameFun
     self._rand = 0
     self._testFramework = testFramework
+    self._initValues = initValues
 
   def _formatTerm(self, var, indices):
     address = var.memoryLayout().addressString(indices)
@@ -248,15 +250,21 @@ class UnitTestFactory(KernelFactory):
 
     spp = node.spp()
     isDense = spp.count_nonzero() == size
-    if isDense:
+    values = node.values() if self._initValues else None
+    if values is not None:
+      # Kernels may fold constant tensors, hence, the actual values are required
+      memory = ['0.0']*size
+      if len(values) > 0:
+        for addr, value in zip(ml.addresses(tuple(zip(*values.keys()))).tolist(), values.values()):
+          memory[addr] = value
+      self.temporary(resultName, size, memory=memory)
+    elif isDense:
       self.temporary(resultName, size)
       with self._cpp.For('int i = 0; i < {}; ++i'.format(size)):
         self._cpp('{}[i] = static_cast<{}>((i + {}) % {} + 1);'.format(resultName, self._arch.typename, self._rand, maxValue))
     else:
       memory = ['0.0']*size
-      nz = spp.nonzero()
-      for entry in zip(*nz):
-        addr = ml.address(entry)
+      for addr in ml.addresses(spp.nonzero()).tolist():
         memory[addr] = str(float((addr + self._rand) % maxValue)+1.0)
       self.temporary(resultName, size, memory=memory)
     self._rand += 1
@@ -0,0 +1,91 @@
+from ...ast.indices import Range
+
+class Banded(object):
+  """Lowers a GEMM with a banded (or diagonal) operand to one scaling loop per diagonal.
+
+  Diagonal d of op(A) updates row i of C with row i+d of op(B), and diagonal d of op(B)
+  updates column l+d of C with column l of op(A).
+  """
+
+  def __init__(self, arch, descr):
+    self._arch = arch
+    self._descr = descr
+
+  @staticmethod
+  def _shifted(index, shift):
+    if shift == 0:
+      return index
+    return '{} {} {}'.format(index, '+' if shift > 0 else '-', abs(shift))
+
+  def _access(self, term, row, col, trans):
+    if trans:
+      row, col = col, row
+    ml = term.memoryLayout
+    scaled = lambda dim, index: '{}*{}'.format(ml.stridei(dim), index if ' ' not in index else '({})'.format(index))
+    return '{}[{} + {}]'.format(term.name, scaled(0, self._shifted(row, -ml.bboxi(0).start)), scaled(1, self._shifted(col, -ml.bboxi(1).start)))
+
+  def _diagonals(self, term, trans):
+    """Diagonals in the orientation of op(term) as (d, startRow, length, offset)."""
+    for d, start, length, offset in term.memoryLayout.diagonals():
+      yield (-d, start + d, length, offset) if trans else (d, start, length, offset)
+
+  def generate(self, cpp, routineCache):
+    d = self._descr
+    m, n, k = d.mnk()
+    bandedA = d.isABanded
+    banded = d.leftTerm if bandedA else d.rightTerm
+    trans = d.transA if bandedA else d.transB
+    alpha = '{} * '.format(d.alpha) if d.alpha != 1.0 else ''
+    flop = 3 if d.alpha != 1.0 else 2
+
+    # (diagonal, range of the sparse operand's row index) pairs, restricted to m, n, and k
+    updates = list()
+    for diag, start, length, offset in self._diagonals(banded, trans):
+      if bandedA:
+        rows = Range(start, start + length) & m & Range(k.start - diag, k.stop - diag)
+      else:
+        rows = Range(start, start + length) & k & Range(n.start - diag, n.stop - diag)
+      if rows.size() > 0:
+        updates.append((diag, rows, offset - start))
+
+    # A single diagonal that covers the whole output range may apply beta directly
+    out = m if bandedA else n
+    fuseBeta = len(updates) == 1 and updates[0][1].start + (0 if bandedA else updates[0][0]) == out.start \
+               and updates[0][1].size() == out.size()
+
+    flops = 0
+    C = lambda i, j: self._access(d.result, i, j, False)
+    if d.beta != 1.0 and not fuseBeta:
+      with cpp.For('int n = {0}; n < {1}; ++n'.format(n.start, n.stop)):
+        cpp('#pragma omp simd')
+        with cpp.For('int m = {0}; m < {1}; ++m'.format(m.start, m.stop)):
+          cpp('{} = {}{};'.format(C('m', 'n'), d.beta, ' * ' + C('m', 'n') if d.beta != 0.0 else ''))
+      flops += m.size() * n.size() * (0 if d.beta == 0.0 else 1)
+
+    def update(target, product, size):
+      if not fuseBeta or d.beta == 1.0:
+        cpp('{} += {}{};'.format(target, alpha, product))
+        return size * flop
+      elif d.beta == 0.0:
+        cpp('{} = {}{};'.format(target, alpha, product))
+        return size * (flop - 1)
+      cpp('{0} = {1}{2} + {3} * {0};'.format(target, alpha, product, d.beta))
+      return size * (flop + 1)
+
+    for diag, rows, base in updates:
+      value = '{}[{}]'.format(banded.name, self._shifted('i', base))
+      if bandedA:
+        # C(i, n) += A(i, i+diag) * B(i+diag, n)
+        with cpp.For('int n = {0}; n < {1}; ++n'.format(n.start, n.stop)):
+          cpp('#pragma omp simd')
+          with cpp.For('int i = {0}; i < {1}; ++i'.format(rows.start, rows.stop)):
+            B = self._access(d.rightTerm, self._shifted('i', diag), 'n', d.transB)
+            flops += update(C('i', 'n'), '{} * {}'.format(value, B), rows.size() * n.size())
+      else:
+        # C(m, i+diag) += A(m, i) * B(i, i+diag)
+        with cpp.For('int i = {0}; i < {1}; ++i'.format(rows.start, rows.stop)):
+          cpp('#pragma omp simd')
+          with cpp.For('int m = {0}; m < {1}; ++m'.format(m.start, m.stop)):
+            A = self._access(d.leftTerm, 'm', 'i', d.transA)
+            flops += update(C('m', self._shifted('i', diag)), '{} * {}'.format(A, value), rows.size() * m.size())
+    return flops
@@ -0,0 +1,99 @@
+from ... import aspp
+from ...ast.indices import BoundingBox, Range
+from ..common import TensorDescription
+from . import factory
+
+class BlockSparse(object):
+  """Lowers a GEMM with a block-sparse operand to one dense GEMM per stored block."""
+
+  def __init__(self, arch, descr, gemm_cfg, target):
+    self._arch = arch
+    self._descr = descr
+    self._gemm_cfg = gemm_cfg
+    self._target = target
+
+  def _blockTerm(self, term, rows, cols, offset):
+    bb = BoundingBox.fromSpp(term.eqspp)
+    clipped = (rows & bb[0], cols & bb[1])
+    if any(r.size() <= 0 for r in clipped):
+      return None
+    name = '({} + {})'.format(term.name, offset) if offset > 0 else term.name
+    eqspp = aspp.boxed(term.eqspp.shape, [(r.start, r.stop) for r in clipped])
+    return TensorDescription(name, term.memoryLayout.blockLayout(rows, cols), eqspp, term.is_compute_constant, term.is_temporary)
+
+  def _blockDescriptions(self):
+    d = self._descr
+    sparseA = d.isABlockSparse
+    sparse = d.leftTerm if sparseA else d.rightTerm
+    descriptions = list()
+    for rows, cols, offset in sparse.memoryLayout.blocks():
+      term = self._blockTerm(sparse, rows, cols, offset)
+      if term is None:
+        continue
+      descr = factory.Description(
+        result = d.result,
+        leftTerm = term if sparseA else d.leftTerm,
+        rightTerm = d.rightTerm if sparseA else term,
+        transA = d.transA,
+        transB = d.transB,
+        alpha = d.alpha,
+        beta = 1.0,
+        arch = self._arch,
+        alignedStartA = d.alignedA,
+        alignedStartC = d.alignedC
+      )
+      if all(r.size() > 0 for r in descr.mnk()):
+        descriptions.append(descr)
+    return descriptions
+
+  def _scale(self, cpp, rows, cols):
+    d = self._descr
+    offset = d.result.memoryLayout.subtensorOffset((rows.start, cols.start))
+    stride = d.result.memoryLayout.stride()
+    with cpp.For('int n = 0; n < {0}; ++n'.format(cols.size())):
+      with cpp.For('int m = 0; m < {0}; ++m'.format(rows.size())):
+        C = '{}[{} + {}*m + {}*n]'.format(d.result.name, offset, stride[0], stride[1])
+        cpp('{} = {}{};'.format(C, d.beta, ' * ' + C if d.beta != 0.0 else ''))
+    return rows.size() * cols.size() * (0 if d.beta == 0.0 else 1)
+
+  def generate(self, cpp, routineCache):
+    d = self._descr
+    if self._target == 'gpu':
+      raise NotImplementedError('Block-sparse GEMMs are not supported on GPUs.')
+
+    m, n, k = d.mnk()
+    # Blocks of A write to rows of C, blocks of B to columns of C
+    outDim = 0 if d.isABlockSparse else 1
+    full = m if d.isABlockSparse else n
+
+    descriptions = self._blockDescriptions()
+    outRanges = sorted({(descr.mnk()[outDim].start, descr.mnk()[outDim].stop) for descr in descriptions})
+    disjoint = all(prev[1] <= cur[0] for prev, cur in zip(outRanges[:-1], outRanges[1:]))
+
+    gaps = list()
+    if d.beta != 1.0:
+      if disjoint:
+        # The first GEMM writing a part of C applies beta, parts of C without any block are scaled explicitly
+        pos = full.start
+        for start, stop in outRanges:
+          if start > pos:
+            gaps.append(Range(pos, start))
+          pos = max(pos, stop)
+        if pos < full.stop:
+          gaps.append(Range(pos, full.stop))
+      else:
+        gaps.append(Range(full.start, full.stop))
+
+    flops = 0
+    for gap in gaps:
+      flops += self._scale(cpp, gap, n) if d.isABlockSparse else self._scale(cpp, m, gap)
+
+    written = set()
+    for descr in descriptions:
+      out = descr.mnk()[outDim]
+      if d.beta != 1.0 and disjoint and (out.start, out.stop) not in written:
+        descr.setBeta(d.beta)
+        written.add((out.start, out.stop))
+      generator = factory.generator(self._arch, descr, self._gemm_cfg, self._target)
+      flops += generator.generate(cpp, routineCache)
+    return flops
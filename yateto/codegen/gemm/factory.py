@@ -1,10 +1,12 @@
 from ...ast.indices import BoundingBox, Range
-from ...memory import CSCMemoryLayout
+from ...memory import BandedMemoryLayout, BlockSparseMemoryLayout, CSCMemoryLayout
 from ..common import TensorDescription
 from .generic import Generic
 from .gemmgen import GemmGen
 from ...gemm_configuration import GemmForge
 from .GemmforgeGemmGen import GemmforgeGemmGen
+from .blocksparse import BlockSparse
+from .banded import Banded
 
 class Description(object):
   def __init__(self,
@@ -31,8 +33,12 @@ class Description(object):
     
     self.isACsc = isinstance(self.leftTerm.memoryLayout, CSCMemoryLayout)
     self.isBCsc = isinstance(self.rightTerm.memoryLayout, CSCMemoryLayout)
+    self.isABlockSparse = isinstance(self.leftTerm.memoryLayout, BlockSparseMemoryLayout)
+    self.isBBlockSparse = isinstance(self.rightTerm.memoryLayout, BlockSparseMemoryLayout)
+    self.isABanded = isinstance(self.leftTerm.memoryLayout, BandedMemoryLayout)
+    self.isBBanded = isinstance(self.rightTerm.memoryLayout, BandedMemoryLayout)
     
-    if self.isACsc and self.isBCsc:
+    if (self.isACsc or self.isABlockSparse or self.isABanded) and (self.isBCsc or self.isBBlockSparse or self.isBBanded):
       raise RuntimeError('GEMM: sparse x sparse is currently not supported.')
     
     bbA = BoundingBox.fromSpp(self.leftTerm.eqspp)
@@ -79,6 +85,10 @@ class Description(object):
               f"  prefetchName={self.prefetchName},\t"
               f"  isACsc={self.isACsc},\t"
               f"  isBCsc={self.isBCsc},\t"
+              f"  isABlockSparse={self.isABlockSparse},\t"
+              f"  isBBlockSparse={self.isBBlockSparse},\t"
+              f"  isABanded={self.isABanded},\t"
+              f"  isBBanded={self.isBBanded},\t"
               f"  alignedA={self.alignedA},\t"
               f"  alignedC={self.alignedC},\t"
               f"  mnk={self._mnk}"
@@ -88,6 +98,12 @@ class Description(object):
     return self.__str__()
 
 def generator(arch, descr, gemm_cfg, target):
+  if descr.isABlockSparse or descr.isBBlockSparse:
+    return BlockSparse(arch, descr, gemm_cfg, target)
+  if descr.isABanded or descr.isBBanded:
+    if target == 'gpu':
+      raise NotImplementedError('Banded GEMMs are not supported on GPUs.')
+    return Banded(arch, descr)
   AOk = descr.isACsc or descr.leftTerm.memoryLayout.stridei(0) == 1
   BOk = descr.isBCsc or descr.rightTerm.memoryLayout.stridei(0) == 1
   strideOneC = descr.result.memoryLayout.stridei(0) == 1
@@ -1,3 +1,4 @@
+from ...memory import CSCMemoryLayout, CSFMemoryLayout
 from ..common import *
 from .generic import Generic
 
@@ -7,6 +8,7 @@ class Description(object):
     self.add = add
     self.result = result
     self.term = term
+    self.isSparse = isinstance(self.term.memoryLayout, (CSCMemoryLayout, CSFMemoryLayout))
     
     rA = loopRanges(self.term, self.result.indices)
     rB = loopRanges(self.result, self.result.indices)
@@ -1,3 +1,4 @@
+from ...ast.indices import Indices
 from ..common import *
 
 class Generic(object):
@@ -5,8 +6,26 @@ class Generic(object):
     self._arch = arch
     self._descr = descr
 
+  def _generateSparse(self, cpp):
+    d = self._descr
+
+    if not d.add:
+      initializeWithZero(cpp, self._arch, d.result)
+
+    mult = '{} * '.format(d.alpha) if d.alpha != 1.0 else ''
+    flop = 2 if d.alpha != 1.0 else 1
+
+    def body(address, entry):
+      cpp( '{}[{}] += {}{}[{}];'.format(d.result.name, fixedAddressString(d.result, entry, d.term.indices), mult, d.term.name, address) )
+      return flop
+
+    return sparseForLoops(cpp, d.term, Indices(), d.loopRanges, body)
+
   def generate(self, cpp, routineCache):
     d = self._descr
+
+    if d.isSparse:
+      return self._generateSparse(cpp)
         
     if not d.add:
       writeBB = boundingBoxFromLoopRanges(d.result.indices, d.loopRanges)
@@ -1,4 +1,5 @@
 import copy
+from ...memory import CSFMemoryLayout
 from ..common import *
 from .generic import Generic
 from .GemmforgeLOG import GemmforgeLOG
@@ -23,6 +24,8 @@ class Description(object):
     self.transA = transA
     self.transB = transB
     self.prefetchName = prefetchName
+    self.isACsf = isinstance(self.leftTerm.memoryLayout, CSFMemoryLayout)
+    self.isBCsf = isinstance(self.rightTerm.memoryLayout, CSFMemoryLayout)
     
     rA = loopRanges(self.leftTerm, self.loopIndices)
     rB = loopRanges(self.rightTerm, self.loopIndices)
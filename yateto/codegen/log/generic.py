@@ -43,8 +43,43 @@ class Generic(object):
       return  {next(iter(I)): fusedRange}
     return term.memoryLayout.defuse(fusedRange, term.indices, I)
 
+  def _generateCSF(self, cpp):
+    d = self._descr
+    if d.isACsf and d.isBCsf:
+      raise RuntimeError('LoG: sparse x sparse is currently not supported.')
+
+    sparse = d.leftTerm if d.isACsf else d.rightTerm
+    dense = d.rightTerm if d.isACsf else d.leftTerm
+
+    if not d.add:
+      initializeWithZero(cpp, self._arch, d.result)
+
+    loopIndices = dense.indices - sparse.indices
+    mult = '{} * '.format(d.alpha) if d.alpha != 1.0 else ''
+    flop = 3 if d.alpha != 1.0 else 2
+
+    # Indices of the sparse term are loop variables if its nonzeros are not unrolled
+    varying = set(loopIndices) | set(sparse.indices)
+
+    def body(address, entry):
+      sparseTerm = '{}[{}]'.format(sparse.name, address)
+      denseTerm = '{}[{}]'.format(dense.name, fixedAddressString(dense, entry, varying))
+      cpp( '{}[{}] += {}{} * {};'.format(
+          d.result.name, fixedAddressString(d.result, entry, varying),
+          mult,
+          sparseTerm if d.isACsf else denseTerm,
+          denseTerm if d.isACsf else sparseTerm
+        )
+      )
+      return flop
+
+    return sparseForLoops(cpp, sparse, loopIndices, loopRanges(dense, loopIndices), body)
+
   def generate(self, cpp, routineCache, gemm_cfg):
     d = self._descr
+
+    if d.isACsf or d.isBCsf:
+      return self._generateCSF(cpp)
     
     A = d.leftTerm.indices - d.loopIndices
     B = d.rightTerm.indices - d.loopIndices
@@ -1,4 +1,4 @@
-from ...memory import CSCMemoryLayout
+from ...memory import CSCMemoryLayout, CSFMemoryLayout
 from ..common import *
 from .generic import Generic
 from .GemmforgeProduct import GemmforgeProduct
@@ -13,6 +13,10 @@ class Description(object):
 
     self.isACsc = isinstance(self.leftTerm.memoryLayout, CSCMemoryLayout)
     self.isBCsc = isinstance(self.rightTerm.memoryLayout, CSCMemoryLayout)
+    self.isACsf = isinstance(self.leftTerm.memoryLayout, CSFMemoryLayout)
+    self.isBCsf = isinstance(self.rightTerm.memoryLayout, CSFMemoryLayout)
+    self.isASparse = self.isACsc or self.isACsf
+    self.isBSparse = self.isBCsc or self.isBCsf
     
     rA = loopRanges(self.leftTerm, self.result.indices)
     rB = loopRanges(self.rightTerm, self.result.indices)
@@ -34,6 +38,8 @@ class Description(object):
             f"\trightTerm: {self.rightTerm}\n"
             f"\tisACsc: {self.isACsc}\n"
             f"\tisBCsc: {self.isBCsc}\n"
+            f"\tisACsf: {self.isACsf}\n"
+            f"\tisBCsf: {self.isBCsf}\n"
             f"\tloopRanges: {self.loopRanges}\n"
             f")")
 
@@ -41,11 +41,38 @@ class Generic(object):
     return forLoops(cpp, d.result.indices, d.loopRanges, ProductBody())
 
   def _generateSparseDense(self, cpp):
-    raise NotImplementedError
+    d = self._descr
+    sparse = d.leftTerm if d.isASparse else d.rightTerm
+    dense = d.rightTerm if d.isASparse else d.leftTerm
+
+    if not d.add:
+      initializeWithZero(cpp, self._arch, d.result)
+
+    loopIndices = d.result.indices - sparse.indices
+    mult = self._mult(d.alpha)
+    flop = self._flop(d.add, d.alpha)
+
+    # Indices of the sparse term are loop variables if its nonzeros are not unrolled
+    varying = set(loopIndices) | set(sparse.indices)
+
+    def body(address, entry):
+      sparseTerm = '{}[{}]'.format(sparse.name, address)
+      denseTerm = '{}[{}]'.format(dense.name, fixedAddressString(dense, entry, varying))
+      cpp( '{}[{}] {} {}{} * {};'.format(
+          d.result.name, fixedAddressString(d.result, entry, varying),
+          '+=' if d.add else '=',
+          mult,
+          sparseTerm if d.isASparse else denseTerm,
+          denseTerm if d.isASparse else sparseTerm
+        )
+      )
+      return flop
+
+    return sparseForLoops(cpp, sparse, loopIndices, d.loopRanges, body)
 
   def _generateSparseSparse(self, cpp):
     d = self._descr
-    assert d.isACsc and d.isBCsc
+    assert d.isASparse and d.isBSparse
 
     if not d.add:
       initializeWithZero(cpp, self._arch, d.result)
@@ -59,8 +86,8 @@ class Generic(object):
     flops = 0
     nonzeros = d.result.eqspp.nonzero()
     for entry in sorted(zip(*nonzeros), key=lambda x: x[::-1]):
-      leftEntry = (entry[ left[0] ], entry[ left[1] ])
-      rightEntry = (entry[ right[0] ], entry[ right[1] ])
+      leftEntry = tuple(entry[p] for p in left)
+      rightEntry = tuple(entry[p] for p in right)
 
       cpp( '{}[{}] {} {}{}[{}] * {}[{}];'.format(
           d.result.name, d.result.memoryLayout.address(entry),
@@ -78,10 +105,10 @@ class Generic(object):
   def generate(self, cpp, routineCache):
     d = self._descr
 
-    if d.isACsc and d.isBCsc:
+    if d.isASparse and d.isBSparse:
       return self._generateSparseSparse(cpp)
 
-    if d.isACsc or d.isBCsc:
+    if d.isASparse or d.isBSparse:
       return self._generateSparseDense(cpp)
 
     return self._generateDenseDense(cpp)
@@ -6,7 +6,7 @@ from ..memory import DenseMemoryLayout
 from ..controlflow.visitor import ScalarsSet, SortedGlobalsList, SortedPrefetchList
 from ..controlflow.transformer import DetermineLocalInitialization
 from ..controlflow.graph import Variable
-from ..type import Tensor
+from ..type import Tensor, FoldedTensor
 from .code import Cpp
 from .factory import *
 from .common import BatchedOperationsAux
@@ -78,7 +78,7 @@ class KernelGenerator(object):
     for pp in cfg:
       localPtrs.update(pp.bufferMap.keys())
     if localPtrs:
-      cpp( '{}{};'.format(self._arch.typename, ','.join(map(lambda x: ' *' + str(x), localPtrs))) )
+      cpp( '{}{};'.format(self._arch.typename, ','.join(map(lambda x: ' *' + str(x), sorted(localPtrs, key=str)))) )
     for pp in cfg:
       for buf, size in pp.initBuffer.items():
         required_tmp_mem += size * self._arch.bytesPerReal
@@ -123,7 +123,9 @@ class OptimisedKernelGenerator(KernelGenerator):
                  function,
                  tmp_mem_size,
                  is_compute_constant_tensors,
-                 target):
+                 target,
+                 folded_tensors=frozenset(),
+                 unused_tensors=None):
 
       self.nonZeroFlops = nonZeroFlops
       self.hwFlops = hwFlops
@@ -135,6 +137,8 @@ class OptimisedKernelGenerator(KernelGenerator):
       self.tmp_mem_size = tmp_mem_size
       self.is_compute_constant_tensors = is_compute_constant_tensors
       self.target = target
+      self.folded_tensors = folded_tensors
+      self.unused_tensors = unused_tensors if unused_tensors is not None else collections.OrderedDict()
 
     @classmethod
     def _addTensor(cls, tensor, tensors):
@@ -148,7 +152,7 @@ class OptimisedKernelGenerator(KernelGenerator):
       else:
         tensors[base_name] = {group}
   
-  def generateKernelOutline(self, nonZeroFlops, cfg, gemm_cfg, target):
+  def generateKernelOutline(self, nonZeroFlops, cfg, gemm_cfg, target, unusedTensors=()):
     scalarsP = ScalarsSet().visit(cfg)
     variables = SortedGlobalsList().visit(cfg)
     tensors = collections.OrderedDict()
@@ -168,6 +172,11 @@ class OptimisedKernelGenerator(KernelGenerator):
         writable[bn] = var.writable
 
       is_compute_constant_tensors[bn] = var.tensor.is_compute_constant()
+    folded_tensors = {var.tensor.baseNameWithNamespace() for var in variables if isinstance(var.tensor, FoldedTensor)}
+    # Tensors which were folded away remain kernel arguments such that the interface does not change
+    unused_tensors = collections.OrderedDict()
+    for tensor in unusedTensors:
+      self.KernelOutline._addTensor(tensor, unused_tensors)
 
     prefetchTensors = SortedPrefetchList().visit(cfg)
     prefetch = collections.OrderedDict()
@@ -192,7 +201,9 @@ class OptimisedKernelGenerator(KernelGenerator):
                               function,
                               tmp_memory,
                               is_compute_constant_tensors,
-                              target)
+                              target,
+                              folded_tensors,
+                              unused_tensors)
 
   @classmethod
   def _addFromKO(cls, koEntries, entries):
@@ -209,13 +220,21 @@ class OptimisedKernelGenerator(KernelGenerator):
     writable = dict()
     scalars = collections.OrderedDict()
     is_compute_constant_tensors = dict()
+    folded_tensors = set()
     for ko in kernelOutlines:
       if ko:
+        folded_tensors |= ko.folded_tensors
         self._addFromKO(ko.scalars, scalars)
         self._addFromKO(ko.tensors, tensors)
         self._addFromKO(ko.writable, writable)
         self._addFromKO(ko.prefetch, prefetch)
         self._addFromKO(ko.is_compute_constant_tensors, is_compute_constant_tensors)
+    for ko in kernelOutlines:
+      if ko:
+        self._addFromKO(ko.unused_tensors, tensors)
+        for base_name in ko.unused_tensors:
+          writable.setdefault(base_name, False)
+          is_compute_constant_tensors.setdefault(base_name, True)
 
     target = kernelOutlines[-1].target
     is_same_target = True
@@ -271,13 +290,16 @@ class OptimisedKernelGenerator(KernelGenerator):
 
         header.emptyline()
 
-        def kernelArgs(base_name_with_namespace, groups, writable, is_constant, target):
+        def kernelArgs(base_name_with_namespace, groups, writable, is_constant, target, is_folded=False):
           prefix, base_name = Tensor.splitBasename(base_name_with_namespace)
           typ = self._arch.typename
           ptr_type = '**' if not is_constant and target == 'gpu' else '*'
           if not writable:
             typ += ' const'
-          if len(next(iter(groups))) > 0:
+          if is_folded:
+            values = f'{prefix}{InitializerGenerator.INIT_NAMESPACE}::{base_name}::{InitializerGenerator.VALUES_BASENAME}'
+            header(f'{typ}{ptr_type} {base_name}{{{values}}};')
+          elif len(next(iter(groups))) > 0:
             class_name = f'{prefix}{InitializerGenerator.TENSOR_NAMESPACE}::{base_name}'
             container_type = f'{InitializerGenerator.CONTAINER_CLASS_NAME}<{typ}{ptr_type}>'
             header(f'{class_name}::{container_type} {base_name};')
@@ -302,7 +324,8 @@ class OptimisedKernelGenerator(KernelGenerator):
                      groups,
                      writable[baseName],
                      is_compute_constant_tensors[baseName],
-                     target)
+                     target,
+                     baseName in folded_tensors)
         header.emptyline()
 
         # containers with extra offsets for GPU-like computations
@@ -401,8 +424,9 @@ class OptimisedKernelGenerator(KernelGenerator):
 class UnitTestGenerator(KernelGenerator):
   KERNEL_VAR = 'krnl'
   
-  def __init__(self, arch):
+  def __init__(self, arch, initValues=False):
     super().__init__(arch)
+    self._initValues = initValues
 
   def deduce_single_scalar(self, scalar):
     if scalar is None:
@@ -459,7 +483,7 @@ class UnitTestGenerator(KernelGenerator):
     variables = SortedGlobalsList().visit(cfg)
     kernel_prefix = '{}::'.format(namespace) if namespace else ''
     with cpp.Function(**testFramework.functionArgs(testName)):
-      factory = UnitTestFactory(cpp, self._arch, self._name, testFramework)
+      factory = UnitTestFactory(cpp, self._arch, self._name, testFramework, self._initValues)
 
       for i,scalar in enumerate(scalars):
         cpp('{} {} = {};'.format(self._arch.typename, self._tensorNameS(scalar), float(i+2)))
@@ -585,6 +609,65 @@ class InitializerGenerator(object):
       cpp(self.formatArray(numberType, namespace + self.ROWIND_NAME + index, memLayout.rowIndex(), declarationOnly))
       cpp(self.formatArray(numberType, namespace + self.COLPTR_NAME + index, memLayout.colPointer(), declarationOnly))
 
+  class CSFTensorView(TensorView):
+    FIBERIDX_NAME = 'FiberIdx'
+    FIBERPTR_NAME = 'FiberPtr'
+
+    def generate(self, cpp, memLayout, arch, index):
+      index = index if index is not None else ''
+      cpp( 'return {}({}, {}, {}, {}, {});'.format(
+          self.typename(len(memLayout.shape()), arch),
+          self.ARGUMENT_NAME,
+          self.listToInitializerList(memLayout.shape()),
+          memLayout.numberOfRoots(),
+          self.FIBERIDX_NAME + index,
+          self.FIBERPTR_NAME + index
+        )
+      )
+    def arrays(self, cpp, memLayout, arch, namespace, index, numberType, declarationOnly):
+      cpp(self.formatArray(numberType, namespace + self.FIBERIDX_NAME + index, memLayout.fiberIndices(), declarationOnly))
+      cpp(self.formatArray(numberType, namespace + self.FIBERPTR_NAME + index, memLayout.fiberPointer(), declarationOnly))
+
+  class BandedMatrixView(TensorView):
+    def typename(self, dim, arch):
+      return '::{}::{}<{},{}>'.format(SUPPORT_LIBRARY_NAMESPACE, type(self).__name__, arch.typename, arch.uintTypename)
+
+    def generate(self, cpp, memLayout, arch, index):
+      cpp( 'return {}({}, {}, {}, {});'.format(
+          self.typename(len(memLayout.shape()), arch),
+          self.ARGUMENT_NAME,
+          self.listToInitializerList(memLayout.shape()),
+          *memLayout.bandwidths()
+        )
+      )
+    def arrays(self, cpp, memLayout, arch, namespace, index, numberType, declarationOnly):
+      pass
+
+  class BlockSparseMatrixView(TensorView):
+    BLOCKPTR_NAME = 'BlockPtr'
+    BLOCKROWS_NAME = 'BlockRows'
+    BLOCKCOLS_NAME = 'BlockCols'
+
+    def typename(self, dim, arch):
+      return '::{}::{}<{},{}>'.format(SUPPORT_LIBRARY_NAMESPACE, type(self).__name__, arch.typename, arch.uintTypename)
+
+    def generate(self, cpp, memLayout, arch, index):
+      index = index if index is not None else ''
+      cpp( 'return {}({}, {}, {}, {}, {}, {});'.format(
+          self.typename(len(memLayout.shape()), arch),
+          self.ARGUMENT_NAME,
+          self.listToInitializerList(memLayout.shape()),
+          memLayout.numberOfBlocks(),
+          self.BLOCKPTR_NAME + index,
+          self.BLOCKROWS_NAME + index,
+          self.BLOCKCOLS_NAME + index
+        )
+      )
+    def arrays(self, cpp, memLayout, arch, namespace, index, numberType, declarationOnly):
+      cpp(self.formatArray(numberType, namespace + self.BLOCKPTR_NAME + index, memLayout.blockPointer(), declarationOnly))
+      cpp(self.formatArray(numberType, namespace + self.BLOCKROWS_NAME + index, memLayout.blockRows(), declarationOnly))
+      cpp(self.formatArray(numberType, namespace + self.BLOCKCOLS_NAME + index, memLayout.blockCols(), declarationOnly))
+
   def __init__(self, arch, tensors, scalars):
     self._arch = arch
     self._numberType = '{} const'.format(self._arch.uintTypename)
@@ -624,7 +707,11 @@ class InitializerGenerator(object):
   def _tensorViewGenerator(self, memoryLayout):
     memLayoutMap = {
       'DenseMemoryLayout': self.DenseTensorView,
-      'CSCMemoryLayout': self.CSCMatrixView
+      'CSCMemoryLayout': self.CSCMatrixView,
+      'CSFMemoryLayout': self.CSFTensorView,
+      'BlockSparseMemoryLayout': self.BlockSparseMatrixView,
+      'BandedMemoryLayout': self.BandedMatrixView,
+      'DiagonalMemoryLayout': self.BandedMatrixView
     }
     return memLayoutMap[type(memoryLayout).__name__]()
   
@@ -756,8 +843,10 @@ class InitializerGenerator(object):
         memLayout = tensor.memoryLayout()
         if values is not None:
           memory = ['0.']*memLayout.requiredReals()
-          for idx,x in values.items():
-            memory[memLayout.address(idx)] = x
+          if len(values) > 0:
+            addresses = memLayout.addresses(tuple(zip(*values.keys())))
+            for addr,x in zip(addresses.tolist(), values.values()):
+              memory[addr] = x
           valuesName = '{}{}{}'.format(name, self.VALUES_BASENAME, index(group))
           valueNames[group] = ['&{}[0]'.format(valuesName)]
           cpp('{} {}[] = {{{}}};'.format(self._realType, valuesName, ', '.join(memory)))
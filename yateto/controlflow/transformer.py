@@ -1,3 +1,5 @@
+import collections
+import numpy as np
 from .graph import *
 from collections import deque
 from ..ast.node import LoopOverGEMM
@@ -23,11 +25,77 @@ class MergeScalarMultiplications(object):
 
 class LivenessAnalysis(object):
   def visit(self, cfg):
-    cfg[-1].live = set()
+    # Global results are output of the kernel, hence, live at its end
+    cfg[-1].live = {pp.action.result for pp in cfg[:-1] if pp.action.result.isGlobal()}
     for i in reversed(range(len(cfg)-1)):
       cfg[i].live = (cfg[i+1].live - {cfg[i].action.result}) | cfg[i].action.variables()
     return cfg
 
+class EliminateCommonSubexpressions(object):
+  """Computes structurally identical expressions only once.
+
+  An expression is identical to an earlier one if the same operation (node type,
+  indices, sparsity pattern, and memory layout) is applied to the same variables,
+  and none of these variables has been written in between. Uses of the later
+  temporary are replaced by the earlier one.
+  """
+  IGNORED_ATTRIBUTES = {'_children', '_eqspp', '_memoryLayout', 'indices', 'prefetch', 'selectedMemoryLayout'}
+
+  @classmethod
+  def _attribute(cls, value):
+    if isinstance(value, (set, frozenset)):
+      return str(sorted(str(v) for v in value))
+    return str(value)
+
+  @classmethod
+  def _nodeKey(cls, node):
+    attributes = tuple((name, cls._attribute(value)) for name, value in sorted(vars(node).items()) if name not in cls.IGNORED_ATTRIBUTES)
+    children = tuple(str(child.indices) for child in node)
+    return (type(node), str(node.indices), attributes, children)
+
+  @staticmethod
+  def _sameSpp(spp1, spp2):
+    if spp1 is None or spp2 is None:
+      return spp1 is spp2
+    if spp1.shape != spp2.shape:
+      return False
+    return (spp1.is_dense() and spp2.is_dense()) or np.array_equal(spp1.as_ndarray(), spp2.as_ndarray())
+
+  def _equivalent(self, ua, va):
+    return ua.term.variableList() == va.term.variableList() and \
+           self._nodeKey(ua.term.node) == self._nodeKey(va.term.node) and \
+           ua.scalar == va.scalar and \
+           ua.result.memoryLayout() == va.result.memoryLayout() and \
+           self._sameSpp(ua.term.eqspp(), va.term.eqspp())
+
+  def visit(self, cfg):
+    n = len(cfg)-1
+    definitions = collections.Counter(cfg[i].action.result for i in range(n))
+    isCandidate = lambda action: action.isRHSExpression() and not action.isCompound() \
+                                 and action.result.is_temporary and definitions[action.result] == 1 \
+                                 and action.term.node.prefetch is None
+    available = list()
+    i = 0
+    while i < n:
+      ua = cfg[i].action
+      candidate = isCandidate(ua)
+      if candidate:
+        match = next((va for va in available if self._equivalent(ua, va)), None)
+        if match is not None:
+          when = ua.result
+          by = match.result
+          if all([cfg[j].action.maySubstitute(when, by) for j in range(i+1, n)]):
+            for j in range(i+1, n):
+              cfg[j].action = cfg[j].action.substituted(when, by)
+            del cfg[i]
+            n -= 1
+            continue
+      available = [va for va in available if ua.result != va.result and ua.result not in va.term.variables()]
+      if candidate:
+        available.append(ua)
+      i += 1
+    return LivenessAnalysis().visit(cfg)
+
 class SubstituteForward(object):
   def visit(self, cfg):
     n = len(cfg)-1
@@ -49,7 +117,7 @@ class SubstituteBackward(object):
     n = len(cfg)-1
     for i in reversed(range(n)):
       va = cfg[i].action
-      if not va.isCompound() and va.isRHSVariable() and va.term.isLocal():
+      if not va.isCompound() and va.isRHSVariable() and va.term.isLocal() and va.term not in cfg[i+1].live:
         by = va.result
         found = -1
         for j in range(i):
@@ -100,7 +168,7 @@ class MergeActions(object):
             V = V | va.variables() | {va.result}
         if found >= 0:
           va = cfg[found].action
-          if ua.maySubstitute(ua.result, va.result, term=False):
+          if ua.result not in cfg[found+1].live and ua.maySubstitute(ua.result, va.result, term=False):
             cfg[i].action = ua.substituted(ua.result, va.result, term=False)
             cfg[i].action.add = va.add
             if not va.hasTrivialScalar():
@@ -7,11 +7,12 @@ from ..ast.node import Permute
 class AST2ControlFlow(Visitor):
   TEMPORARY_RESULT = '_tmp'
   
-  def __init__(self, simpleMemoryLayout=False):
+  def __init__(self, simpleMemoryLayout=False, blockTransposes=False):
     self._tmp = 0
     self._cfg = []
     self._writable = set()
     self._simpleMemoryLayout = simpleMemoryLayout
+    self._blockTransposes = blockTransposes
   
   def cfg(self):
     return self._cfg + [ProgramPoint(None)]
@@ -21,7 +22,7 @@ class AST2ControlFlow(Visitor):
 
   def _addPermuteIfRequired(self, indices, term, variable):
     if indices != term.indices:
-      permute = Permute(term, indices)
+      permute = Permute(term, indices, self._blockTransposes)
       if not self._simpleMemoryLayout:
         permute.setEqspp( permute.computeSparsityPattern() )
         permute.computeMemoryLayout()
@@ -266,8 +266,9 @@ class GeneratorCollection(object):
     self.gemmTools = gemmTools
     self.selected = set()
 
-  def getGemmTool(self, m, n, k, sparseA, sparseB, transA, transB, alpha,
-                  beta, alignedA, alignedC, target):
+  def findGemmTool(self, m, n, k, sparseA, sparseB, transA, transB, alpha,
+                   beta, alignedA, alignedC, target):
+    """Returns the preferred GemmTool without marking it as selected."""
     tools = dict()
     for gemmTool in reversed(self.gemmTools):
       if gemmTool.supported(m, n, k, sparseA, sparseB, transA, transB, alpha,
@@ -275,10 +276,14 @@ class GeneratorCollection(object):
         tools[gemmTool.preference(m, n, k, sparseA, sparseB, transA, transB, alpha, beta,
                                   alignedA, alignedC)] = gemmTool
 
-    select = None
     if tools:
-      select = max(tools.items(), key=operator.itemgetter(0))[1]
+      return max(tools.items(), key=operator.itemgetter(0))[1]
+    return None
 
+  def getGemmTool(self, m, n, k, sparseA, sparseB, transA, transB, alpha,
+                  beta, alignedA, alignedC, target):
+    select = self.findGemmTool(m, n, k, sparseA, sparseB, transA, transB, alpha,
+                               beta, alignedA, alignedC, target)
     if select:
       self.selected.add(select)
 
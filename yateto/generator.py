@@ -2,10 +2,17 @@ import copy
 import itertools
 import re
 import os
+import io
+import pickle
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
-from yateto import Tensor
+from yateto import Tensor, Scalar
+from .type import FoldedTensor
 from .ast.cost import BoundingBoxCostEstimator
 from .ast.node import Node
+from .ast import opt
 from .ast.visitor import ComputeOptimalFlopCount, FindIndexPermutations, FindTensors, FindPrefetchCapabilities
 from .ast.transformer import *
 from .codegen.cache import *
@@ -15,6 +22,8 @@ from .codegen.visitor import *
 from .controlflow.visitor import AST2ControlFlow
 from .controlflow.transformer import *
 from .gemm_configuration import GeneratorCollection, DefaultGeneratorCollection, BLASlike
+from .kernel_cache import KernelCache
+from .memory import DenseMemoryLayout
 from typing import List
 from io import StringIO
 import importlib.util
@@ -52,6 +61,8 @@ class Kernel(object):
 
     self.cfg = None
     self.nonZeroFlops = -1
+    # Tensors which are no longer accessed after constant folding
+    self.unusedTensors = list()
 
   @classmethod
   def isValidName(cls, name):
@@ -65,12 +76,18 @@ class Kernel(object):
     self.cfg = ast2cf.cfg()
     self.cfg = LivenessAnalysis().visit(self.cfg)
   
-  def prepareUntilCodeGen(self, cost_estimator):
+  def prepareUntilCodeGen(self, cost_estimator, planner=opt.AUTO, log_cost_model=None, ttgt=False, temporary_layouts=False, fold_constants=False):
+    if fold_constants and self.target == 'cpu':
+      tensors = FindTensors().visit(self.ast)
+      self.ast = [FoldConstantExpressions().visit(ast) for ast in self.ast]
+      folded = FindTensors().visit(self.ast)
+      self.unusedTensors = [tensor for name, tensor in tensors.items() if name not in folded]
+
     self.nonZeroFlops = 0
     for a in self.ast:
       ast = copy.deepcopy(a)
       ast = EquivalentSparsityPattern(groupSpp=False).visit(ast)
-      ast = StrengthReduction(cost_estimator).visit(ast)
+      ast = StrengthReduction(cost_estimator, planner).visit(ast)
       ast = SetSparsityPattern().visit(ast)
       self.nonZeroFlops += ComputeOptimalFlopCount().visit(ast)
 
@@ -78,12 +95,12 @@ class Kernel(object):
     prefetch = copy.copy(self._prefetch)
     for ast in self.ast:
       ast = EquivalentSparsityPattern().visit(ast)
-      ast = StrengthReduction(cost_estimator).visit(ast)
+      ast = StrengthReduction(cost_estimator, planner).visit(ast)
       ast = FindContractions().visit(ast)
       ast = ComputeMemoryLayout().visit(ast)
-      permutationVariants = FindIndexPermutations().visit(ast)
+      permutationVariants = FindIndexPermutations(log_cost_model, ttgt, temporary_layouts).visit(ast)
       ast = SelectIndexPermutations(permutationVariants).visit(ast)
-      ast = ImplementContractions().visit(ast)
+      ast = ImplementContractions(log_cost_model).visit(ast)
       if self._prefetch is not None:
         prefetchCapabilities = FindPrefetchCapabilities().visit(ast)
         assignPf = AssignPrefetch(prefetchCapabilities, prefetch)
@@ -92,12 +109,12 @@ class Kernel(object):
       tmpASTs.append(ast)
     self.ast = tmpASTs
 
-    ast2cf = AST2ControlFlow()
+    ast2cf = AST2ControlFlow(blockTransposes=ttgt)
     for ast in self.ast:
       ast2cf.visit(ast)
     self.cfg = ast2cf.cfg()
     self.cfg = MergeScalarMultiplications().visit(self.cfg)
-    self.cfg = LivenessAnalysis().visit(self.cfg)
+    self.cfg = EliminateCommonSubexpressions().visit(self.cfg)
     self.cfg = SubstituteForward().visit(self.cfg)
     self.cfg = SubstituteBackward().visit(self.cfg)
     self.cfg = RemoveEmptyStatements().visit(self.cfg)
@@ -106,6 +123,12 @@ class Kernel(object):
       self.cfg = FindFusedGemms().visit(self.cfg)
       self.cfg = LivenessAnalysis().visit(self.cfg)
 
+  def preparedState(self):
+    return self.ast, self.cfg, self.nonZeroFlops, self.unusedTensors
+
+  def setPreparedState(self, state):
+    self.ast, self.cfg, self.nonZeroFlops, self.unusedTensors = state
+
   def __str__(self):
     return f"Kernel(name='{self.name}', ast={self.ast}, prefetch={self._prefetch}, namespace='{self.namespace}', target='{self.target}', cfg={self.cfg}, nonZeroFlops={self.nonZeroFlops})"
 
@@ -182,9 +205,55 @@ class KernelFamily(object):
     for kernel in self._kernels.values():
       kernel.prepareUntilUnitTest()
   
-  def prepareUntilCodeGen(self, costEstimator):
+  def prepareUntilCodeGen(self, costEstimator, planner=opt.AUTO, logCostModel=None, ttgt=False, temporaryLayouts=False, foldConstants=False):
     for kernel in self._kernels.values():
-      kernel.prepareUntilCodeGen(costEstimator)
+      kernel.prepareUntilCodeGen(costEstimator, planner, logCostModel, ttgt, temporaryLayouts, foldConstants)
+
+
+class _SharedObjectPickler(pickle.Pickler):
+  """Replaces tensors and scalars by a persistent key.
+
+  Kernels are optimized in worker processes on copies of their tensors. The keys are
+  resolved against the parent's objects on unpickling such that all kernels keep on
+  referring to the very same Tensor and Scalar instances as in a serial run.
+  """
+  def __init__(self, file, shared=None):
+    super().__init__(file, pickle.HIGHEST_PROTOCOL)
+    self.shared = shared
+
+  def persistent_id(self, obj):
+    # Folded tensors are created during optimization and, hence, are pickled by value
+    if isinstance(obj, (Tensor, Scalar)) and not isinstance(obj, FoldedTensor):
+      key = (type(obj).__name__, obj.nameWithNamespace())
+      if self.shared is not None:
+        self.shared[key] = obj
+      return key
+    return None
+
+class _SharedObjectUnpickler(pickle.Unpickler):
+  def __init__(self, file, shared):
+    super().__init__(file)
+    self.shared = shared
+
+  def persistent_load(self, key):
+    if key not in self.shared:
+      raise pickle.UnpicklingError(f'unknown shared object {key}')
+    return self.shared[key]
+
+def _dumpShared(obj, shared=None):
+  buffer = io.BytesIO()
+  _SharedObjectPickler(buffer, shared).dump(obj)
+  return buffer.getvalue()
+
+def _loadShared(data, shared):
+  return _SharedObjectUnpickler(io.BytesIO(data), shared).load()
+
+def _initWorker(alignmentArch):
+  DenseMemoryLayout.setAlignmentArch(alignmentArch)
+
+def _prepareKernel(kernel, method, args):
+  getattr(kernel, method)(*args)
+  return _dumpShared(kernel.preparedState())
 
 
 def simpleParameterSpace(*args):
@@ -261,6 +330,72 @@ class Generator(object):
       prefetch = prefetchGenerator(*p) if prefetchGenerator is not None else None
       family.add(indexedName, ast, prefetch, namespace, target=target)
   
+  def _prepareKernels(self, method, args, jobs, verbose=False, kernelCache=None, cacheKey=None):
+    """Calls method (prepareUntilUnitTest or prepareUntilCodeGen) for every kernel.
+
+    If jobs != 1 the kernels are prepared in a pool of jobs worker processes (jobs=None
+    uses all available cores). Results are collected in the order of the serial run,
+    hence, the generated code does not depend on the number of jobs.
+
+    If a kernelCache is given, kernels whose cacheKey is found in the cache are restored
+    from the cache instead of being prepared, and newly prepared kernels are stored.
+    """
+    units = [(kernel.name, [kernel]) for kernel in self._kernels]
+    units += [(family.name, list(family.kernels())) for family in self._kernelFamilies.values()]
+
+    def sharedObjects(kernel):
+      shared = dict()
+      _dumpShared(kernel.preparedState(), shared)
+      if kernel._prefetch is not None:
+        _dumpShared(kernel._prefetch, shared)
+      return shared
+
+    keys = dict()
+    pending = [[] for _ in units]
+    for (_, kernels), unitPending in zip(units, pending):
+      for kernel in kernels:
+        if kernelCache is not None:
+          key = cacheKey(kernel)
+          data = kernelCache.load(key)
+          if data is not None:
+            try:
+              kernel.setPreparedState(_loadShared(data, sharedObjects(kernel)))
+              continue
+            except (pickle.UnpicklingError, EOFError, OSError):
+              kernelCache.invalidate(key)
+          keys[kernel.name] = key
+        unitPending.append(kernel)
+
+    def finalize(kernel, state=None):
+      if state is not None:
+        kernel.setPreparedState(_loadShared(state, sharedObjects(kernel)))
+      if kernel.name in keys:
+        try:
+          kernelCache.store(keys[kernel.name], _dumpShared(kernel.preparedState()))
+        except (pickle.PicklingError, TypeError, AttributeError, OSError) as e:
+          warnings.warn(f'Could not store kernel {kernel.name} in the kernel cache: {e}')
+
+    if jobs == 1 or not any(pending):
+      for (name, _), kernels in zip(units, pending):
+        if verbose:
+          print(name)
+        for kernel in kernels:
+          getattr(kernel, method)(*args)
+          finalize(kernel)
+      return
+
+    mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=jobs,
+                             mp_context=mp_context,
+                             initializer=_initWorker,
+                             initargs=(DenseMemoryLayout.ALIGNMENT_ARCH,)) as executor:
+      futures = [[executor.submit(_prepareKernel, kernel, method, args) for kernel in kernels] for kernels in pending]
+      for (name, _), kernels, results in zip(units, pending, futures):
+        if verbose:
+          print(name)
+        for kernel, result in zip(kernels, results):
+          finalize(kernel, result.result())
+
   def _headerGuardName(self, namespace, fileBaseName):
     partlist = namespace.upper().split('::') + [fileBaseName.upper(), self.HEADER_GUARD_SUFFIX]
     return '_'.join(partlist)
@@ -270,16 +405,31 @@ class Generator(object):
                namespace='yateto',
                gemm_cfg: GeneratorCollection = None,
                cost_estimator=BoundingBoxCostEstimator,
-               include_tensors=set()):
+               include_tensors=set(),
+               jobs=1,
+               kernel_cache=None,
+               planner=opt.AUTO,
+               layout_selector=None,
+               log_cost_model=None,
+               ttgt=False,
+               temporary_layouts=False,
+               fold_constants=False):
 
     if not gemm_cfg:
       gemm_cfg = DefaultGeneratorCollection(self._arch)
 
+    if kernel_cache is not None and not isinstance(kernel_cache, KernelCache):
+      kernel_cache = KernelCache(kernel_cache)
+
     print('Deducing indices...')
-    for kernel in self._kernels:
-      kernel.prepareUntilUnitTest()
-    for family in self._kernelFamilies.values():
-      family.prepareUntilUnitTest()
+    self._prepareKernels('prepareUntilUnitTest', (), jobs)
+
+    if layout_selector is not None:
+      print('Selecting memory layouts...')
+      asts = [ast for kernel in self._kernels for ast in kernel.ast]
+      asts += [ast for family in self._kernelFamilies.values() for kernel in family.kernels() for ast in kernel.ast]
+      layout_selector.apply(asts)
+      print(layout_selector.report())
 
     fUTdoctest = self.FileNames(outputDir, self.DOCTEST_FILE_NAME)
     fUTcxxtest = self.FileNames(outputDir, self.CXXTEST_FILE_NAME)
@@ -292,10 +442,10 @@ class Generator(object):
     print('Generating unit tests...')
     def unit_test_body(cpp, testFramework):
         for kernel in self._kernels:
-            UnitTestGenerator(self._arch).generate(cpp, kernel.namespace, kernel.name, kernel.name, kernel.cfg, gemm_cfg, testFramework)
+            UnitTestGenerator(self._arch, fold_constants).generate(cpp, kernel.namespace, kernel.name, kernel.name, kernel.cfg, gemm_cfg, testFramework)
         for family in self._kernelFamilies.values():
             for group, kernel in family.items():
-                UnitTestGenerator(self._arch).generate(cpp, kernel.namespace, kernel.name, family.name, kernel.cfg, gemm_cfg, testFramework, group)
+                UnitTestGenerator(self._arch, fold_constants).generate(cpp, kernel.namespace, kernel.name, family.name, kernel.cfg, gemm_cfg, testFramework, group)
     with Cpp(fUTdoctest.cpp) as cpp:
         Doctest().generate(cpp, namespace, fKernels.hName, fInit.hName, unit_test_body)
     with Cpp(fUTcxxtest.h) as cpp:
@@ -304,12 +454,13 @@ class Generator(object):
 
 
     print('Optimizing ASTs...')
-    for kernel in self._kernels:
-      print(kernel.name)
-      kernel.prepareUntilCodeGen(cost_estimator)
-    for family in self._kernelFamilies.values():
-      print(family.name)
-      family.prepareUntilCodeGen(cost_estimator)
+    options = (cost_estimator, planner, log_cost_model, ttgt, temporary_layouts, fold_constants)
+    cacheKey = lambda kernel: KernelCache.key(kernel, self._arch, gemm_cfg, options)
+    self._prepareKernels('prepareUntilCodeGen', options, jobs, verbose=True,
+                         kernelCache=kernel_cache, cacheKey=cacheKey)
+    if kernel_cache is not None:
+      kernel_cache.evict()
+      print(kernel_cache)
 
 
     # Create mapping from namespace to kernel/family
@@ -346,6 +497,9 @@ class Generator(object):
           header.includeSys('limits')
           header.include('yateto.h')
           header.include(fTensors.hName)
+          if any(isinstance(tensor, FoldedTensor) for kernel in self.kernels() for tensor in FindTensors().visit(kernel.ast).values()):
+            # Folded tensors are initialized with their values
+            header.include(fInit.hName)
           cpp.include(fKernels.hName)
           with cpp.Namespace(namespace), header.Namespace(namespace):
               # Group kernels by namespace
@@ -354,7 +508,8 @@ class Generator(object):
                   kernelOutline = optKernelGenerator.generateKernelOutline(kernel.nonZeroFlops,
                                                                            kernel.cfg,
                                                                            gemm_cfg,
-                                                                           kernel.target)
+                                                                           kernel.target,
+                                                                           kernel.unusedTensors)
                   with cpp.Namespace(kernel_namespace), header.Namespace(kernel_namespace):
                     optKernelGenerator.generate(cpp, header, kernel.name, [kernelOutline])
 
@@ -366,7 +521,8 @@ class Generator(object):
                     kernelOutlines[group] = optKernelGenerator.generateKernelOutline(kernel.nonZeroFlops,
                                                                                      kernel.cfg,
                                                                                      gemm_cfg,
-                                                                                     kernel.target)
+                                                                                     kernel.target,
+                                                                                     kernel.unusedTensors)
 
                   with cpp.Namespace(family_namespace), header.Namespace(family_namespace):
                     optKernelGenerator.generate(cpp, header, family.name, kernelOutlines, family.stride())
@@ -395,14 +551,11 @@ class Generator(object):
     for tensor in include_tensors:
       tensors[tensor.name()] = tensor
       tensors_dict[tensor.namespace][tensor.name()] = tensor
-    for kernel in self._kernels:
-        tensors.update( FindTensors().visit(kernel.ast) )
-        tensors_dict[''].update( FindTensors().visit(kernel.ast) )
-        scalars.update(ScalarsSet().visit(kernel.cfg))
-    for family in self._kernelFamilies.values():
-      for group, kernel in family.items():
-        tensors.update( FindTensors().visit(kernel.ast) )
-        tensors_dict[''].update( FindTensors().visit(kernel.ast) )
+    for kernel in self.kernels():
+        kernelTensors = FindTensors().visit(kernel.ast)
+        kernelTensors.update({tensor.name(): tensor for tensor in kernel.unusedTensors})
+        tensors.update(kernelTensors)
+        tensors_dict[''].update(kernelTensors)
         scalars.update(ScalarsSet().visit(kernel.cfg))
 
     print('Generating initialization code...')
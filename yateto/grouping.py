@@ -0,0 +1,128 @@
+import itertools
+from . import aspp
+from .type import Collection
+from .input import etree
+
+
+def _tensors(tensors):
+  if isinstance(tensors, Collection):
+    flat = list()
+    for value in tensors.__dict__.values():
+      flat.extend(value.values() if isinstance(value, dict) else [value])
+    return flat
+  return list(tensors)
+
+
+class _Cluster(object):
+  def __init__(self, tensors, spp):
+    self.tensors = tensors
+    self.spp = spp
+    # Nonzero flops per use, which are proportional to the nonzeros of the shared pattern
+    self.flops = len(tensors) * spp.count_nonzero()
+
+  def merged(self, other):
+    return _Cluster(self.tensors + other.tensors, aspp.add(self.spp, other.spp))
+
+
+def clusterSparsityPatterns(tensors, maxFlopIncrease=None, maxRoutines=None):
+  """Groups matrices such that every group shares the union of its sparsity patterns.
+
+  Matrices with equal shapes are merged greedily, cheapest merge first, where the cost
+  of a merge is the number of nonzeros that the union adds to the patterns of its
+  members. Matrices with equal patterns are always grouped as they share routines.
+  With maxRoutines, merging continues until at most maxRoutines distinct patterns
+  remain; with maxFlopIncrease, the nonzero flops of all matrices may grow by at most
+  this fraction. If both are given, the flop budget is never exceeded.
+
+  Args:
+    tensors: A Collection or a list of Tensors.
+    maxFlopIncrease (float): Budget on added flops relative to the nonzero flops.
+    maxRoutines (int): Budget on the number of distinct sparsity patterns.
+
+  Returns:
+    A list of groups, each a list of Tensors.
+  """
+  if maxFlopIncrease is None and maxRoutines is None:
+    raise ValueError('Either maxFlopIncrease or maxRoutines is required.')
+
+  clusters = dict()
+  for tensor in _tensors(tensors):
+    spp = tensor.spp(groupSpp=False)
+    key = spp.fingerprint()
+    if key in clusters:
+      clusters[key].tensors.append(tensor)
+      clusters[key].flops += spp.count_nonzero()
+    else:
+      clusters[key] = _Cluster([tensor], spp)
+  clusters = list(clusters.values())
+
+  budget = float('inf')
+  if maxFlopIncrease is not None:
+    budget = maxFlopIncrease * sum(cluster.flops for cluster in clusters)
+
+  def merge(a, b):
+    union = a.merged(b)
+    return union.flops - a.flops - b.flops, union
+
+  candidates = dict()
+  for a, b in itertools.combinations(clusters, 2):
+    if a.spp.shape == b.spp.shape:
+      candidates[(a, b)] = merge(a, b)
+
+  added = 0
+  while candidates and (maxRoutines is None or len(clusters) > maxRoutines):
+    (a, b), (cost, union) = min(candidates.items(), key=lambda item: item[1][0])
+    if added + cost > budget:
+      break
+    added += cost
+    clusters = [cluster for cluster in clusters if cluster is not a and cluster is not b]
+    candidates = {pair: value for pair, value in candidates.items() if a not in pair and b not in pair}
+    for cluster in clusters:
+      if cluster.spp.shape == union.spp.shape:
+        candidates[(cluster, union)] = merge(cluster, union)
+    clusters.append(union)
+
+  groups = [sorted(cluster.tensors, key=lambda tensor: tensor.name()) for cluster in clusters]
+  return sorted(groups, key=lambda group: group[0].name())
+
+
+def applyGroups(groups):
+  """Sets the union of the sparsity patterns of every group, which updates the memory layouts.
+
+  Layouts keep their parameters, e.g., the block shape of a BlockSparseMemoryLayout.
+  """
+  for group in groups:
+    spp = group[0].spp(groupSpp=False)
+    for tensor in group[1:]:
+      spp = aspp.add(spp, tensor.spp(groupSpp=False))
+    for tensor in group:
+      tensor.setGroupSpp(spp)
+
+
+def writeGroups(xmlFile, groups, sparse=None):
+  """Writes groups with more than one matrix in the format of memoryLayoutFromFile.
+
+  If given, sparse is written as sparse attribute of every group, e.g. 'auto'.
+  """
+  root = etree.Element('memoryLayout')
+  root.text = '\n  '
+  elements = list()
+  for group in groups:
+    if len(group) < 2:
+      continue
+    name = 'group{}'.format(len(elements) // 2)
+    element = etree.SubElement(root, 'group', name=name)
+    element.text = '\n    '
+    for tensor in group:
+      etree.SubElement(element, 'matrix', name=tensor.name()).tail = '\n    '
+    element[-1].tail = '\n  '
+    attributes = {'group': name}
+    if sparse is not None:
+      attributes['sparse'] = sparse
+    matrix = etree.SubElement(root, 'matrix', **attributes)
+    elements += [element, matrix]
+  for element in elements:
+    element.tail = '\n  '
+  if elements:
+    elements[-1].tail = '\n'
+  etree.ElementTree(root).write(xmlFile)
@@ -2,7 +2,7 @@ import re
 import itertools
 import json
 from . import Collection, Tensor
-from .memory import CSCMemoryLayout, DenseMemoryLayout
+from .memory import BlockSparseMemoryLayout, CSCMemoryLayout, DenseMemoryLayout
 from . import aspp
 from .util import create_collection
 
@@ -110,7 +110,12 @@ def parseJSONMatrixFile(jsonFile, clones=dict(), transpose=lambda name: False, a
 
   return create_collection(matrices)
 
-def memoryLayoutFromFile(xmlFile, db, clones):
+def memoryLayoutFromFile(xmlFile, db, clones, layoutSelector=None):
+  """Sets memory layouts as given in xmlFile.
+
+  Matrices with sparse="auto" are added to layoutSelector, which chooses their layouts
+  when the kernels are known (see Generator.generate).
+  """
   tree = etree.parse(xmlFile)
   root = tree.getroot()
   strtobool = ['yes', 'true', '1']
@@ -143,24 +148,35 @@ def memoryLayoutFromFile(xmlFile, db, clones):
   for matrix in root.findall('matrix'):
     group = matrix.get('group')
     name = matrix.get('name')
+    auto = matrix.get('sparse', '').lower() == 'auto'
     sparse = matrix.get('sparse', '').lower() in strtobool
+    if auto and layoutSelector is None:
+      raise ValueError('Matrix {} requires a LayoutSelector for sparse="auto".'.format(name))
 
     if group in groups or name in clones or db.containsName(name):
       blocks = []
       for block in matrix:
-        raise NotImplementedError
         if block.tag == 'block':
           startrow = int(block.get('startrow'))
           stoprow = int(block.get('stoprow'))
           startcol = int(block.get('startcol'))
           stopcol = int(block.get('stopcol'))
           blksparse = (block.get('sparse') == None and sparse) or block.get('sparse', '').lower() in strtobool
+          if blksparse:
+            raise NotImplementedError('Sparse blocks are not supported (matrix {}).'.format(name))
+          blocks.append(((startrow, stoprow), (startcol, stopcol)))
         else:
           __complain(block)
+      if auto and len(blocks) > 0:
+        raise ValueError('Matrix {} cannot have explicit blocks and sparse="auto".'.format(name))
       names = groups[group] if group in groups else (clones[name] if name in clones else [name])
       for n in names:
         tensor = db.byName(n)
-        if sparse:
+        if auto:
+          layoutSelector.add(tensor)
+        elif len(blocks) > 0:
+          tensor.setMemoryLayout(BlockSparseMemoryLayout, blocks=blocks)
+        elif sparse:
           tensor.setMemoryLayout(CSCMemoryLayout)
         else:
           tensor.setMemoryLayout(DenseMemoryLayout, alignStride=tensor.memoryLayout().alignedStride())
@@ -0,0 +1,121 @@
+import hashlib
+import io
+import os
+import pickle
+import time
+from .memory import DenseMemoryLayout
+
+class KernelCache(object):
+  """Persistent on-disk storage of optimized kernels.
+
+  Entries are opaque byte strings which are stored in one file per key. A key
+  is a content hash of everything that influences the optimization of a kernel,
+  see KernelCache.key. Entries which are older than maxAge (in seconds) are removed
+  on evict(). If the total size of the cache exceeds maxSize (in bytes), the least
+  recently used entries are removed until the cache fits.
+  """
+  SUFFIX = '.kernel'
+  _sourceFingerprint = None
+
+  def __init__(self, directory, maxAge=None, maxSize=None):
+    self._directory = directory
+    self._maxAge = maxAge
+    self._maxSize = maxSize
+    self.hits = 0
+    self.misses = 0
+    os.makedirs(self._directory, exist_ok=True)
+
+  @classmethod
+  def sourceFingerprint(cls):
+    """Hash of yateto's source code such that a cache is invalidated on update."""
+    if cls._sourceFingerprint is None:
+      sha = hashlib.sha256()
+      root = os.path.dirname(os.path.abspath(__file__))
+      for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+          if filename.endswith('.py'):
+            path = os.path.join(dirpath, filename)
+            sha.update(os.path.relpath(path, root).encode())
+            with open(path, 'rb') as f:
+              sha.update(f.read())
+      cls._sourceFingerprint = sha.hexdigest()
+    return cls._sourceFingerprint
+
+  @classmethod
+  def key(cls, kernel, arch, gemm_cfg, options):
+    """Computes a stable hash of the kernel's ASTs (including tensor shapes, sparsity
+    patterns, memory layouts, and values), the architecture, the GEMM tools, and the
+    optimization options (e.g. the cost estimator)."""
+    description = (
+      cls.sourceFingerprint(),
+      kernel.ast,
+      kernel._prefetch,
+      kernel.target,
+      sorted(arch.__dict__.items()),
+      DenseMemoryLayout.ALIGNMENT_ARCH is not None,
+      gemm_cfg.gemmTools,
+      tuple('{}.{}'.format(option.__module__, option.__qualname__) if isinstance(option, type) else option for option in options)
+    )
+    # Memoization is disabled such that the hash only depends on content and not on
+    # whether equal objects are shared
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=4)
+    pickler.fast = True
+    pickler.dump(description)
+    return hashlib.sha256(buffer.getvalue()).hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self._directory, key + self.SUFFIX)
+
+  def load(self, key):
+    path = self._path(key)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+      os.utime(path)
+    except OSError:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return data
+
+  def store(self, key, data):
+    path = self._path(key)
+    tmpPath = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+      f.write(data)
+    os.replace(tmpPath, path)
+
+  def invalidate(self, key):
+    try:
+      os.remove(self._path(key))
+    except OSError:
+      pass
+
+  def evict(self):
+    entries = list()
+    now = time.time()
+    for filename in os.listdir(self._directory):
+      if not filename.endswith(self.SUFFIX):
+        continue
+      path = os.path.join(self._directory, filename)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      if self._maxAge is not None and now - stat.st_mtime > self._maxAge:
+        os.remove(path)
+      else:
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    if self._maxSize is not None:
+      totalSize = sum(size for _, size, _ in entries)
+      for _, size, path in sorted(entries):
+        if totalSize <= self._maxSize:
+          break
+        os.remove(path)
+        totalSize -= size
+
+  def __str__(self):
+    return 'KernelCache(directory={}, hits={}, misses={})'.format(self._directory, self.hits, self.misses)
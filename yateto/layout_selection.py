@@ -0,0 +1,199 @@
+import collections
+from .ast.indices import BoundingBox
+from .ast.node import IndexedTensor
+from .ast.visitor import Visitor
+from .gemm_configuration import BLASlike, CodeGenerator
+from .memory import BlockSparseMemoryLayout, CSCMemoryLayout, DenseMemoryLayout
+
+GemmOperand = collections.namedtuple('GemmOperand', ['m', 'n', 'k', 'isA', 'trans'])
+GemmOperand.__doc__ = 'A matrix used as operand A (m x k) or B (k x n) of a GEMM C (m x n).'
+
+
+class FindGemmOperands(Visitor):
+  """Collects how matrices enter Einsums, i.e. with one free and one contracted index.
+
+  Returns a dict mapping tensor names to lists of GemmOperands. The indices of the
+  ASTs must be deduced. The matrix is operand A if its free index leads the result,
+  where the order of an assignment's left-hand side is used for its right-hand side.
+  """
+  def generic_visit(self, node, order=None):
+    return self._merge(node, None)
+
+  def _merge(self, node, order):
+    operands = collections.defaultdict(list)
+    for child in node:
+      for name, uses in self.visit(child, order=order).items():
+        operands[name].extend(uses)
+    return operands
+
+  def visit_Assign(self, node, order=None):
+    operands = self.visit(node.leftTerm())
+    for name, uses in self.visit(node.rightTerm(), order=node.leftTerm().indices).items():
+      operands[name].extend(uses)
+    return operands
+
+  def visit_Add(self, node, order=None):
+    return self._merge(node, order)
+
+  def visit_ScalarMultiplication(self, node, order=None):
+    return self._merge(node, order)
+
+  def visit_IndexedTensor(self, node, order=None):
+    return collections.defaultdict(list)
+
+  def visit_Einsum(self, node, order=None):
+    operands = self.generic_visit(node)
+    indices = order if order is not None and set(order) == set(node.indices) else node.indices
+    size = 1
+    for index in indices:
+      size *= indices.indexSize(index)
+    for child in node:
+      if not isinstance(child, IndexedTensor) or len(child.indices) != 2:
+        continue
+      free = [index for index in child.indices if index in indices]
+      if len(free) != 1:
+        continue
+      free = free[0]
+      contracted = [index for index in child.indices if index != free][0]
+      freeSize = child.indices.indexSize(free)
+      other = size // freeSize
+      k = child.indices.indexSize(contracted)
+      if indices[0] == free:
+        use = GemmOperand(freeSize, other, k, True, child.indices[0] != free)
+      else:
+        use = GemmOperand(other, freeSize, k, False, child.indices[0] != contracted)
+      operands[child.name()].append(use)
+    return operands
+
+
+class LayoutSelector(object):
+  """Chooses dense, CSC, or block-sparse memory layouts for matrices.
+
+  Matrices whose density within their bounding box reaches DENSE_THRESHOLD stay dense.
+  Otherwise, every candidate layout is rated over all GEMMs the matrix is an operand of
+  with the roofline model, where the peak flops are scaled by the efficiency of the
+  GemmTool which supports the GEMM (Generic code if there is none). Block-sparse layouts
+  pay CALL_OVERHEAD per block and are only considered if the blocks are filled by at
+  least BLOCK_FILL_THRESHOLD. Matrices which are no GEMM operand become CSC if their
+  density is below SPARSE_THRESHOLD. On GPUs, only dense layouts are supported.
+  """
+  DENSE_THRESHOLD = 0.5
+  SPARSE_THRESHOLD = 0.25
+  BLOCK_FILL_THRESHOLD = 0.5
+  CODE_GENERATOR_EFFICIENCY = 1.0
+  BLAS_EFFICIENCY = 0.5
+  GENERIC_EFFICIENCY = 0.25
+  SPARSE_EFFICIENCY = 0.5
+  CALL_OVERHEAD = 10.0
+
+  Decision = collections.namedtuple('Decision', ['name', 'layout', 'density', 'costs', 'reason'])
+
+  def __init__(self, arch, gemm_cfg=None, target='cpu', blockShape=None):
+    self._arch = arch
+    self._gemm_cfg = gemm_cfg
+    self._target = target
+    self._blockShape = blockShape
+    self._tensors = list()
+    self._decisions = list()
+
+  def add(self, tensor):
+    """Marks a tensor whose memory layout is chosen by apply()."""
+    if len(tensor.shape()) != 2:
+      raise ValueError('Automatic layout selection requires a matrix, got {} with shape {}.'.format(tensor.name(), tensor.shape()))
+    if tensor not in self._tensors:
+      self._tensors.append(tensor)
+
+  def tensors(self):
+    return list(self._tensors)
+
+  def decisions(self):
+    return list(self._decisions)
+
+  def _efficiency(self, m, n, k, sparseA, sparseB, trans, isA):
+    tool = None
+    if self._gemm_cfg is not None:
+      tool = self._gemm_cfg.findGemmTool(m, n, k, sparseA, sparseB, trans and isA, trans and not isA,
+                                         1.0, 0.0, False, False, self._target)
+    if isinstance(tool, CodeGenerator):
+      efficiency = self.CODE_GENERATOR_EFFICIENCY
+    elif isinstance(tool, BLASlike):
+      efficiency = self.BLAS_EFFICIENCY
+    else:
+      efficiency = self.GENERIC_EFFICIENCY
+    return efficiency * (self.SPARSE_EFFICIENCY if sparseA or sparseB else 1.0)
+
+  def _time(self, flops, efficiency, numReals):
+    numBytes = numReals * self._arch.bytesPerReal
+    return max(flops / (efficiency * self._arch.peakFlops()), numBytes / self._arch.bandwidth(numBytes))
+
+  def _cost(self, use, blocks, sparse):
+    """Run-time estimate of a GEMM with blocks given as (rows, cols, stored reals) of the matrix."""
+    other = use.n if use.isA else use.m
+    otherReals = use.k * use.n if use.isA else use.m * use.k
+    time = 0.0
+    reals = 0
+    for rows, cols, stored in blocks:
+      inner, outer = (cols, rows) if use.trans else (rows, cols)
+      m, n, k = (inner, other, outer) if use.isA else (other, outer, inner)
+      efficiency = self._efficiency(m, n, k, sparse and use.isA, sparse and not use.isA, use.trans, use.isA)
+      time += self._time(2 * stored * other, efficiency, 0)
+      reals += stored
+    if len(blocks) > 1:
+      time += self.CALL_OVERHEAD * len(blocks)
+    return max(time, self._time(0, 1.0, reals + otherReals + use.m * use.n))
+
+  def _candidates(self, spp):
+    bbox = BoundingBox.fromSpp(spp)
+    candidates = [(DenseMemoryLayout, dict(), [(bbox[0].size(), bbox[1].size(), bbox.size())], False)]
+    if self._target == 'gpu':
+      return candidates
+    nnz = spp.count_nonzero()
+    candidates.append((CSCMemoryLayout, dict(), [(spp.shape[0], spp.shape[1], nnz)], True))
+    blockLayout = BlockSparseMemoryLayout.fromSpp(spp, blockShape=self._blockShape)
+    if blockLayout.numberOfBlocks() > 1 and nnz >= self.BLOCK_FILL_THRESHOLD * blockLayout.requiredReals():
+      blocks = [(rows.size(), cols.size(), rows.size() * cols.size()) for rows, cols, _ in blockLayout.blocks()]
+      candidates.append((BlockSparseMemoryLayout, {'blocks': [((r.start, r.stop), (c.start, c.stop)) for r, c, _ in blockLayout.blocks()]}, blocks, False))
+    return candidates
+
+  def select(self, tensor, operands=()):
+    """Returns the decision for tensor, given the GemmOperands it is used as, without applying it."""
+    spp = tensor.spp()
+    bbox = BoundingBox.fromSpp(spp)
+    density = spp.count_nonzero() / bbox.size() if bbox.size() > 0 else 1.0
+    if density >= self.DENSE_THRESHOLD:
+      return self.Decision(tensor.name(), (DenseMemoryLayout, dict()), density, dict(), 'density')
+    if not operands:
+      choice = CSCMemoryLayout if density < self.SPARSE_THRESHOLD and self._target != 'gpu' else DenseMemoryLayout
+      return self.Decision(tensor.name(), (choice, dict()), density, dict(), 'density, no GEMM operand')
+    costs = dict()
+    kwargs = dict()
+    for layout, layoutKwargs, blocks, sparse in self._candidates(spp):
+      costs[layout] = sum(self._cost(use, blocks, sparse) for use in operands)
+      kwargs[layout] = layoutKwargs
+    choice = min(costs, key=costs.get)
+    return self.Decision(tensor.name(), (choice, kwargs[choice]), density, costs, 'cost model')
+
+  def apply(self, asts):
+    """Selects and sets the memory layouts of all added tensors, given the ASTs of all kernels."""
+    operands = collections.defaultdict(list)
+    finder = FindGemmOperands()
+    for ast in asts:
+      for name, uses in finder.visit(ast).items():
+        operands[name].extend(uses)
+    for tensor in self._tensors:
+      decision = self.select(tensor, operands[tensor.name()])
+      layout, kwargs = decision.layout
+      if layout == DenseMemoryLayout:
+        tensor.setMemoryLayout(layout, alignStride=tensor.memoryLayout().alignedStride())
+      else:
+        tensor.setMemoryLayout(layout, **kwargs)
+      self._decisions.append(decision)
+    return self._decisions
+
+  def report(self):
+    lines = list()
+    for decision in self._decisions:
+      costs = ', '.join('{} {:.3g}'.format(layout.__name__, cost) for layout, cost in decision.costs.items())
+      lines.append('  {}: {} (density {:.2f}, {}{})'.format(decision.name, decision.layout[0].__name__, decision.density,
+                                                          decision.reason, '; ' + costs if costs else ''))
+    return '\n'.join(lines)
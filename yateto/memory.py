@@ -1,6 +1,5 @@
 from .ast.indices import BoundingBox, Range
 import copy
-import itertools
 import warnings
 import numpy as np
 from abc import ABC, abstractmethod
@@ -15,6 +14,10 @@ class MemoryLayout(ABC):
   @abstractmethod
   def address(self, entry):
     pass
+
+  def addresses(self, entries):
+    """Bulk variant of address; entries is a tuple of index arrays, one per dimension."""
+    return np.array([self.address(entry) for entry in zip(*entries)], dtype=int)
   
   @abstractmethod
   def subtensorOffset(self, topLeftEntry):
@@ -36,6 +39,10 @@ class MemoryLayout(ABC):
   def fromSpp(cls, spp, **kwargs):
     pass
 
+  def fromSppKwargs(self):
+    """Keyword arguments for fromSpp which keep the parameters of this layout for another sparsity pattern."""
+    return {'alignStride': self.alignedStride()}
+
   @abstractmethod
   def __contains__(self, entry):
     pass
@@ -119,6 +126,10 @@ class DenseMemoryLayout(MemoryLayout):
     newBB = BoundingBox([copy.copy(originalBB[p]) for p in permutation])
     return DenseMemoryLayout(newShape, newBB, alignStride=self._range0 is not None)
 
+  def padded(self, alignStride=False):
+    """Layout whose bounding box spans the whole shape, hence, all adjacent dimensions may be fused."""
+    return DenseMemoryLayout(self._shape, alignStride=alignStride)
+
   def address(self, entry):
     assert entry in self._bbox
     a = 0
@@ -126,17 +137,67 @@ class DenseMemoryLayout(MemoryLayout):
       a += (e - self._bbox[i].start) * self._stride[i]
     return a
 
+  def addresses(self, entries):
+    addr = np.zeros(len(entries[0]) if len(entries) > 0 else 1, dtype=int)
+    for i, e in enumerate(entries):
+      e = np.asarray(e, dtype=int)
+      assert np.all((e >= self._bbox[i].start) & (e < self._bbox[i].stop))
+      addr += (e - self._bbox[i].start) * self._stride[i]
+    return addr
+
   def subtensorOffset(self, topLeftEntry):
     return self.address(topLeftEntry)
   
-  def notWrittenAddresses(self, writeBB):
+  def notWrittenIntervals(self, writeBB):
+    """Returns maximal address intervals [start, stop) of the entries in the
+    bounding box which are not in writeBB, in ascending order."""
     if writeBB == self._bbox:
       return []
 
     assert writeBB in self._bbox
-    re = [range(r.start, r.stop) for r in self._bbox]
-    we = [range(w.start, w.stop) for w in writeBB]
-    return [self.address(e) for e in set(itertools.product(*re)) - set(itertools.product(*we))]
+    n = len(self._bbox)
+    # contiguous[d] is true if the entries of dimensions 0..d form a contiguous block
+    contiguous = list()
+    for d in range(n):
+      if d == 0:
+        contiguous.append(self._stride[0] == 1)
+      else:
+        contiguous.append(contiguous[d-1] and self._stride[d] == self._stride[d-1] * self._bbox[d-1].size())
+
+    intervals = list()
+    def block(d, base, start, stop):
+      # All entries with index start <= i < stop in dimension d
+      r = self._bbox[d]
+      if contiguous[d]:
+        intervals.append((base + (start - r.start) * self._stride[d], base + (stop - r.start) * self._stride[d]))
+        return
+      for i in range(start, stop):
+        offset = base + (i - r.start) * self._stride[d]
+        if d == 0:
+          intervals.append((offset, offset + 1))
+        else:
+          block(d-1, offset, self._bbox[d-1].start, self._bbox[d-1].stop)
+
+    def subtract(d, base):
+      r = self._bbox[d]
+      w = writeBB[d]
+      block(d, base, r.start, w.start)
+      if d > 0:
+        for i in range(w.start, w.stop):
+          subtract(d-1, base + (i - r.start) * self._stride[d])
+      block(d, base, w.stop, r.stop)
+
+    subtract(n-1, 0)
+    merged = list()
+    for start, stop in sorted(interval for interval in intervals if interval[0] < interval[1]):
+      if merged and merged[-1][1] == start:
+        merged[-1] = (merged[-1][0], stop)
+      else:
+        merged.append((start, stop))
+    return merged
+
+  def notWrittenAddresses(self, writeBB):
+    return [address for start, stop in self.notWrittenIntervals(writeBB) for address in range(start, stop)]
 
   def stride(self):
     return self._stride
@@ -272,22 +333,13 @@ class CSCMemoryLayout(MemoryLayout):
     
     self._bbox = BoundingBox.fromSpp(spp)
     
-    nonzeros = spp.nonzero()
-    nonzeros = sorted(zip(nonzeros[0], nonzeros[1]), key=lambda x: (x[1], x[0]))
-    
-    self._rowIndex = np.ndarray(shape=(len(nonzeros),), dtype=int)
-    self._colPtr = np.ndarray(shape=(self._shape[1]+1,), dtype=int)
+    rows, cols = spp.nonzero()
+    order = np.lexsort((rows, cols))
     
-    lastCol = 0
-    self._colPtr[0] = 0
-    for i,entry in enumerate(nonzeros):
-      self._rowIndex[i] = entry[0]
-      if entry[1] != lastCol:
-        for j in range(lastCol+1, entry[1]+1):
-          self._colPtr[ j ] = i
-        lastCol = entry[1]
-    for j in range(lastCol+1, self._shape[1]+1):
-      self._colPtr[j] = len(nonzeros)
+    self._rowIndex = np.asarray(rows, dtype=int)[order]
+    self._colPtr = np.zeros(self._shape[1]+1, dtype=int)
+    np.cumsum(np.bincount(cols, minlength=self._shape[1]), out=self._colPtr[1:])
+    self._keys = None
 
   def requiredReals(self):
     return len(self._rowIndex)
@@ -307,12 +359,31 @@ class CSCMemoryLayout(MemoryLayout):
     start = self._colPtr[ entry[1] ]
     stop = self._colPtr[ entry[1]+1 ]
     subRowInd = self._rowIndex[start:stop]
- 
-    find = np.where(subRowInd == entry[0])[0]
-    assert len(find) == 1
 
-    return start + find[0]
-  
+    find = np.searchsorted(subRowInd, entry[0])
+    assert find < len(subRowInd) and subRowInd[find] == entry[0]
+
+    return start + find
+
+  def storedEntries(self):
+    """Coordinates of the stored values in storage order, one index array per dimension."""
+    return (self._rowIndex, np.repeat(np.arange(self._shape[1]), np.diff(self._colPtr)))
+
+  def _sortedKeys(self):
+    # Linearized (col, row) of the stored entries, which are ascending by construction
+    if self._keys is None:
+      rows, cols = self.storedEntries()
+      self._keys = cols * self._shape[0] + rows
+    return self._keys
+
+  def addresses(self, entries):
+    rows, cols = (np.asarray(e, dtype=int) for e in entries)
+    keys = self._sortedKeys()
+    queries = cols * self._shape[0] + rows
+    addr = np.searchsorted(keys, queries)
+    assert np.all(addr < len(keys)) and np.array_equal(keys[np.minimum(addr, len(keys)-1)], queries)
+    return addr
+
   def subtensorOffset(self, topLeftEntry):
     assert topLeftEntry in self._bbox
     assert topLeftEntry[0] <= self._bbox[0].start
@@ -320,10 +391,11 @@ class CSCMemoryLayout(MemoryLayout):
 
   def entries(self, rowRange, colRange):
     assert self._bbox[0].start >= rowRange.start
-    e = list()
-    for col in colRange:
-      e.extend([(self._rowIndex[i]-rowRange.start, col-colRange.start) for i in range(self._colPtr[col], self._colPtr[col+1])])
-    return e
+    start = self._colPtr[colRange.start]
+    stop = self._colPtr[colRange.stop]
+    rows = self._rowIndex[start:stop] - rowRange.start
+    cols = np.repeat(np.arange(colRange.size()), np.diff(self._colPtr[colRange.start:colRange.stop+1]))
+    return list(zip(rows, cols.tolist()))
 
   def alignedStride(self):
     return False
@@ -350,4 +422,333 @@ class CSCMemoryLayout(MemoryLayout):
             f"bbox={self._bbox}, "
             f"rowIndex_size={len(self._rowIndex)}, "
             f"colPtr_size={len(self._colPtr)})"
-          )
\ No newline at end of file
+          )
+
+
+class CSFMemoryLayout(MemoryLayout):
+  """Compressed sparse fiber layout for tensors of arbitrary order.
+
+  The fiber tree is rooted at the last dimension and its leaves are the first
+  dimension, such that values are stored in column-major order of the nonzeros.
+  """
+  def __init__(self, spp):
+    super().__init__(spp.shape)
+
+    if len(self._shape) == 0:
+      raise ValueError('CSFMemoryLayout may not be used for scalars.')
+
+    self._bbox = BoundingBox.fromSpp(spp)
+
+    nonzeros = spp.nonzero()
+    self._keys = np.ravel_multi_index(nonzeros, self._shape, order='F') if len(nonzeros[0]) > 0 else np.zeros(0, dtype=int)
+    order = np.argsort(self._keys, kind='stable')
+    self._keys = self._keys[order]
+    self._entries = tuple(np.asarray(nz, dtype=int)[order] for nz in nonzeros)
+
+    # A node at level l starts wherever one of the dimensions N-1, ..., N-1-l changes
+    nnz = len(self._keys)
+    newNode = np.zeros(nnz, dtype=bool)
+    if nnz > 0:
+      newNode[0] = True
+    positions = list()
+    for dim in reversed(range(len(self._shape))):
+      newNode[1:] |= np.diff(self._entries[dim]) != 0
+      positions.append(np.flatnonzero(newNode))
+    self._fiberIdx = [self._entries[len(self._shape)-1-level][pos] for level, pos in enumerate(positions)]
+    self._fiberPtr = [np.append(np.searchsorted(child, parent), len(child)) for parent, child in zip(positions[:-1], positions[1:])]
+
+  def requiredReals(self):
+    return len(self._keys)
+
+  def bboxi(self, dim):
+    return self._bbox[dim]
+
+  def storedEntries(self):
+    """Coordinates of the stored values in storage order, one index array per dimension."""
+    return self._entries
+
+  def fiberIndices(self):
+    """Fiber indices of all levels, concatenated from root to leaves."""
+    return np.concatenate(self._fiberIdx)
+
+  def fiberPointer(self):
+    """Child pointers of all inner levels, concatenated from root to leaves."""
+    return np.concatenate(self._fiberPtr) if len(self._fiberPtr) > 0 else np.zeros(0, dtype=int)
+
+  def numberOfRoots(self):
+    return len(self._fiberIdx[0])
+
+  def address(self, entry):
+    assert entry in self._bbox
+    key = np.ravel_multi_index(tuple(entry), self._shape, order='F')
+    find = np.searchsorted(self._keys, key)
+    assert find < len(self._keys) and self._keys[find] == key
+    return int(find)
+
+  def addresses(self, entries):
+    queries = np.ravel_multi_index(tuple(np.asarray(e, dtype=int) for e in entries), self._shape, order='F')
+    addr = np.searchsorted(self._keys, queries)
+    assert np.all(addr < len(self._keys)) and np.array_equal(self._keys[np.minimum(addr, len(self._keys)-1)], queries)
+    return addr
+
+  def subtensorOffset(self, topLeftEntry):
+    assert topLeftEntry in self._bbox
+    return int(np.searchsorted(self._keys, np.ravel_multi_index(tuple(topLeftEntry), self._shape, order='F')))
+
+  def alignedStride(self):
+    return False
+
+  def mayVectorizeDim(self, dim):
+    return False
+
+  @classmethod
+  def fromSpp(cls, spp, **kwargs):
+    return CSFMemoryLayout(spp)
+
+  def __contains__(self, entry):
+    return entry in self._bbox
+
+  def isCompatible(self, spp):
+    return self.fromSpp(spp) == self
+
+  def __eq__(self, other):
+    return isinstance(other, CSFMemoryLayout) and self._shape == other._shape and np.array_equal(self._keys, other._keys)
+
+  def __str__(self):
+    return ("CSFMemoryLayout("
+            f"shape={self._shape}, "
+            f"bbox={self._bbox}, "
+            f"nnz={len(self._keys)}, "
+            f"fibers={[len(f) for f in self._fiberIdx]})"
+          )
+
+
+class BlockSparseMemoryLayout(MemoryLayout):
+  """Stores only the nonzero blocks of a matrix.
+
+  Blocks are disjoint rectangles given as ((rowStart, rowStop), (colStart, colStop)).
+  Every block is stored dense in column-major order; blocks are ordered by
+  column, then row. If the blocks are a tiling of blockShape, blockShape is kept
+  such that a changed sparsity pattern is tiled alike.
+  """
+  BLOCK_SHAPE = (8, 8)
+
+  def __init__(self, shape, blocks, blockShape=None):
+    super().__init__(shape)
+    self._blockShape = blockShape
+
+    if len(self._shape) != 2:
+      raise ValueError('BlockSparseMemoryLayout may only be used for matrices.')
+
+    blocks = np.array(blocks, dtype=int).reshape(-1, 2, 2)
+    self._blocks = blocks[np.lexsort((blocks[:,0,0], blocks[:,1,0]))] if len(blocks) > 0 else blocks
+
+    starts = self._blocks[:,:,0]
+    stops = self._blocks[:,:,1]
+    if np.any(starts < 0) or np.any(stops > np.array(self._shape)) or np.any(stops <= starts):
+      raise ValueError('Blocks must be non-empty and lie within the shape {}.'.format(self._shape))
+
+    self._blockId = np.full(self._shape, -1, dtype=int)
+    for b, ((r0, r1), (c0, c1)) in enumerate(self._blocks):
+      if np.any(self._blockId[r0:r1, c0:c1] >= 0):
+        raise ValueError('Blocks must not overlap.')
+      self._blockId[r0:r1, c0:c1] = b
+
+    self._blockPtr = np.concatenate(([0], np.cumsum(np.prod(stops - starts, axis=1)))).astype(int)
+    if len(self._blocks) > 0:
+      self._bbox = BoundingBox([Range(int(starts[:,d].min()), int(stops[:,d].max())) for d in range(2)])
+    else:
+      self._bbox = BoundingBox([Range(0, 0), Range(0, 0)])
+
+  def requiredReals(self):
+    return int(self._blockPtr[-1])
+
+  def numberOfBlocks(self):
+    return len(self._blocks)
+
+  def blocks(self):
+    """Returns (rows, cols, offset) for each stored block."""
+    return [(Range(int(r0), int(r1)), Range(int(c0), int(c1)), int(offset)) for ((r0, r1), (c0, c1)), offset in zip(self._blocks, self._blockPtr)]
+
+  def blockPointer(self):
+    return self._blockPtr
+
+  def blockRows(self):
+    return self._blocks[:,0,:].flatten()
+
+  def blockCols(self):
+    return self._blocks[:,1,:].flatten()
+
+  def blockLayout(self, rows, cols):
+    """Dense layout of a single block, addressed in the coordinates of the whole matrix."""
+    return DenseMemoryLayout(self._shape, BoundingBox([Range(rows.start, rows.stop), Range(cols.start, cols.stop)]))
+
+  def bboxi(self, dim):
+    return self._bbox[dim]
+
+  def address(self, entry):
+    assert entry in self._bbox
+    b = self._blockId[entry[0], entry[1]]
+    assert b >= 0
+    (r0, r1), (c0, _) = self._blocks[b]
+    return int(self._blockPtr[b] + (entry[0] - r0) + (entry[1] - c0) * (r1 - r0))
+
+  def addresses(self, entries):
+    rows, cols = (np.asarray(e, dtype=int) for e in entries)
+    b = self._blockId[rows, cols]
+    assert np.all(b >= 0)
+    blocks = self._blocks[b]
+    return self._blockPtr[b] + (rows - blocks[:,0,0]) + (cols - blocks[:,1,0]) * (blocks[:,0,1] - blocks[:,0,0])
+
+  def subtensorOffset(self, topLeftEntry):
+    return self.address(topLeftEntry)
+
+  def alignedStride(self):
+    return False
+
+  def mayVectorizeDim(self, dim):
+    return False
+
+  @classmethod
+  def fromSpp(cls, spp, blocks=None, blockShape=None, **kwargs):
+    """Tiles spp with blocks of blockShape and keeps the nonzero tiles, unless explicit blocks are given."""
+    if blocks is None:
+      bm, bn = blockShape if blockShape is not None else cls.BLOCK_SHAPE
+      rows, cols = spp.shape
+      nz = np.zeros((-(-rows // bm) * bm, -(-cols // bn) * bn), dtype=bool)
+      nz[:rows, :cols] = spp.as_ndarray()
+      tiles = nz.reshape(nz.shape[0] // bm, bm, nz.shape[1] // bn, bn).any(axis=(1, 3))
+      blocks = [((i*bm, min((i+1)*bm, rows)), (j*bn, min((j+1)*bn, cols))) for i, j in zip(*np.nonzero(tiles))]
+      layout = cls(spp.shape, blocks, blockShape=(bm, bn))
+    else:
+      layout = cls(spp.shape, blocks)
+    if not layout.isCompatible(spp):
+      raise ValueError('The blocks do not cover all nonzeros of the sparsity pattern.')
+    return layout
+
+  def __contains__(self, entry):
+    return entry in self._bbox
+
+  def fromSppKwargs(self):
+    if self._blockShape is not None:
+      return {'blockShape': self._blockShape}
+    return {'blocks': self._blocks.tolist()}
+
+  def isCompatible(self, spp):
+    if spp.shape != self._shape:
+      return False
+    return bool(np.all(self._blockId[spp.nonzero()] >= 0))
+
+  def __eq__(self, other):
+    return isinstance(other, BlockSparseMemoryLayout) and self._shape == other._shape and np.array_equal(self._blocks, other._blocks)
+
+  def __str__(self):
+    return ("BlockSparseMemoryLayout("
+            f"shape={self._shape}, "
+            f"bbox={self._bbox}, "
+            f"blocks={len(self._blocks)}, "
+            f"size={self.requiredReals()})"
+          )
+
+
+class BandedMemoryLayout(MemoryLayout):
+  """Stores the diagonals of a banded matrix.
+
+  Diagonal d contains the entries (i, i+d) for lower >= -d and d <= upper.
+  Diagonals are stored contiguously one after another, starting with d = -lower.
+  """
+  def __init__(self, shape, lower, upper):
+    super().__init__(shape)
+
+    if len(self._shape) != 2:
+      raise ValueError('{} may only be used for matrices.'.format(type(self).__name__))
+
+    rows, cols = self._shape
+    if lower < 0 or upper < 0 or lower >= rows or upper >= cols:
+      raise ValueError('Invalid bandwidths {} and {} for shape {}.'.format(lower, upper, self._shape))
+
+    self._lower = lower
+    self._upper = upper
+    self._bbox = BoundingBox([Range(0, min(rows, cols + lower)), Range(0, min(cols, rows + upper))])
+
+    d = np.arange(-lower, upper+1)
+    self._start = np.maximum(0, -d)
+    self._length = np.minimum(rows, cols - d) - self._start
+    self._offset = np.concatenate(([0], np.cumsum(self._length)))
+
+  def requiredReals(self):
+    return int(self._offset[-1])
+
+  def bandwidths(self):
+    return (self._lower, self._upper)
+
+  def diagonals(self):
+    """Returns (d, startRow, length, offset) for each stored diagonal."""
+    return [(int(d), int(start), int(length), int(offset)) for d, start, length, offset in zip(range(-self._lower, self._upper+1), self._start, self._length, self._offset)]
+
+  def bboxi(self, dim):
+    return self._bbox[dim]
+
+  def address(self, entry):
+    d = entry[1] - entry[0]
+    assert -self._lower <= d <= self._upper
+    k = d + self._lower
+    return int(self._offset[k] + entry[0] - self._start[k])
+
+  def addresses(self, entries):
+    rows, cols = (np.asarray(e, dtype=int) for e in entries)
+    k = cols - rows + self._lower
+    assert np.all((k >= 0) & (k <= self._lower + self._upper))
+    return self._offset[k] + rows - self._start[k]
+
+  def subtensorOffset(self, topLeftEntry):
+    return self.address(topLeftEntry)
+
+  def alignedStride(self):
+    return False
+
+  def mayVectorizeDim(self, dim):
+    return False
+
+  @staticmethod
+  def bandwidthsOf(spp):
+    rows, cols = spp.nonzero()
+    if len(rows) == 0:
+      return (0, 0)
+    return (max(0, int(np.max(rows - cols))), max(0, int(np.max(cols - rows))))
+
+  @classmethod
+  def fromSpp(cls, spp, **kwargs):
+    return cls(spp.shape, *cls.bandwidthsOf(spp))
+
+  def __contains__(self, entry):
+    return entry in self._bbox
+
+  def isCompatible(self, spp):
+    if spp.shape != self._shape:
+      return False
+    lower, upper = self.bandwidthsOf(spp)
+    return lower <= self._lower and upper <= self._upper
+
+  def __eq__(self, other):
+    return type(self) == type(other) and self._shape == other._shape and self.bandwidths() == other.bandwidths()
+
+  def __str__(self):
+    return ("{}("
+            f"shape={self._shape}, "
+            f"lower={self._lower}, "
+            f"upper={self._upper}, "
+            f"size={self.requiredReals()})"
+          ).format(type(self).__name__)
+
+
+class DiagonalMemoryLayout(BandedMemoryLayout):
+  """Stores only the main diagonal of a matrix."""
+  def __init__(self, shape):
+    super().__init__(shape, 0, 0)
+
+  @classmethod
+  def fromSpp(cls, spp, **kwargs):
+    if cls.bandwidthsOf(spp) != (0, 0):
+      raise ValueError('The sparsity pattern is not diagonal.')
+    return cls(spp.shape)
@@ -120,8 +120,8 @@ class Tensor(IdentifiedType):
     
     self.setMemoryLayout(memoryLayoutClass, alignStride)
 
-  def setMemoryLayout(self, memoryLayoutClass, alignStride=False):
-    self._memoryLayout = memoryLayoutClass.fromSpp(self._groupSpp, alignStride=alignStride)
+  def setMemoryLayout(self, memoryLayoutClass, alignStride=False, **kwargs):
+    self._memoryLayout = memoryLayoutClass.fromSpp(self._groupSpp, alignStride=alignStride, **kwargs)
 
   def _setSparsityPattern(self, spp, setOnlyGroupSpp=False):
     if spp.shape != self._shape:
@@ -133,7 +133,7 @@ class Tensor(IdentifiedType):
 
   def setGroupSpp(self, spp):
     self._setSparsityPattern(spp, setOnlyGroupSpp=True)
-    self.setMemoryLayout(self._memoryLayout.__class__, alignStride=self._memoryLayout.alignedStride())
+    self.setMemoryLayout(self._memoryLayout.__class__, **self._memoryLayout.fromSppKwargs())
 
   def __getitem__(self, indexNames):
     return IndexedTensor(self, indexNames)
@@ -182,6 +182,13 @@ class Tensor(IdentifiedType):
   def __repr__(self):
     return self.__str__()
 
+class FoldedTensor(Tensor):
+  """Constant tensor whose values are computed at generation time (see FoldConstantExpressions).
+
+  Kernels initialize folded tensors with their values, thus, they need not be set by the user.
+  """
+  pass
+
 class Collection(object):
   def update(self, collection):
     self.__dict__.update(collection.__dict__)